@@ -1538,31 +1538,19 @@ async def load_heroku_module(client, file_path: str | Path, chat_id: int = None)
             _out_kw = {k: v for k, v in handler_kwargs.items()
                        if k not in ("incoming", "outgoing", "from_users")}
             _out_kw["outgoing"] = True
-            client.add_event_handler(_wrap_html_handler(func), events.NewMessage(**_out_kw))
+            # Команды старого стиля (<cmd>cmd без декоратора) метрики ещё не оборачивали
+            from compat.loader import _timed_command
+            _wrapped = _wrap_html_handler(_timed_command(func, cmd))
+            _loader_mod.add_command_route(client, f"heroku:{mod_name}", cmd, _wrapped,
+                                          events.NewMessage(**_out_kw))
 
             # 2. Входящие от trusted пользователей
-            def _make_trusted_filter():
-                from utils import database as _db2
-                def _is_trusted(ev):
-                    try:
-                        # Telethon иногда передаёт сырой update-объект до оборачивания
-                        # в NewMessage — у него нет sender_id / message.out
-                        msg = getattr(ev, "message", ev)
-                        if not hasattr(msg, "out"):
-                            return False
-                        sid = getattr(ev, "sender_id", None) or getattr(msg, "sender_id", None)
-                        if sid is None:
-                            return False
-                        return _db2.get_user_level(sid) in ("OWNER", "TRUSTED")
-                    except Exception:
-                        return False
-                return _is_trusted
-
             _in_kw = {k: v for k, v in handler_kwargs.items()
                       if k not in ("incoming", "outgoing", "from_users")}
             _in_kw["incoming"] = True
-            _in_kw["func"] = _make_trusted_filter()
-            client.add_event_handler(_wrap_html_handler(func), events.NewMessage(**_in_kw))
+            _in_kw["func"] = _loader_mod._trusted_filter
+            _loader_mod.add_command_route(client, f"heroku:{mod_name}", cmd, _wrapped,
+                                          events.NewMessage(**_in_kw))
 
             if cmd not in _COMMANDS:
                 _COMMANDS[cmd] = []
@@ -1586,6 +1574,7 @@ async def load_heroku_module(client, file_path: str | Path, chat_id: int = None)
         if getattr(func, "_is_watcher", False):
             wkw = func._watcher_kwargs.copy()
             ev = wkw.pop("event", None)
+            w_timeout = wkw.pop("timeout", None)
             if ev is None:
                 # chat_id= не поддерживается в NewMessage, конвертируем в chats=
                 if "chat_id" in wkw:
@@ -1595,7 +1584,9 @@ async def load_heroku_module(client, file_path: str | Path, chat_id: int = None)
                 except Exception as _we:
                     logger.warning(f"[compat] watcher kwargs error in {mod_name}: {_we}, skipping")
                     continue
-            client.add_event_handler(_wrap_html_handler(func), ev)
+            _wrapped_w = _wrap_html_handler(func)
+            if not _loader_mod.add_watcher_route(client, f"heroku:{mod_name}", _wrapped_w, ev, w_timeout):
+                client.add_event_handler(_wrapped_w, ev)
 
         # ── Callback-кнопки ──────────────────────────────────────────────
         # Автодетект по суффиксу: Hikka соглашение — метод *_callback_handler
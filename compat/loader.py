@@ -203,6 +203,34 @@ def inline_handler(**kwargs):
     return decorator
 
 
+def _timed_command(func, cmd_name: str):
+    """Обёртка команды для utils.metrics: время выполнения и исключения (исключение пробрасывается дальше)."""
+    import functools
+    import time as _time
+    from utils import metrics as _metrics
+
+    if not inspect.iscoroutinefunction(func) or getattr(func, "_metrics_timed", False):
+        return func
+    module_label = _metrics.module_label(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = _time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            _metrics.observe(module_label, cmd_name, _time.perf_counter() - started, error=True)
+            raise
+        _metrics.observe(module_label, cmd_name, _time.perf_counter() - started)
+        return result
+
+    for _attr in ("_is_command", "_command_name", "_command_kwargs", "_command_doc"):
+        if hasattr(func, _attr):
+            setattr(wrapper, _attr, getattr(func, _attr))
+    wrapper._metrics_timed = True
+    return wrapper
+
+
 def command(alias: str = None, **kwargs):
     """
     @loader.command()  — маркирует метод как команду.
@@ -225,7 +253,7 @@ def command(alias: str = None, **kwargs):
                 or func.__doc__
                 or "")
         func._command_doc = _doc.strip()
-        return func
+        return _timed_command(func, cmd_name)
 
     # Поддерживаем @loader.command без скобок
     if callable(alias):
@@ -394,13 +422,21 @@ def inline_everyone(func):
 def ratelimit(func):
     """
     @loader.ratelimit — ограничение частоты вызовов (FTG/Heroku-совместимость).
-    В KoteLoader не реализует реальный рейтлимит — просто pass-through,
-    чтобы модули с этим декоратором не падали при импорте.
+    Token bucket на отправителя (кроме собственных исходящих) и на саму команду,
+    см. utils/ratelimit.py. Лишние вызовы не отбрасываются, а ждут своей очереди.
     """
     import functools
+    from utils import ratelimit as _rl
+
+    _command_key = f"{getattr(func, '__module__', '')}.{getattr(func, '__qualname__', func)}"
 
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
+        # Сообщение — первый аргумент, похожий на событие (self идёт раньше у методов)
+        message = next((a for a in args if hasattr(a, "sender_id")), None)
+        if message is not None and not getattr(message, "out", False):
+            await _rl.acquire("user", getattr(message, "sender_id", None))
+        await _rl.acquire("command", _command_key)
         return await func(*args, **kwargs)
 
     for _attr in ("_is_command", "_is_watcher", "_is_callback_handler",
@@ -1647,11 +1683,12 @@ class Module:
 class _StorageFetcher:
     """
     Эмулирует lm._storage из Hikka.
-    Реально скачивает исходный код модуля по URL через aiohttp.
+    Реально скачивает исходный код модуля по URL через общий HTTP-клиент (utils/http.py).
     """
 
     async def fetch(self, url: str, auth=None) -> str:
         import aiohttp
+        from utils import http as _http
         logger.info(f"[compat] StorageFetcher.fetch: downloading {url!r}")
         headers = {}
         if auth:
@@ -1660,12 +1697,9 @@ class _StorageFetcher:
             headers["Authorization"] = f"Basic {encoded}"
         timeout = aiohttp.ClientTimeout(total=30)
         try:
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(url, headers=headers) as resp:
-                    resp.raise_for_status()
-                    text = await resp.text()
-                    logger.info(f"[compat] StorageFetcher.fetch: OK, {len(text)} chars")
-                    return text
+            text = await _http.fetch_text(url, headers=headers, timeout=timeout)
+            logger.info(f"[compat] StorageFetcher.fetch: OK, {len(text)} chars")
+            return text
         except Exception as _fe:
             logger.warning(f"[compat] StorageFetcher.fetch FAILED: {_fe}")
             raise
@@ -1880,6 +1914,8 @@ class _AllModules:
                     self._client.remove_event_handler(_func, _handler)
                 except Exception:
                     pass
+            from utils.loader import remove_watcher_routes
+            remove_watcher_routes(_old_key)
             # Убираем из реестра команд
             from utils.loader import COMMANDS_REGISTRY as _CR
             for _cmd in list(_CR):
@@ -2248,7 +2284,10 @@ class _AllModules:
                                     "from_users", "forwards", "pattern", "func"}
                 hkw = {k: v for k, v in func._command_kwargs.items() if k in _VALID_NM_KWARGS}
                 hkw["pattern"] = pattern
-                self._client.add_event_handler(func, events.NewMessage(**hkw))
+                from utils.loader import add_command_route
+                # Команды старого стиля (<cmd>cmd без декоратора) метрики ещё не оборачивали
+                add_command_route(self._client, f"heroku:{mod_name}", cmd, _timed_command(func, cmd),
+                                  events.NewMessage(**hkw))
                 if cmd not in COMMANDS_REGISTRY:
                     COMMANDS_REGISTRY[cmd] = []
                 _doc_str = getattr(func, '_command_doc', '') or ''
@@ -2266,6 +2305,7 @@ class _AllModules:
             if getattr(func, "_is_watcher", False):
                 wkw = func._watcher_kwargs.copy()
                 ev = wkw.pop("event", None)
+                w_timeout = wkw.pop("timeout", None)
                 if ev is None:
                     if "chat_id" in wkw:
                         wkw["chats"] = wkw.pop("chat_id")
@@ -2285,7 +2325,9 @@ class _AllModules:
                     except Exception as _we:
                         logger.warning(f"[compat] register_module watcher error {mod_name}: {_we}")
                         continue
-                self._client.add_event_handler(func, ev)
+                from utils.loader import add_watcher_route
+                if not add_watcher_route(self._client, f"heroku:{mod_name}", func, ev, w_timeout):
+                    self._client.add_event_handler(func, ev)
 
             if getattr(func, "_is_callback_handler", False):
                 import re as _re2
@@ -2408,6 +2450,9 @@ class _AllModules:
 
         # Чистим реестры команд
         mod_label = target_key  # "heroku:ModName"
+        from utils.loader import remove_command_routes, remove_watcher_routes
+        remove_command_routes(mod_label)
+        remove_watcher_routes(mod_label)
         for cmd in list(COMMANDS_REGISTRY):
             COMMANDS_REGISTRY[cmd] = [c for c in COMMANDS_REGISTRY[cmd]
                                       if c.get("module") != mod_label]
@@ -2597,6 +2642,15 @@ class _LoaderModuleStub:
 class _Utils:
     """Эмуляция utils из Heroku/Hikka."""
 
+    @staticmethod
+    async def get_http_session():
+        """
+        Общая aiohttp-сессия загрузчика (keep-alive, кэш DNS, лимиты на хост).
+        Закрывать её не нужно — она живёт до завершения процесса.
+        """
+        from utils import http as _http
+        return await _http.get_session()
+
     @staticmethod
     def escape_html(text: Any) -> str:
         return html.escape(str(text))
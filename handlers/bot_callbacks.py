@@ -14,15 +14,14 @@ from telethon.tl.types import InputBotInlineResult
 
 from utils import database as db
 from utils.loader import (
-    INLINE_HANDLERS_REGISTRY, CALLBACK_REGISTRY,
-    load_module, unload_module, reload_module, check_module_dependencies
+    INLINE_HANDLERS_REGISTRY, CALLBACK_REGISTRY, check_module_dependencies, in_use
 )
 from panels.main_panel import build_main_panel
 from panels.module_menu import build_module_menu
 from panels.global_menu import build_global_menu
 from panels.updates_panel import build_updates_panel
-from services.state_manager import update_state_file
-from modules.updater import check_for_updates
+from workers.command_worker import run_command
+from modules.updater import check_for_updates, refresh_updates_cache, get_cached_updates
 
 
 class _HtmlCallProxy:
@@ -378,9 +377,10 @@ async def updates_callback_handler(event):
     report_chat_id = event.chat_id
 
     if action == "all":
-        from modules.updater import check_for_updates
-        
-        updates = await check_for_updates()
+        # Список уже есть в кэше панели — .update всё равно перепроверит каждый модуль
+        updates, _ = get_cached_updates()
+        if updates is None:
+            updates = await check_for_updates()
         modules_to_update = [u["module_name"] for u in updates]
 
         for module_name in modules_to_update:
@@ -523,10 +523,15 @@ async def inline_query_handler(event: events.InlineQuery):
 
         if query_text == "updates:check":
             
-            text = "⚙️ <b>Центр обновлений</b>\n\nНажмите кнопку ниже, чтобы запустить поиск обновлений для ваших модулей."
-            buttons = [
-                [Button.inline("🔄 Начать проверку", data="run_updates_check")]
-            ]
+            cached_updates, checked_at = get_cached_updates()
+            if checked_at:
+                # Результат фоновой проверки — показываем сразу
+                text, buttons = build_updates_panel(cached_updates, checked_at)
+            else:
+                text = "⚙️ <b>Центр обновлений</b>\n\nНажмите кнопку ниже, чтобы запустить поиск обновлений для ваших модулей."
+                buttons = [
+                    [Button.inline("🔄 Начать проверку", data="run_updates_check")]
+                ]
             
             result = event.builder.article(
                 title="Центр обновлений",
@@ -567,54 +572,56 @@ async def inline_query_handler(event: events.InlineQuery):
         for pattern, handler_info in list(INLINE_HANDLERS_REGISTRY.items()):
             match = pattern.match(query_text)
             if match:
-                # Одноразовый обработчик (для inline.form) — удаляем после вызова
-                if handler_info.get("_one_shot"):
-                    INLINE_HANDLERS_REGISTRY.pop(pattern, None)
-                # ── Raw handler: прямой вызов с Telethon InlineQuery event ─
-                if handler_info.get("_raw_handler"):
-                    try:
-                        await handler_info["func"](event)
-                    except Exception:
-                        traceback.print_exc()
-                    return
-                # ── Hikka-стиль: функция принимает query-объект ─────────
-                if handler_info.get("hikka_style"):
-                    # args = всё что идёт после имени обработчика (напр. "fheta foo bar" → "foo bar")
-                    _prefix = handler_info.get("prefix", "")
-                    _args = query_text[len(_prefix):].lstrip() if _prefix else query_text
-                    query_obj = _HikkaQueryWrapper(event, query_text, _args)
-                    try:
-                        ret = await handler_info["func"](query_obj)
-                    except Exception:
-                        traceback.print_exc()
+                # Пока обработчик выполняется, TTL ленивых модулей его модуль не выгрузит
+                with in_use(handler_info["func"]):
+                    # Одноразовый обработчик (для inline.form) — удаляем после вызова
+                    if handler_info.get("_one_shot"):
+                        INLINE_HANDLERS_REGISTRY.pop(pattern, None)
+                    # ── Raw handler: прямой вызов с Telethon InlineQuery event ─
+                    if handler_info.get("_raw_handler"):
+                        try:
+                            await handler_info["func"](event)
+                        except Exception:
+                            traceback.print_exc()
                         return
-                    # Если функция вернула dict — оборачиваем в один Article сами
-                    if isinstance(ret, dict):
-                        from telethon.tl.types import (
-                            InputBotInlineResultArticle,
-                            InputBotInlineMessageText,
-                        )
-                        _msg = ret.get("message", ret.get("title", ""))
-                        _thumb = ret.get("thumb", "")
-                        result = event.builder.article(
-                            title=ret.get("title", ""),
-                            description=ret.get("description", ""),
-                            text=_msg,
-                            parse_mode="html",
-                        )
-                        await event.answer([result], cache_time=0)
-                    # None → функция сама вызвала answer(), ничего не делаем
+                    # ── Hikka-стиль: функция принимает query-объект ─────────
+                    if handler_info.get("hikka_style"):
+                        # args = всё что идёт после имени обработчика (напр. "fheta foo bar" → "foo bar")
+                        _prefix = handler_info.get("prefix", "")
+                        _args = query_text[len(_prefix):].lstrip() if _prefix else query_text
+                        query_obj = _HikkaQueryWrapper(event, query_text, _args)
+                        try:
+                            ret = await handler_info["func"](query_obj)
+                        except Exception:
+                            traceback.print_exc()
+                            return
+                        # Если функция вернула dict — оборачиваем в один Article сами
+                        if isinstance(ret, dict):
+                            from telethon.tl.types import (
+                                InputBotInlineResultArticle,
+                                InputBotInlineMessageText,
+                            )
+                            _msg = ret.get("message", ret.get("title", ""))
+                            _thumb = ret.get("thumb", "")
+                            result = event.builder.article(
+                                title=ret.get("title", ""),
+                                description=ret.get("description", ""),
+                                text=_msg,
+                                parse_mode="html",
+                            )
+                            await event.answer([result], cache_time=0)
+                        # None → функция сама вызвала answer(), ничего не делаем
+                        return
+                    # ── Старый стиль: func → (text, buttons) ────────────────
+                    event.pattern_match = match
+                    text, buttons = await handler_info["func"](event)
+                    result = event.builder.article(
+                        title=handler_info["title"],
+                        description=handler_info["description"],
+                        text=text, buttons=buttons, parse_mode="html"
+                    )
+                    await event.answer([result])
                     return
-                # ── Старый стиль: func → (text, buttons) ────────────────
-                event.pattern_match = match
-                text, buttons = await handler_info["func"](event)
-                result = event.builder.article(
-                    title=handler_info["title"],
-                    description=handler_info["description"],
-                    text=text, buttons=buttons, parse_mode="html"
-                )
-                await event.answer([result])
-                return
 
         text, buttons = build_main_panel(search_query=query_text, as_text=True, user_client=getattr(event.client, "user_client", None))
         result = event.builder.article(
@@ -675,8 +682,9 @@ async def callback_query_handler(event: events.CallbackQuery):
             
         if data == "run_updates_check":
             await event.answer("🔄 Ищу обновления...", alert=False)
-            updates_list = await check_for_updates()
-            text, buttons = build_updates_panel(updates_list)
+            updates_list = await refresh_updates_cache(getattr(event.client, "user_client", None))
+            _, checked_at = get_cached_updates()
+            text, buttons = build_updates_panel(updates_list, checked_at)
             await event.edit(text, buttons=buttons, parse_mode="html")
             return
         
@@ -802,51 +810,28 @@ async def callback_query_handler(event: events.CallbackQuery):
                 import logging as _mlog
                 _mlog.getLogger("bot_callbacks").info(f"[callback] matched pattern={_pat_str!r} handler={handler_func.__name__!r}")
                 try:
-                    await handler_func(_HtmlCallProxy(event))
+                    with in_use(handler_func):
+                        await handler_func(_HtmlCallProxy(event))
                 except Exception as _hex:
                     _mlog.getLogger("bot_callbacks").error(f"[callback] EXCEPTION in {handler_func.__name__!r}: {_hex}", exc_info=True)
                 return
 
         text, buttons = None, None
 
-        if data.startswith("load:"):
-            module_name = data.split(":", 1)[1]
-            if module_name == "all":
-                from utils.loader import get_all_modules
-                for mod in get_all_modules(): await load_module(user_client, mod)
-                update_state_file(user_client)
-                await event.answer("✅ Все модули загружены!", alert=True)
-                text, buttons = build_main_panel(page=0, as_text=True, user_client=user_client)
-            else:
-                result = await load_module(user_client, module_name)
-                update_state_file(user_client)
-                await event.answer(result.get("message", "✅ Готово."), alert=True)
-                text, buttons = build_module_menu(module_name, as_text=True)
-
-        elif data.startswith("unload:"):
-            module_name = data.split(":", 1)[1]
-            if module_name == "all":
-                for mod in list(user_client.modules.keys()): await unload_module(user_client, mod)
-                update_state_file(user_client)
-                await event.answer("🗑️ Все модули выгружены!", alert=True)
-                text, buttons = build_main_panel(page=0, as_text=True, user_client=user_client)
-            else:
-                result = await unload_module(user_client, module_name)
-                update_state_file(user_client)
-                await event.answer(result.get("message", "✅ Готово."), alert=True)
-                text, buttons = build_module_menu(module_name, as_text=True)
-
-        elif data.startswith("reload:"):
-            module_name = data.split(":", 1)[1]
+        if data.startswith(("load:", "unload:", "reload:")):
+            # Команды управления модулями выполняет воркер (очередь без опроса файлов)
+            action, module_name = data.split(":", 1)
+            report = await run_command(action, module_name)
             if module_name == "all":
-                for mod in list(user_client.modules.keys()): await reload_module(user_client, mod)
-                update_state_file(user_client)
-                await event.answer("♻️ Все модули перезагружены!", alert=True)
+                all_messages = {
+                    "load": "✅ Все модули загружены!",
+                    "unload": "🗑️ Все модули выгружены!",
+                    "reload": "♻️ Все модули перезагружены!",
+                }
+                await event.answer(all_messages[action], alert=True)
                 text, buttons = build_main_panel(page=0, as_text=True, user_client=user_client)
             else:
-                result = await reload_module(user_client, module_name)
-                update_state_file(user_client)
-                await event.answer(result.get("message", "✅ Готово."), alert=True)
+                await event.answer(report[0] if report else "✅ Готово.", alert=True)
                 text, buttons = build_module_menu(module_name, as_text=True)
 
         elif data.startswith("page:"):
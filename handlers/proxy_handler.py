@@ -6,11 +6,12 @@
   .proxy                — показать текущие прокси
   .proxy add <ссылка>   — добавить прокси
   .proxy del <N>        — удалить прокси по номеру
-  .proxy test           — проверить все прокси
+  .proxy test           — проверить все прокси (параллельно) и показать рейтинг по задержке
+  .proxy history        — история RTT и переключений фонового мониторинга
   .proxy clear          — удалить все прокси
 """
 
-import asyncio
+import time
 import urllib.parse
 from configparser import ConfigParser
 from telethon import connection
@@ -19,6 +20,7 @@ from telethon.tl.types import (
     MessageEntityBold,
     MessageEntityCode,
 )
+from services import proxy_manager
 from utils.message_builder import build_and_edit
 
 # ── Премиум эмодзи ID ────────────────────────────────────────────────────────
@@ -106,48 +108,26 @@ def _is_faketls_secret(secret: str) -> bool:
     return secret.lower().startswith("ee")
 
 
-async def _test_proxy(px: dict, api_id: int, api_hash: str) -> bool:
-    from telethon import TelegramClient
-    from telethon.sessions import MemorySession
-    from network.faketls_connection import get_connection_class
-
-    secret = px["secret"]
-    conn_cls = get_connection_class(secret)
-
-    c = None
-    try:
-        c = TelegramClient(
-            MemorySession(), api_id, api_hash,
-            connection=conn_cls,
-            proxy=(px["server"], px["port"], secret),
-        )
-        await asyncio.wait_for(c.connect(), timeout=15)
-        if c.is_connected():
-            await c.disconnect()
-            return True
-    except Exception:
-        pass
-    finally:
-        if c is not None:
-            try:
-                await c.disconnect()
-            except Exception:
-                pass
-
-    # Fallback: сырая проверка TCP-порта (порт открыт = прокси жив)
-    try:
-        reader, writer = await asyncio.wait_for(
-            asyncio.open_connection(px["server"], px["port"]),
-            timeout=6,
-        )
-        writer.close()
-        try:
-            await writer.wait_closed()
-        except Exception:
-            pass
-        return True  # Порт открыт — прокси живой, FakeTLS просто требует правильного клиента
-    except Exception:
-        return False
+# ── Мониторинг ───────────────────────────────────────────────────────────────
+
+_SPARK = "▁▂▃▄▅▆▇█"
+
+
+def _sparkline(values: list) -> str:
+    """RTT-замеры строкой из блоков; × — потерянный замер."""
+    ok = [v for v in values if v is not None]
+    if not ok:
+        return "×" * len(values)
+    low, high = min(ok), max(ok)
+    step = (high - low) / (len(_SPARK) - 1) or 1
+    return "".join("×" if v is None else _SPARK[int((v - low) / step)] for v in values)
+
+
+def _rtt_label(stats: dict | None) -> str:
+    if not stats or not stats["samples"]:
+        return "нет замеров"
+    avg = "—" if stats["avg"] is None else f"{stats['avg']:.0f} мс"
+    return f"{avg}, потери {stats['loss']:.0%}"
 
 
 # ── Главный обработчик ───────────────────────────────────────────────────────
@@ -180,14 +160,25 @@ async def proxy_command_handler(event, config: ConfigParser, config_file: str, p
                 _t("\n\nМожно добавить несколько — каждый отдельной командой."),
             ])
 
+        rtt = proxy_manager.get_rtt_stats()
+        in_use = proxy_manager.proxy_key(proxy_manager.current) if proxy_manager.current else None
         msg = [_e("plug", "🔌"), _b(" Текущие MTProto прокси:\n\n")]
         for i, px in enumerate(current, 1):
-            msg += [_c(f"  {i}. {px['server']}:{px['port']}"), _t("\n")]
+            key = proxy_manager.proxy_key(px)
+            msg += [_c(f"  {i}. {key}")]
+            if key in rtt:
+                msg += [_t(f" — TCP {_rtt_label(rtt[key])}")]
+            if key == in_use:
+                msg += [_b(" ← используется")]
+            msg += [_t("\n")]
+        if in_use:
+            msg += [_t("\nPing через текущий: "), _c(_rtt_label(proxy_manager.get_ping_stats())), _t("\n")]
         msg += [
             _t("\n"), _b("Команды:\n"),
             _c(".proxy add <ссылка>"), _t(" — добавить\n"),
             _c(".proxy del <N>"),      _t(" — удалить по номеру\n"),
             _c(".proxy test"),         _t(" — проверить все\n"),
+            _c(".proxy history"),      _t(" — RTT и переключения\n"),
             _c(".proxy clear"),        _t(" — удалить все"),
         ]
         return await build_and_edit(event, msg)
@@ -224,7 +215,9 @@ async def proxy_command_handler(event, config: ConfigParser, config_file: str, p
 
         api_id  = int(config.get("telethon", "api_id"))
         api_hash = config.get("telethon", "api_hash")
-        ok = await _test_proxy(px, api_id, api_hash)
+        result = await proxy_manager.probe(px, api_id, api_hash)
+        # Открытый порт тоже считаем живым: FakeTLS может не пройти тестовое рукопожатие
+        ok = result["status"] != "dead"
 
         current.append(px)
         proxies_list.clear()
@@ -236,7 +229,7 @@ async def proxy_command_handler(event, config: ConfigParser, config_file: str, p
                 _e("ok", "✅"), _b(" Прокси добавлен и работает!\n\n"),
                 _e("server", "🖥"), _t(" Сервер: "), _c(f"{px['server']}:{px['port']}"), _t("\n"),
                 _e("list",   "📋"), _t(" Всего прокси: "), _c(str(len(current))), _t("\n\n"),
-                _e("warn", "❗️"), _b(" Перезапусти юзербот"), _t(" чтобы применить прокси к подключению."),
+                _t("Он участвует в автопереключении, а при следующем запуске будет выбран, если окажется самым быстрым."),
             ])
         else:
             return await build_and_edit(event, [
@@ -293,18 +286,71 @@ async def proxy_command_handler(event, config: ConfigParser, config_file: str, p
             _e("spin", "🔁"), _t(f" Проверяю {len(current)} прокси..."),
         ])
 
-        msg = [_e("plug", "🔌"), _b(" Результаты проверки прокси:\n\n")]
-        for i, px in enumerate(current, 1):
-            ok       = await _test_proxy(px, api_id, api_hash)
-            ekey     = "ok" if ok else "fail"
-            esym     = "✅" if ok else "❌"
-            status   = "Работает" if ok else "Не отвечает"
+        results = await proxy_manager.probe_all(current, api_id, api_hash)
+        proxy_manager.save_ranking(config, config_file, results)
+
+        # Номер в списке (для .proxy del) и текущий прокси подключения
+        numbers = {proxy_manager.proxy_key(px): i for i, px in enumerate(current, 1)}
+        in_use = proxy_manager.proxy_key(proxy_manager.current) if proxy_manager.current else None
+
+        msg = [_e("plug", "🔌"), _b(" Рейтинг прокси по задержке:\n\n")]
+        for rank, r in enumerate(results, 1):
+            key = proxy_manager.proxy_key(r)
+            if r["status"] == "ok":
+                ekey, esym = "ok", "✅"
+                status = f"{r['handshake_ms']:.0f} мс (TCP {r['tcp_ms']:.0f} мс)"
+            elif r["status"] == "tcp":
+                ekey, esym = "warn", "❗️"
+                status = f"только TCP {r['tcp_ms']:.0f} мс — {r['error']}"
+            else:
+                ekey, esym = "fail", "❌"
+                status = f"не отвечает — {r['error']}"
+            msg += [
+                _e(ekey, esym), _t(f" {rank}. "),
+                _c(f"[{numbers.get(key, '?')}] {key}"),
+                _t(f" — {status}"),
+                _b(" ← используется") if key == in_use else _t(""),
+                _t("\n"),
+            ]
+        msg += [
+            _t("\nВ квадратных скобках — номер для "), _c(".proxy del <N>"),
+            _t(".\nПри обрыве соединения юзербот сам переключится на лучший рабочий прокси."),
+        ]
+        return await build_and_edit(event, msg)
+
+    # ── .proxy history ───────────────────────────────────────────────────────
+    if sub == "history":
+        if not proxy_manager.current:
+            return await build_and_edit(event, [
+                _e("plug", "🔌"), _t(" Мониторинг не запущен: юзербот подключён без прокси."),
+            ])
+
+        in_use = proxy_manager.proxy_key(proxy_manager.current)
+        pings = [v for _, key, v in proxy_manager.ping_history if key == in_use]
+        msg = [
+            _e("list", "📋"), _b(" Мониторинг прокси\n\n"),
+            _e("server", "🖥"), _t(" Используется: "), _c(in_use), _t("\n"),
+            _t("Ping: "), _c(_rtt_label(proxy_manager.get_ping_stats())), _t("\n"),
+        ]
+        if pings:
+            msg += [_c(_sparkline(pings)), _t("\n")]
+
+        msg += [_t("\n"), _b("TCP RTT по прокси:\n")]
+        rtt = proxy_manager.get_rtt_stats()
+        for key, samples in proxy_manager.rtt_history.items():
             msg += [
-                _e(ekey, esym), _t(" "),
-                _c(f"{i}. {px['server']}:{px['port']}"),
-                _t(f" — {status}\n"),
+                _c(key), _t(f" — {_rtt_label(rtt[key])}\n"),
+                _c(_sparkline([v for _, v in samples])), _t("\n"),
             ]
-        msg += [_t("\nЧтобы удалить нерабочий: "), _c(".proxy del <N>")]
+        if not proxy_manager.rtt_history:
+            msg += [_t("Замеров ещё нет.\n")]
+
+        msg += [_t("\n"), _b("Переключения:\n")]
+        for ev in reversed(proxy_manager.switch_events):
+            when = time.strftime("%d.%m %H:%M:%S", time.localtime(ev["time"]))
+            msg += [_t(f"{when}  "), _c(f"{ev['from'] or '—'} → {ev['to']}"), _t(f"  ({ev['reason']})\n")]
+        if not proxy_manager.switch_events:
+            msg += [_t("Не было.\n")]
         return await build_and_edit(event, msg)
 
     # ── Неизвестная подкоманда ───────────────────────────────────────────────
@@ -315,5 +361,6 @@ async def proxy_command_handler(event, config: ConfigParser, config_file: str, p
         _c(".proxy add <ссылка>"), _t(" — добавить прокси\n"),
         _c(".proxy del <N>"),      _t(" — удалить по номеру\n"),
         _c(".proxy test"),         _t(" — проверить все\n"),
+        _c(".proxy history"),      _t(" — RTT и переключения\n"),
         _c(".proxy clear"),        _t(" — удалить все"),
     ])
\ No newline at end of file
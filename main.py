@@ -9,8 +9,8 @@ import uuid
 import random
 from configparser import ConfigParser
 from telethon import TelegramClient, events, connection
-from telethon.sessions import StringSession, MemorySession
-from telethon.errors import AccessTokenInvalidError, AccessTokenExpiredError, FloodWaitError
+from telethon.sessions import StringSession
+from telethon.errors import AccessTokenInvalidError, AccessTokenExpiredError
 
 LOG_FILE = "kote_loader.log"
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -77,8 +77,13 @@ try:
     from handlers.user_commands import user_panel_helper
     from workers.command_worker import command_worker
     from utils import database as db
+    from utils import aiodb
+    from utils import http as http_client
     from utils import loader
+    from utils import profiler
+    from utils import metrics
     from services.twin_manager import twin_manager 
+    from services import proxy_manager
 except ImportError as e:
     print(f"Критическая ошибка: не удалось импортировать необходимый компонент: {e}")
     exit()
@@ -159,13 +164,9 @@ def _build_proxy_kwargs(proxies: list) -> dict:
     """
     if not proxies:
         return {}
-    px = proxies[0]
-    from network.faketls_connection import get_connection_class
-    conn_cls = get_connection_class(px["secret"])
-    return {
-        "connection": conn_cls,
-        "proxy": (px["server"], px["port"], px["secret"]),
-    }
+    # Бесконечные попытки переподключения: если прокси упадёт, клиент не завершится,
+    # а proxy_manager переключит его на другой прокси из списка
+    return dict(proxy_manager.connection_kwargs(proxies[0]), connection_retries=-1)
 
 
 def _setup_mtproto_proxies(prompt_fn, info_fn, C, Y, G, RST) -> list:
@@ -279,20 +280,6 @@ async def auto_create_bot(user_client):
             print("❌ BotFather не ответил вовремя.")
             return None
 
-async def all_messages_handler(event):
-    for watcher_func, kwargs in loader.WATCHERS_REGISTRY:
-        try:
-            is_incoming = kwargs.get("incoming", False)
-            is_outgoing = kwargs.get("outgoing", False)
-            if (is_incoming and event.incoming) or (is_outgoing and event.outgoing):
-                await watcher_func(event)
-        except FloodWaitError as e:
-            logging.warning(f"⏳ FloodWait в модуле: ожидание {e.seconds} сек.")
-            await asyncio.sleep(e.seconds)
-        except Exception as e:
-            logging.error(f"⚠️ Ошибка в модуле ({watcher_func.__name__}): {e}")
-            continue
-
 async def ensure_folder_added(client):
     """
     Каждый запуск:
@@ -422,12 +409,7 @@ async def start_clients():
         if _raw:
             proxies_list = _deserialize_proxies(_raw)
 
-    # ── Подключение с прокси (или без) ──────────────────────────────────────
-    proxy_kwargs = _build_proxy_kwargs(proxies_list)
-
     _info(f"Сессия: {_Y}{session_name}{_RST}  {_DIM}•  подключаюсь...{_RST}")
-    if proxy_kwargs:
-        _info(f"Используется MTProto прокси: {_Y}{proxy_kwargs.get('proxy', ('?',))[0]}{_RST}")
 
     # УБРАН преждевременный TelegramClient здесь — он открывал my_account.session
     # до того как _make_client создавал второй клиент с тем же файлом,
@@ -452,45 +434,40 @@ async def start_clients():
 
     # ── Вспомогательная функция создания клиента ────────────────────────────
     def _make_client(px_list):
-        if px_list:
-            pk = _build_proxy_kwargs(px_list)
-        else:
-            pk = {}
+        pk = _build_proxy_kwargs(px_list)
         c = TelegramClient(session_name, api_id, api_hash, **pk)
         c.device_model = "KoteLoader"
         return c
 
     # ── Подключение (с прокси или без, с фоллбэком) ─────────────────────────
-    async def _try_connect_proxy(px):
-        """Проверяет прокси через MemorySession (без записи на диск). Возвращает True или False."""
-        _info(f"Попытка подключения через прокси {_Y}{px['server']}:{px['port']}{_RST} ...")
-        c = None
-        try:
-            pk = _build_proxy_kwargs([px])
-            c = TelegramClient(MemorySession(), api_id, api_hash, **pk)
-            await asyncio.wait_for(c.connect(), timeout=15)
-            if c.is_connected():
-                print(f"  {_G}✔{_RST} Прокси {_Y}{px['server']}{_RST} работает!")
-                return True
-        except Exception as e:
-            print(f"  \033[91m✘\033[0m {px['server']}: {e}")
-        finally:
-            if c is not None:
-                try:
-                    await c.disconnect()
-                except Exception:
-                    pass
-        return False
+    async def _connect_best_proxy():
+        """
+        Проверяет все прокси параллельно (один таймаут на всех), сохраняет рейтинг
+        в config.ini и подключается через самый быстрый рабочий. Возвращает клиент или None.
+        """
+        _info(f"Проверяю прокси: {_Y}{len(proxies_list)}{_RST} шт. параллельно...")
+        with profiler.span("proxy_probe", "clients", count=len(proxies_list)):
+            results = await proxy_manager.probe_all(proxies_list, api_id, api_hash)
+        proxy_manager.save_ranking(config, config_file, results)
+        for r in results:
+            if r["status"] == "ok":
+                print(f"  {_G}✔{_RST} {_Y}{proxy_manager.proxy_key(r)}{_RST} — {r['handshake_ms']:.0f} мс")
+            else:
+                print(f"  \033[91m✘\033[0m {proxy_manager.proxy_key(r)}: {r['error']}")
+
+        best = proxy_manager.best_healthy(results)
+        if best is None:
+            return None
+        _info(f"Используется MTProto прокси: {_Y}{proxy_manager.proxy_key(best)}{_RST}")
+        client = _make_client([best])
+        with profiler.span("connect", "clients"):
+            await client.connect()
+        proxy_manager.current = best
+        return client
 
     if proxies_list:
-        connected_ok = False
-        for px in proxies_list:
-            connected_ok = await _try_connect_proxy(px)
-            if connected_ok:
-                proxy_kwargs = _build_proxy_kwargs([px])
-                user_client = _make_client([px])
-                await user_client.connect()
-                break
+        user_client = await _connect_best_proxy()
+        connected_ok = user_client is not None
         if not connected_ok:
             while True:
                 print(f"\n  \033[91m✘\033[0m Ни один прокси не ответил.")
@@ -506,26 +483,21 @@ async def start_clients():
                     config['mtproto'] = {'proxies': _serialize_proxies(proxies_list)}
                     with open(config_file, 'w', encoding='utf-8') as f:
                         config.write(f)
-                    for px in proxies_list:
-                        connected_ok = await _try_connect_proxy(px)
-                        if connected_ok:
-                            proxy_kwargs = _build_proxy_kwargs([px])
-                            user_client = _make_client([px])
-                            await user_client.connect()
-                            break
-                    if connected_ok:
+                    user_client = await _connect_best_proxy()
+                    if user_client is not None:
                         break
                 elif ch == "2":
                     _info("Подключение без прокси...")
-                    proxy_kwargs = {}
                     user_client = _make_client([])
-                    await user_client.connect()
+                    with profiler.span("connect", "clients"):
+                        await user_client.connect()
                     break
                 else:
                     print("  Введи 1 или 2")
     else:
         user_client = _make_client([])
-        await user_client.connect()
+        with profiler.span("connect", "clients"):
+            await user_client.connect()
 
     if not await user_client.is_user_authorized():
         banner("АВТОРИЗАЦИЯ  •  KoteLoader")
@@ -666,7 +638,8 @@ async def start_clients():
     user_client._tg_id = me.id
     user_client.tg_id = me.id
 
-    await ensure_folder_added(user_client)
+    with profiler.span("ensure_folder_added", "clients"):
+        await ensure_folder_added(user_client)
 
     bot_client = None
     
@@ -700,8 +673,10 @@ async def start_clients():
         if bot_token:
             print(f"🚀 Проверка запуска бота...")
             try:
-                bot_client = TelegramClient(None, api_id, api_hash, **proxy_kwargs)
-                await bot_client.start(bot_token=bot_token)
+                bot_client = TelegramClient(None, api_id, api_hash, **_build_proxy_kwargs(
+                    [proxy_manager.current] if proxy_manager.current else []))
+                with profiler.span("bot_start", "clients"):
+                    await bot_client.start(bot_token=bot_token)
                 print("✅ Бот успешно запущен!")
                 break 
             except (AccessTokenInvalidError, AccessTokenExpiredError):
@@ -719,7 +694,8 @@ async def start_clients():
                     config.write(f)
                 bot_token = None
 
-    db.init_db()
+    with profiler.span("init_db", "core"):
+        db.init_db()
     if db.get_setting("debug_mode") == "True":
         logging.getLogger().setLevel(logging.DEBUG)
     
@@ -735,7 +711,8 @@ async def start_clients():
             user_client.bot_username = bot_info.username or ""
             
             await asyncio.sleep(1) 
-            await ensure_inline_mode_enabled(user_client, bot_info.username)
+            with profiler.span("ensure_inline_mode_enabled", "clients"):
+                await ensure_inline_mode_enabled(user_client, bot_info.username)
             
             # Отправка start самому себе, чтобы бот появился в диалогах
             await user_client.send_message(bot_info.username, "/start")
@@ -752,9 +729,15 @@ async def start_clients():
         lambda e: proxy_command_handler(e, config, config_file, proxies_list),
         events.NewMessage(pattern=_proxy_pattern, outgoing=True)
     )
+    if proxy_manager.current:
+        # Автопереключение на другой прокси, если текущий отвалился
+        proxy_manager.start_failover([user_client, bot_client], proxies_list, api_id, api_hash, config, config_file)
+        # Замер RTT и переключение на лету, если текущий прокси деградировал
+        proxy_manager.start_monitor([user_client, bot_client], proxies_list, api_id, api_hash, config)
     # ─────────────────────────────────────────────────────────────────────────
 
-    user_client.add_event_handler(all_messages_handler)
+    loader.install_command_router(user_client)
+    loader.install_watcher_dispatcher(user_client)
 
     if bot_client:
         bot_client.add_event_handler(inline_query_handler, events.InlineQuery)
@@ -768,52 +751,57 @@ async def start_clients():
     return user_client, bot_client
 
 async def main():
-    user_client, bot_client = await start_clients()
+    # Таймлайн сохраняется, когда загружены и модули (воркер), и твинки
+    profiler.begin(stages=("modules", "twins"))
+    with profiler.span("start_clients", "clients"):
+        user_client, bot_client = await start_clients()
     if not user_client: return
+
+    from utils.integrity import start_watcher
+    start_watcher()
         
     worker_task = asyncio.create_task(command_worker(user_client))
+    metrics_task = metrics.start_persistence()
+
+    try:
+        from modules.updater import start_update_scheduler
+        update_task = start_update_scheduler(user_client)
+    except Exception as e:
+        update_task = None
+        print(f"⚠️ Фоновая проверка обновлений не запущена: {e}")
     
     print("👥 Запускаю твинков...")
     try:
-        twins_count = await twin_manager.start_all_twins()
+        with profiler.span("start_all_twins", "twins"):
+            twins_count = await twin_manager.start_all_twins()
         print(f"✅ Запущено твинков: {twins_count}")
-        # Регистрируем watcher Silent Tags на каждом твин-клиенте
-        try:
-            from modules.stags import twin_silent_tags_watcher
-            from telethon import events as _tl_events
-            for _twin_name, _twin_client in twin_manager.clients.items():
-                _twin_client._twin_name = _twin_name
-                _twin_client.add_event_handler(
-                    twin_silent_tags_watcher,
-                    _tl_events.NewMessage(incoming=True)
-                )
-            print(f"[stags] Twin watchers зарегистрированы для {len(twin_manager.clients)} твинков.")
-        except Exception as _twe:
-            print(f"[stags] Не удалось зарегистрировать twin watchers: {_twe}")
-        try:
-            from modules.auto_manager import twin_auto_read_watcher
-            from telethon import events as _tl_events
-            for _twin_name, _twin_client in twin_manager.clients.items():
-                _twin_client.add_event_handler(
-                    twin_auto_read_watcher,
-                    _tl_events.NewMessage(incoming=True)
-                )
-            print(f"[auto_manager] Twin read watchers зарегистрированы для {len(twin_manager.clients)} твинков.")
-        except Exception as _awe:
-            print(f"[auto_manager] Не удалось зарегистрировать twin read watchers: {_awe}")
+        # Watcher'ы твинков (@watcher(twins=True)) модули регистрируют сами через общую шину TwinManager
     except Exception as e:
         print(f"⚠️ Ошибка при запуске твинков: {e}")
+    profiler.complete("twins")
 
     print("\n🟢 KoteLoader полностью запущен! Напишите help в чате.")
     
     try:
         # Добавляем heartbeat в список задач
-        tasks = [worker_task, user_client.run_until_disconnected(), heartbeat()]
+        tasks = [worker_task, proxy_manager.run_until_disconnected(user_client), heartbeat()]
         if bot_client: 
-            tasks.append(bot_client.run_until_disconnected())
+            tasks.append(proxy_manager.run_until_disconnected(bot_client))
         await asyncio.gather(*tasks)
     finally:
         print("\nЗавершение работы...")
+        if update_task is not None:
+            update_task.cancel()
+        metrics_task.cancel()
+        try:
+            metrics.save()
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить метрики команд: {e}")
+        aiodb.shutdown()
+        await http_client.close()
+        flushed = db.flush_module_writes()
+        if flushed:
+            print(f"💾 Сохранено отложенных записей модулей: {flushed}")
         db.close_db()
 
 if __name__ == "__main__":
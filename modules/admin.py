@@ -10,8 +10,9 @@ author: Kote
 Включает аварийный сброс префикса с авто-рестартом.
 """
 
+import io
 import os
-import sys
+import json
 import zipfile
 import asyncio
 import time
@@ -19,6 +20,9 @@ from pathlib import Path
 from datetime import datetime
 from core import register, watcher
 from utils import database as db
+from utils import aiodb
+from utils import profiler
+from utils import metrics, ratelimit, flood, restart
 from utils.message_builder import build_and_edit, utf16len
 from utils.security import check_permission
 from telethon.tl.types import (
@@ -61,7 +65,7 @@ async def emergency_reset_prefix(event):
         
         # 5. Жесткий перезапуск процесса
         await asyncio.sleep(1) # Даем время сообщению отправиться
-        os.execv(sys.executable, [sys.executable] + sys.argv)
+        restart.restart_process()
 
 @register("prefix", incoming=True)
 async def show_prefix(event):
@@ -129,9 +133,74 @@ async def restart_bot(event):
         db.set_setting("restart_report_chat_id", str(event.chat_id))
         db.set_setting("restart_start_time", str(time.time()))
     
-    os.execv(sys.executable, [sys.executable] + sys.argv)
+    restart.restart_process()
 
 
+@register("boot", incoming=True)
+async def show_boot_timeline(event):
+    """Таймлайн последней загрузки: этапы старта и самые медленные модули.
+    С аргументом trace — отправляет таймлайн файлом в формате Chrome trace
+    (открыть в chrome://tracing или ui.perfetto.dev).
+
+    Usage: {prefix}boot [trace]
+    """
+    if not check_permission(event, min_level="TRUSTED"):
+        return
+
+    timeline = profiler.load_timeline()
+    if not timeline or not timeline["spans"]:
+        return await build_and_edit(event, [
+            {"text": "ℹ️ Таймлайн загрузки ещё не записан — он появится после следующего перезапуска.", "entity": MessageEntityItalic}
+        ])
+
+    args = event.message.text.split(maxsplit=1)
+    if len(args) > 1 and args[1].strip().lower() == "trace":
+        started = datetime.fromtimestamp(timeline["started_at"]).strftime("%Y%m%d_%H%M%S")
+        trace = io.BytesIO(json.dumps(profiler.to_chrome_trace(timeline), ensure_ascii=False).encode("utf-8"))
+        trace.name = f"boot_trace_{started}.json"
+        await event.client.send_file(
+            event.chat_id,
+            trace,
+            caption=f"📈 <b>Таймлайн загрузки</b> (Chrome trace)\n<code>{trace.name}</code>",
+            parse_mode="html"
+        )
+        if event.out:
+            await event.delete()
+        return
+
+    summary = profiler.summarize(timeline)
+    started = datetime.fromtimestamp(timeline["started_at"]).strftime("%d.%m.%Y %H:%M:%S")
+    parts = [
+        {"text": "⏱️"},
+        {"text": " Таймлайн загрузки", "entity": MessageEntityBold},
+        {"text": f"\n{started} • всего "},
+        {"text": f"{summary['total']:.2f} сек", "entity": MessageEntityCode},
+        {"text": "\n\n"},
+        {"text": "Этапы:", "entity": MessageEntityBold},
+        {"text": "\n"},
+    ]
+    for stage in summary["stages"]:
+        label = stage["name"] + (f" ({stage['args']['server']})" if stage["args"].get("server") else "")
+        parts.append({"text": f"• +{stage['start']:.2f} "})
+        parts.append({"text": label, "entity": MessageEntityCode})
+        parts.append({"text": f" — {stage['dur']:.3f} сек\n"})
+
+    if summary["modules"]:
+        parts.extend([
+            {"text": "\n"},
+            {"text": f"Самые медленные модули (из {summary['module_count']}):", "entity": MessageEntityBold},
+            {"text": "\n"},
+        ])
+        for module, info in summary["modules"]:
+            phases = ", ".join(f"{phase} {dur:.3f}" for phase, dur in info["phases"].items())
+            parts.append({"text": "• "})
+            parts.append({"text": module, "entity": MessageEntityCode})
+            parts.append({"text": f" — {info['total']:.3f} сек ({phases})\n"})
+
+    prefix = db.get_setting("prefix", default=".")
+    parts.append({"text": f"\nChrome trace: {prefix}boot trace", "entity": MessageEntityItalic})
+    await build_and_edit(event, parts)
+
 @register("trust", incoming=True)
 async def trust_user(event):
     """Добавить пользователя в доверенные.
@@ -423,6 +492,16 @@ async def show_db_stats(event):
             {"text": " Итого", "entity": MessageEntityBold},
             {"text": f":\n• Модулей с данными: {len(stats)}\n• Всего настроек: {total_configs}\n• Всего записей данных: {total_data}"}
         ])
+
+        cache = db.get_module_cache_stats()
+        lookups = cache['hits'] + cache['misses']
+        hit_rate = f"{cache['hits'] * 100 / lookups:.1f}%" if lookups else "—"
+        parts.extend([
+            {"text": "\n\n"},
+            {"text": "⚡"},
+            {"text": " Кэш данных модулей", "entity": MessageEntityBold},
+            {"text": f":\n• Попаданий: {cache['hits']}\n• Промахов: {cache['misses']} ({hit_rate} попаданий)\n• Записей: {cache['size']}/{cache['capacity']}\n• Ожидают записи в БД: {cache['pending']} (сбросов: {cache['flushes']}, строк: {cache['flushed_rows']} из {cache['writes']} записей)"}
+        ])
         await build_and_edit(event, parts)
         
     except Exception as e:
@@ -432,6 +511,71 @@ async def show_db_stats(event):
             {"text": f":\n`{e}`"}
         ])
 
+@register("stats", incoming=True)
+async def show_command_stats(event):
+    """Метрики команд: вызовы, ошибки и задержки (p50/p95/p99) по командам и модулям.
+
+    Usage: {prefix}stats [модуль | reset]
+    """
+    if not check_permission(event, min_level="TRUSTED"):
+        return
+
+    args = event.message.text.split(maxsplit=1)
+    arg = args[1].strip() if len(args) > 1 else ""
+
+    if arg.lower() == "reset":
+        metrics.reset()
+        return await build_and_edit(event, [{"text": "✅ Метрики команд обнулены.", "entity": MessageEntityBold}])
+
+    rows = metrics.get_command_stats()
+    if arg:
+        rows = [r for r in rows if r["module"].lower() == arg.lower()]
+    if not rows:
+        return await build_and_edit(event, [
+            {"text": "ℹ️ Метрик пока нет — ни одна команда ещё не вызывалась.", "entity": MessageEntityItalic}
+        ])
+
+    parts = [
+        {"text": "📈"},
+        {"text": f" Метрики команд{f' модуля {arg}' if arg else ''}", "entity": MessageEntityBold},
+        {"text": "\n\n"},
+    ]
+
+    if not arg:
+        parts.append({"text": "Модули по суммарному времени:", "entity": MessageEntityBold})
+        parts.append({"text": "\n"})
+        for m in metrics.get_module_stats()[:10]:
+            parts.append({"text": "• "})
+            parts.append({"text": m["module"], "entity": MessageEntityCode})
+            parts.append({"text": f" — {m['total']:.2f} сек, вызовов {m['count']}, ошибок {m['errors']}\n"})
+        parts.append({"text": "\n"})
+
+    parts.append({"text": "Команды (p50 / p95 / p99, мс):", "entity": MessageEntityBold})
+    parts.append({"text": "\n"})
+    for r in rows[:20]:
+        parts.append({"text": "• "})
+        parts.append({"text": f".{r['command']}", "entity": MessageEntityCode})
+        errors = f", ошибок {r['errors']}" if r["errors"] else ""
+        parts.append({"text": f" ({r['module']}) ×{r['count']}{errors}: "
+                              f"{r['p50'] * 1000:.0f} / {r['p95'] * 1000:.0f} / {r['p99'] * 1000:.0f}\n"})
+
+    rl = ratelimit.get_stats()
+    fl = flood.get_stats()
+    if rl or fl["flood_waits"]:
+        parts.extend([
+            {"text": "\n"},
+            {"text": "Ограничения:", "entity": MessageEntityBold},
+            {"text": "\n"},
+        ])
+        for scope, stat in sorted(rl.items()):
+            parts.append({"text": f"• ratelimit {scope}: {stat['calls']} запросов, ждали {stat['throttled']} "
+                                  f"(всего {stat['wait_total']:.1f} сек, макс. {stat['wait_max']:.1f} сек)\n"})
+        parts.append({"text": f"• FloodWait: {fl['flood_waits']}, запросов на паузе {fl['parked']} "
+                              f"({fl['parked_seconds']:.1f} сек), отклонено команд владельца {fl['owner_rejected']}, "
+                              f"фоновых (ожидание > {flood.MAX_TOTAL_PARK} сек) {fl['rejected']}\n"})
+
+    await build_and_edit(event, parts)
+
 @register("db_clear", incoming=True)
 async def clear_module_data(event):
     """Очистить данные модуля из БД.
@@ -469,8 +613,8 @@ async def clear_module_data(event):
     module_name = args[1]
     
     try:
-        configs = db.get_all_module_configs(module_name)
-        all_data = db.get_all_module_data(module_name)
+        configs = await aiodb.get_all_module_configs(module_name)
+        all_data = await aiodb.get_all_module_data(module_name)
         
         if not configs and not all_data:
             return await build_and_edit(event, [
@@ -618,6 +762,7 @@ async def restore_db_cmd(event):
     try:
         db_path = Path(__file__).parent.parent / "database.db"
         backup_path = db_path.with_suffix(".db.bak")
+        staged_path = db_path.with_suffix(".db.restore")
 
         # Сохраняем старую БД как .bak на случай если что-то пойдёт не так
         if db_path.exists():
@@ -627,9 +772,10 @@ async def restore_db_cmd(event):
         # Скачиваем новый файл
         data = await msg_with_file.download_media(bytes)
 
-        # Пишем на диск
-        with open(db_path, "wb") as f:
+        # Пишем рядом, а не поверх: база ещё открыта, её читают watcher'ы и пишет таймер write-behind
+        with open(staged_path, "wb") as f:
             f.write(data)
+        db.sanitize_restored_db(staged_path)
 
         await build_and_edit(event, [
             {"text": "✅"},
@@ -651,14 +797,25 @@ async def restore_db_cmd(event):
                 await user_cl.disconnect()
         except Exception:
             pass
-        await asyncio.sleep(0.5)  # даём SQLite сбросить WAL на диск
+        await asyncio.sleep(0.5)
 
-        os.execv(sys.executable, [sys.executable] + sys.argv)
+        # Только теперь сбрасываем отложенные записи и метрики, закрываем базу (закрытие
+        # сбрасывает WAL) и подменяем файл — сразу за этим процесс перезапускается
+        restart.save_state()
+        db.close_db()
+        os.replace(staged_path, db_path)
+        restart.restart_process(save=False)
 
     except Exception as e:
         # Откатываем если что-то сломалось
+        if staged_path.exists():
+            staged_path.unlink()
         if backup_path.exists() and not db_path.exists():
+            import shutil
             shutil.copy2(backup_path, db_path)
+        if db.connection is None:
+            db.db_connect()
+            db.init_twins_table()
         await build_and_edit(event, [
             {"text": "❌"},
             {"text": f" Ошибка восстановления:\n", "entity": MessageEntityBold},
@@ -14,10 +14,9 @@ import asyncio
 import subprocess
 import traceback
 import time
-import os
-import sys
 from core import register
 from utils import database as db
+from utils import restart
 from utils.message_builder import build_and_edit
 from utils.security import check_permission
 from telethon.tl.types import MessageEntityBold, MessageEntityCode
@@ -106,7 +105,7 @@ async def update_core_cmd(event):
         db.set_setting("restart_report_chat_id", str(event.chat_id))
         db.set_setting("restart_start_time", str(time.time()))
         
-        os.execv(sys.executable, [sys.executable] + sys.argv)
+        restart.restart_process()
         
     except Exception as e:
         await build_and_edit(event, [
@@ -10,7 +10,6 @@ author: Kote
 Позволяет автоматически обновлять версию модуля и загружать его в ваш GitHub репозиторий.
 """
 
-import aiohttp
 import json
 import re
 import base64
@@ -19,6 +18,7 @@ from typing import Optional
 
 from core import register
 from utils import database as db
+from utils import http
 from utils.message_builder import build_and_edit
 from utils.security import check_permission
 from telethon.tl.types import MessageEntityBold, MessageEntityCode, MessageEntityCustomEmoji
@@ -197,15 +197,15 @@ async def upload_module_cmd(event):
     try:
         await build_and_edit(event, [{"text": "🚀 Получаю SHA файла... (3/4)", "entity": MessageEntityBold}])
         current_sha = None
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(api_url) as response:
-                if response.status == 200:
-                    current_sha = (await response.json()).get("sha")
-                elif response.status != 404:
-                    return await build_and_edit(event, [
-                        {"text": "❌", "entity": MessageEntityCustomEmoji, "kwargs": {"document_id": ERROR_EMOJI_ID}},
-                        {"text": f" Ошибка GitHub (GET): {response.status}", "entity": MessageEntityBold}
-                    ])
+        session = await http.get_session()
+        async with session.get(api_url, headers=headers) as response:
+            if response.status == 200:
+                current_sha = (await response.json()).get("sha")
+            elif response.status != 404:
+                return await build_and_edit(event, [
+                    {"text": "❌", "entity": MessageEntityCustomEmoji, "kwargs": {"document_id": ERROR_EMOJI_ID}},
+                    {"text": f" Ошибка GitHub (GET): {response.status}", "entity": MessageEntityBold}
+                ])
 
         await build_and_edit(event, [{"text": "🚀 Загружаю файл в репозиторий... (4/4)", "entity": MessageEntityBold}])
         
@@ -220,15 +220,14 @@ async def upload_module_cmd(event):
         if current_sha:
             data["sha"] = current_sha 
 
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.put(api_url, json=data) as response:
-                if response.status not in [200, 201]: 
-                    return await build_and_edit(event, [
-                        {"text": "❌", "entity": MessageEntityCustomEmoji, "kwargs": {"document_id": ERROR_EMOJI_ID}},
-                        {"text": f" Ошибка загрузки на GitHub (PUT): {response.status}", "entity": MessageEntityBold}
-                    ])
-                
-                commit_url = (await response.json())["commit"]["html_url"]
+        async with session.put(api_url, json=data, headers=headers) as response:
+            if response.status not in [200, 201]: 
+                return await build_and_edit(event, [
+                    {"text": "❌", "entity": MessageEntityCustomEmoji, "kwargs": {"document_id": ERROR_EMOJI_ID}},
+                    {"text": f" Ошибка загрузки на GitHub (PUT): {response.status}", "entity": MessageEntityBold}
+                ])
+            
+            commit_url = (await response.json())["commit"]["html_url"]
 
         await build_and_edit(event, [
             {"text": "✅", "entity": MessageEntityCustomEmoji, "kwargs": {"document_id": SUCCESS_EMOJI_ID}},
@@ -14,7 +14,7 @@ author: patch
 
 import json
 from core import register, callback_handler, inline_handler, watcher
-from utils import database as db
+from utils import aiodb
 from utils.message_builder import build_and_edit
 from utils.security import check_permission
 from telethon.tl.custom import Button
@@ -272,7 +272,7 @@ async def hcfg_toggle_callback(event):
     new_val = not bool(current)
 
     # Сохраняем в БД и применяем
-    db.set_module_config(mod_name, key, new_val)
+    await aiodb.set_module_config(mod_name, key, new_val)
     cfg.set_db_value(key, new_val)
 
     status = "✅ Вкл" if new_val else "❌ Выкл"
@@ -396,7 +396,7 @@ async def hcfg_reset_callback(event):
         return
 
     default = cfg._meta[key].default
-    db.set_module_config(mod_name, key, default)
+    await aiodb.set_module_config(mod_name, key, default)
     cfg.set_db_value(key, default)
 
     await event.answer(f"↩️ {key} сброшен до дефолта.", show_alert=False)
@@ -493,7 +493,7 @@ async def hcfg_input_watcher(event):
         return
 
     # Сохраняем
-    db.set_module_config(mod_name, key, new_val)
+    await aiodb.set_module_config(mod_name, key, new_val)
     cfg.set_db_value(key, new_val)
     _awaiting_input.pop(sender_id, None)
 
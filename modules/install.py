@@ -14,7 +14,6 @@ author: Kote
 import os
 import sys
 import ast
-import aiohttp
 import traceback
 import asyncio
 import shutil
@@ -25,6 +24,8 @@ from typing import Optional
 
 from core import register
 from utils import database as db
+from utils import aiodb
+from utils import http
 from utils.message_builder import build_and_edit, build_message
 from utils.security import scan_code, check_permission
 from telethon.tl.types import MessageEntityCustomEmoji, MessageEntityBold, MessageEntityCode
@@ -253,11 +254,11 @@ async def install_requirements(event, code_content: str):
 
 async def _install_from_py_url(event, url, force=False):
     try:
-        async with aiohttp.ClientSession(trust_env=False) as session:
-            async with session.get(url) as response:
-                if response.status != 200:
-                    return await build_and_edit(event, f"**Ошибка скачивания: HTTP {response.status}**", parse_mode="md")
-                content = await response.text(encoding='utf-8')
+        session = await http.get_session()
+        async with session.get(url) as response:
+            if response.status != 200:
+                return await build_and_edit(event, f"**Ошибка скачивания: HTTP {response.status}**", parse_mode="md")
+            content = await response.text(encoding='utf-8')
         
         file_name = os.path.basename(urlparse(url).path)
         await process_and_install(event, file_name, content, source_url=url, force=force)
@@ -447,9 +448,9 @@ async def process_and_install(event, file_name, content, source_url=None, force=
         f.write(content)
     
     if source_url:
-        db.set_module_config(module_name, "source_url", source_url) 
+        await aiodb.set_module_config(module_name, "source_url", source_url) 
     else:
-        db.remove_module_config(module_name, "source_url")
+        await aiodb.remove_module_config(module_name, "source_url")
 
     if _is_heroku_module(content):
         try:
@@ -18,6 +18,7 @@ from typing import Optional
 import re
 from core import register
 from utils import database as db
+from utils import aiodb
 from services.module_info_cache import parse_manifest
 from utils.loader import get_all_modules, COMMANDS_REGISTRY, load_module, unload_module, reload_module
 from services.state_manager import update_state_file
@@ -193,9 +194,9 @@ async def setmodemoji_cmd(event):
     key_upper = parsed["key"].upper()
     if key_upper not in _get_static_emojis():
         return await build_and_edit(event, [{"text": "❌ Неизвестный ключ" }])
-    custom_emojis = db.get_module_data("modules", "modules_emojis", default={})
+    custom_emojis = await aiodb.get_module_data("modules", "modules_emojis", default={})
     custom_emojis[key_upper] = {"id": parsed["id"], "fallback": parsed["fallback"]}
-    db.set_module_data("modules", "modules_emojis", custom_emojis)
+    await aiodb.set_module_data("modules", "modules_emojis", custom_emojis)
     await build_and_edit(event, [{"text": "✅ "}, {"text": f"Эмодзи для {key_upper} (в modules.py) установлен!", "entity": MessageEntityBold}])
 
 @register("delmodemoji", incoming=True)
@@ -204,10 +205,10 @@ async def delmodemoji_cmd(event):
     if not check_permission(event, min_level="TRUSTED"): return
     key_upper = (event.pattern_match.group(1) or "").upper()
     if not key_upper: return await build_and_edit(event, [{"text": "❌ Укажите ключ"}])
-    custom_emojis = db.get_module_data("modules", "modules_emojis", default={})
+    custom_emojis = await aiodb.get_module_data("modules", "modules_emojis", default={})
     if key_upper in custom_emojis:
         del custom_emojis[key_upper]
-        db.set_module_data("modules", "modules_emojis", custom_emojis)
+        await aiodb.set_module_data("modules", "modules_emojis", custom_emojis)
         await build_and_edit(event, [{"text": "🗑️ Эмодзи сброшены."}])
     else:
         await build_and_edit(event, [{"text": "ℹ️ Эмодзи не был найден."}])
@@ -218,7 +219,7 @@ async def modemojis_cmd(event):
     if not check_permission(event, min_level="TRUSTED"): return
     parts = [{"text": "⚙️ "}, {"text": "Эмодзи для "}, {"text": "modules.py", "entity": MessageEntityCode}, {"text": "\n(Кастомные из БД перезаписывают дефолтные)\n\n"}]
     mapping = _get_static_emojis()
-    custom_keys = db.get_module_data("modules", "modules_emojis", default={}).keys()
+    custom_keys = (await aiodb.get_module_data("modules", "modules_emojis", default={})).keys()
     for key, details in sorted(mapping.items()):
         is_custom = " (кастомный)" if key in custom_keys else ""
         parts.append(_build_emoji_part(details))
@@ -376,8 +377,8 @@ async def module_info(event):
             parts.extend([{"text": "• "}, {"text": f"{prefix}{cmd}", "entity": MessageEntityCode}, {"text": f" - {short_desc}\n"}])
         parts.append({"text": "\n"})
     
-    db_configs = db.get_all_module_configs(module_name)
-    db_data = db.get_all_module_data(module_name)
+    db_configs = await aiodb.get_all_module_configs(module_name)
+    db_data = await aiodb.get_all_module_data(module_name)
     if db_configs or db_data:
         parts.extend([_build_emoji_part(emojis['DB']), {"text": " Данные в БД:\n", "entity": MessageEntityBold}])
         if db_configs: parts.append({"text": f"• Настроек: {len(db_configs)}\n"})
@@ -31,6 +31,7 @@ from telethon.errors.rpcerrorlist import (
 
 from core import register
 from utils import database as db
+from utils import aiodb
 from main import START_TIME
 from utils.message_builder import build_message, build_and_edit
 from utils.security import check_permission
@@ -187,7 +188,7 @@ async def _build_info_parts(client, force_fallback: bool = False) -> list:
         {"text": "\n"},
     ]
 
-    bio_data = db.get_module_data("profile", "bio_data_v2", default=None)
+    bio_data = await aiodb.get_module_data("profile", "bio_data_v2", default=None)
     if bio_data:
         bio_text = bio_data.get("text", "...")
         bio_entities_raw = bio_data.get("entities", [])
@@ -202,7 +203,7 @@ async def _build_info_parts(client, force_fallback: bool = False) -> list:
     
     parts.append({"text": "\n"}) 
 
-    fields_data = db.get_module_data("profile", "fields_data_v2", default={})
+    fields_data = await aiodb.get_module_data("profile", "fields_data_v2", default={})
     if fields_data:
         for name, data in fields_data.items():
             field_text = data.get("text", "...")
@@ -343,7 +344,7 @@ async def setbio_cmd(event):
                 entities_list.append(e.to_dict()) 
 
     bio_data = {"text": text_content, "entities": entities_list}
-    db.set_module_data("profile", "bio_data_v2", bio_data) 
+    await aiodb.set_module_data("profile", "bio_data_v2", bio_data) 
     await build_and_edit(event, [
         {"text": "✅ "}, 
         {"text": "Био (с форматированием) обновлено!", "entity": MessageEntityBold}
@@ -384,9 +385,9 @@ async def addfield_cmd(event):
                 e.offset -= content_offset
                 entities_list.append(e.to_dict())
 
-    fields = db.get_module_data("profile", "fields_data_v2", default={})
+    fields = await aiodb.get_module_data("profile", "fields_data_v2", default={})
     fields[name] = {"text": value_raw, "entities": entities_list}
-    db.set_module_data("profile", "fields_data_v2", fields)
+    await aiodb.set_module_data("profile", "fields_data_v2", fields)
     await build_and_edit(event, [{"text": f"✅ Поле «{name}» добавлено."}])
 
 @register("delfield", incoming=True)
@@ -401,10 +402,10 @@ async def delfield_cmd(event):
     name = event.pattern_match.group(1)
     if not name:
         return await build_and_edit(event, [{"text": "❌ Укажите название поля."}])
-    fields = db.get_module_data("profile", "fields_data_v2", default={})
+    fields = await aiodb.get_module_data("profile", "fields_data_v2", default={})
     if name in fields:
         del fields[name]
-        db.set_module_data("profile", "fields_data_v2", fields)
+        await aiodb.set_module_data("profile", "fields_data_v2", fields)
         await build_and_edit(event, [{"text": f"🗑️ Поле «{name}» удалено."}])
     else:
         await build_and_edit(event, [{"text": "ℹ️ Поле не найдено."}])
@@ -458,9 +459,9 @@ async def setpemoji_cmd(event):
     key_upper = parsed["key"].upper()
     if key_upper not in _get_static_emojis():
         return await build_and_edit(event, [{"text": "❌ Неизвестный ключ эмодзи."}])
-    custom_emojis = db.get_module_data("profile", "static_emojis", default={})
+    custom_emojis = await aiodb.get_module_data("profile", "static_emojis", default={})
     custom_emojis[key_upper] = {"id": parsed["id"], "fallback": parsed["fallback"]}
-    db.set_module_data("profile", "static_emojis", custom_emojis)
+    await aiodb.set_module_data("profile", "static_emojis", custom_emojis)
     await build_and_edit(event, [
         {"text": "✅ "}, 
         {"text": f"Эмодзи для {key_upper} установлен!", "entity": MessageEntityBold}
@@ -478,10 +479,10 @@ async def delpemoji_cmd(event):
     key_upper = (event.pattern_match.group(1) or "").upper()
     if not key_upper:
         return await build_and_edit(event, [{"text": "❌ Укажите ключ."}])
-    custom_emojis = db.get_module_data("profile", "static_emojis", default={})
+    custom_emojis = await aiodb.get_module_data("profile", "static_emojis", default={})
     if key_upper in custom_emojis:
         del custom_emojis[key_upper]
-        db.set_module_data("profile", "static_emojis", custom_emojis)
+        await aiodb.set_module_data("profile", "static_emojis", custom_emojis)
         await build_and_edit(event, [{"text": f"🗑️ Эмодзи {key_upper} сброшен."}])
     else:
         await build_and_edit(event, [{"text": "ℹ️ Кастомный эмодзи не найден."}])
@@ -497,7 +498,7 @@ async def pemojis_cmd(event):
         
     parts = [{"text": "⚙️ Настройки эмодзи профиля:\n\n"}]
     mapping = _get_static_emojis()
-    custom_keys = db.get_module_data("profile", "static_emojis", default={}).keys()
+    custom_keys = (await aiodb.get_module_data("profile", "static_emojis", default={})).keys()
     for key, details in sorted(mapping.items()):
         is_custom = " (кастомный)" if key in custom_keys else ""
         parts.append(_build_emoji_part(details))
@@ -522,9 +523,9 @@ async def setosemoji_cmd(event):
     if "error" in parsed:
         return await build_and_edit(event, parsed["error"])
     os_name_capitalized = parsed["key"].capitalize()
-    custom_emojis = db.get_module_data("profile", "os_emojis", default={})
+    custom_emojis = await aiodb.get_module_data("profile", "os_emojis", default={})
     custom_emojis[os_name_capitalized] = {"id": parsed["id"], "fallback": parsed["fallback"]}
-    db.set_module_data("profile", "os_emojis", custom_emojis)
+    await aiodb.set_module_data("profile", "os_emojis", custom_emojis)
     await build_and_edit(event, [
         {"text": "✅ "}, 
         {"text": f"Эмодзи для {os_name_capitalized} установлен!", "entity": MessageEntityBold}
@@ -542,10 +543,10 @@ async def delosemoji_cmd(event):
     os_name = (event.pattern_match.group(1) or "").capitalize()
     if not os_name:
         return await build_and_edit(event, [{"text": "❌ Укажите название ОС."}])
-    custom_emojis = db.get_module_data("profile", "os_emojis", default={})
+    custom_emojis = await aiodb.get_module_data("profile", "os_emojis", default={})
     if os_name in custom_emojis:
         del custom_emojis[os_name]
-        db.set_module_data("profile", "os_emojis", custom_emojis)
+        await aiodb.set_module_data("profile", "os_emojis", custom_emojis)
         await build_and_edit(event, [{"text": f"🗑️ Эмодзи {os_name} сброшен."}])
     else:
         await build_and_edit(event, [{"text": "ℹ️ Кастомный эмодзи не найден."}])
@@ -561,7 +562,7 @@ async def osemojis_cmd(event):
         
     parts = [{"text": "⚙️ Настройки эмодзи ОС:\n\n"}]
     mapping = _get_os_emoji_mapping()
-    custom_keys = db.get_module_data("profile", "os_emojis", default={}).keys()
+    custom_keys = (await aiodb.get_module_data("profile", "os_emojis", default={})).keys()
     for os_name, details in sorted(mapping.items()):
         is_custom = " (кастомный)" if os_name in custom_keys else ""
         parts.append(_build_emoji_part(details))
@@ -582,8 +583,8 @@ async def resetemojis_cmd(event):
     if not check_permission(event, min_level="TRUSTED"):
         return
         
-    db.set_module_data("profile", "static_emojis", {})
-    db.set_module_data("profile", "os_emojis", {})
+    await aiodb.set_module_data("profile", "static_emojis", {})
+    await aiodb.set_module_data("profile", "os_emojis", {})
     await build_and_edit(event, [
         {"text": "🗑️ "}, 
         {"text": "Все кастомные эмодзи сброшены.", "entity": MessageEntityBold}
@@ -626,7 +627,7 @@ async def setinfo_cmd(event):
             {"text": f"\nПример: {prefix}setinfo Привет!", "entity": MessageEntityCode},
         ])
     info_data = {"text": text_content, "entities": entities_list}
-    db.set_module_data("profile", "custom_info_v2", info_data)
+    await aiodb.set_module_data("profile", "custom_info_v2", info_data)
     await build_and_edit(event, [
         {"text": "✅ ", "entity": MessageEntityBold},
         {"text": "Кастомное .info установлено!", "entity": MessageEntityBold}
@@ -641,7 +642,7 @@ async def delinfo_cmd(event):
     if not check_permission(event, min_level="TRUSTED"):
         return
         
-    db.set_module_data("profile", "custom_info_v2", None)
+    await aiodb.set_module_data("profile", "custom_info_v2", None)
     await build_and_edit(event, [
         {"text": "🗑️ ", "entity": MessageEntityBold},
         {"text": "Кастомное .info удалено.", "entity": MessageEntityBold}
@@ -696,7 +697,7 @@ async def profile_cmd(event):
     if not check_permission(event, min_level="TRUSTED"):
         return
 
-    custom_info = db.get_module_data("profile", "custom_info_v2", default=None)
+    custom_info = await aiodb.get_module_data("profile", "custom_info_v2", default=None)
     
     if custom_info:
         # LOGIC FOR CUSTOM INFO RENDERING
@@ -11,6 +11,7 @@ author: Kote
 """
 
 import asyncio
+import time
 from telethon import TelegramClient
 from telethon.sessions import StringSession
 from telethon.errors import (
@@ -51,6 +52,16 @@ AUTH_SESSIONS = {}
 
 # --- HELPERS ---
 
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    days, rem = divmod(seconds, 86400)
+    hours, rem = divmod(rem, 3600)
+    minutes, secs = divmod(rem, 60)
+    if days: return f"{days}д {hours}ч"
+    if hours: return f"{hours}ч {minutes}м"
+    if minutes: return f"{minutes}м {secs}с"
+    return f"{secs}с"
+
 async def _handle_error(user_id, msg, e):
     if user_id in AUTH_SESSIONS:
         try:
@@ -203,10 +214,11 @@ async def list_twins_cmd(event):
 
     parts = [{"text": "👥 Ваши твинки:\n\n", "entity": MessageEntityBold}]
     for name, data in stored.items():
-        is_online = name in active
+        health = twin_manager.get_health(name)
+        is_online = health["state"] == "online"
         is_plus = "api_id" in data # Проверка на наличие кастомного API ID
         
-        status_icon = "🟢" if is_online else "🔴"
+        status_icon = {"online": "🟢", "reconnecting": "🟡"}.get(health["state"], "🔴")
         type_icon = "⚡️" if is_plus else "🤖"
         
         parts.append({"text": f"{status_icon} {type_icon} "})
@@ -216,6 +228,19 @@ async def list_twins_cmd(event):
                 me = await active[name].get_me()
                 parts.append({"text": f" (ID: {me.id})"})
             except: pass
+            parts.append({"text": f"\n      ⏱ в сети {_format_duration(health['uptime'])}"})
+        elif health["state"] == "reconnecting":
+            retry = health["retry_in"]
+            parts.append({"text": f"\n      🔄 переподключение {'через ' + _format_duration(retry) if retry else 'сейчас'}"})
+        elif health["state"] == "revoked":
+            parts.append({"text": "\n      ⛔ сессия отозвана — добавьте твинка заново"})
+        if not is_online and data.get("last_seen"):
+            parts.append({"text": f"\n      👁 был в сети {_format_duration(time.time() - data['last_seen'])} назад"})
+        if health["reconnects"]:
+            parts.append({"text": f", переподключений: {health['reconnects']}"})
+        if health["last_error"] and not is_online:
+            parts.append({"text": "\n      ⚠️ "})
+            parts.append({"text": health["last_error"][:100], "entity": MessageEntityCode})
         parts.append({"text": "\n"})
 
     await build_and_edit(event, parts)
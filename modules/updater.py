@@ -11,11 +11,19 @@ author: Kote
 """
 
 import aiohttp
+import asyncio
+import hashlib
+import random
 import time
+import re
 import traceback
+from collections import OrderedDict
 from pathlib import Path
 
 from core import register
+from utils import database as db
+from utils import aiodb
+from utils import http
 from utils.loader import reload_module
 from utils.security import check_permission
 from handlers.user_commands import _call_inline_bot
@@ -23,99 +31,290 @@ from services.module_info_cache import parse_manifest
 
 MODULES_DIR = Path(__file__).parent.parent / "modules"
 
-async def _fetch_from_tg(client, source_url: str) -> str | None:
+# Telegram-источники: сообщения одного канала запрашиваются одним get_messages,
+# файлы качаются параллельно (не больше TG_DOWNLOAD_CONCURRENCY) и кэшируются по msg.file.id
+TG_DOWNLOAD_CONCURRENCY = 4
+TG_FILE_CACHE_SIZE = 32
+_tg_file_cache: "OrderedDict[str, bytes]" = OrderedDict()
+
+def _parse_tg_source(source_url: str):
+    m = re.match(r"tg://([^/]+)/(\d+)", source_url)
+    if not m:
+        return None
+    return m.group(1), int(m.group(2))
+
+async def _read_tg_message(msg, semaphore) -> str | None:
+    # Если в сообщении есть прикреплённый .py файл
+    if msg.file and msg.file.name and msg.file.name.endswith(".py"):
+        file_id = msg.file.id
+        data = _tg_file_cache.get(file_id)
+        if data is None:
+            async with semaphore:
+                data = await msg.download_media(bytes)
+            _tg_file_cache[file_id] = data
+            while len(_tg_file_cache) > TG_FILE_CACHE_SIZE:
+                _tg_file_cache.popitem(last=False)
+        else:
+            _tg_file_cache.move_to_end(file_id)
+        return data.decode("utf-8", errors="ignore")
+    # Если нет файла — берём текст сообщения (редкий случай)
+    return msg.text or None
+
+async def _fetch_tg_channel(client, channel: str, msg_ids: list, semaphore) -> dict:
+    try:
+        messages = await client.get_messages(channel, ids=msg_ids)
+    except Exception as e:
+        print(f"[updater] TG fetch failed for tg://{channel}: {e}")
+        return {}
+    contents = await asyncio.gather(*(
+        _read_tg_message(msg, semaphore) if msg else asyncio.sleep(0)
+        for msg in messages
+    ), return_exceptions=True)
+    result = {}
+    for msg_id, content in zip(msg_ids, contents):
+        if isinstance(content, Exception):
+            print(f"[updater] TG fetch failed for tg://{channel}/{msg_id}: {content}")
+        elif content:
+            result[f"tg://{channel}/{msg_id}"] = content
+    return result
+
+async def _fetch_tg_sources(client, source_urls) -> dict:
     """
-    Скачивает файл модуля из Telegram-канала.
+    Скачивает файлы модулей из Telegram-каналов.
     Формат source: tg://<channel_username_or_id>/<message_id>
     Например: tg://KoteLoader_mods/42
+    Возвращает {source_url: содержимое} для найденных сообщений.
     """
-    import re as _re
-    m = _re.match(r"tg://([^/]+)/(\d+)", source_url)
-    if not m:
+    by_channel = {}
+    for source_url in source_urls:
+        parsed = _parse_tg_source(source_url)
+        if parsed:
+            ids = by_channel.setdefault(parsed[0], [])
+            if parsed[1] not in ids:
+                ids.append(parsed[1])
+
+    semaphore = asyncio.Semaphore(TG_DOWNLOAD_CONCURRENCY)
+    results = await asyncio.gather(*(
+        _fetch_tg_channel(client, channel, ids, semaphore) for channel, ids in by_channel.items()
+    ))
+    contents = {}
+    for result in results:
+        contents.update(result)
+    return contents
+
+async def _fetch_from_tg(client, source_url: str) -> str | None:
+    """Скачивает один файл модуля из Telegram-канала (см. _fetch_tg_sources)."""
+    parsed = _parse_tg_source(source_url)
+    if not parsed:
         return None
-    channel, msg_id = m.group(1), int(m.group(2))
+    contents = await _fetch_tg_sources(client, [source_url])
+    return contents.get(f"tg://{parsed[0]}/{parsed[1]}")
+
+
+# Сколько модулей проверяется одновременно
+CHECK_CONCURRENCY = 8
+CHECK_TIMEOUT = aiohttp.ClientTimeout(total=20)
+# Сколько байт начала файла скачивается для чтения версии
+MANIFEST_PROBE_BYTES = 16 * 1024
+
+def _parse_version(version: str):
     try:
-        msg = await client.get_messages(channel, ids=msg_id)
-        if not msg:
-            return None
-        # Если в сообщении есть прикреплённый .py файл
-        if msg.file and msg.file.name and msg.file.name.endswith(".py"):
-            data = await msg.download_media(bytes)
-            return data.decode("utf-8", errors="ignore")
-        # Если нет файла — берём текст сообщения (редкий случай)
-        return msg.text or None
-    except Exception as e:
-        print(f"[updater] TG fetch failed for {source_url}: {e}")
+        return tuple(map(int, version.split('.')))
+    except (ValueError, AttributeError):
+        return None
+
+async def _fetch_http_manifest(session, module_name: str, source_url: str):
+    """
+    Проба версии модуля без скачивания всего файла.
+    Запрашивается только начало файла (Range на MANIFEST_PROBE_BYTES; если сервер Range не умеет —
+    читаем первый кусок потока и обрываем). Целиком файл качается, только если версии в начале нет.
+    ETag/Last-Modified и удалённая версия хранятся по модулю в БД: неизменный upstream отвечает 304.
+    Возвращает (remote_version, remote_content | None) — содержимое только если файл прочитан целиком.
+    """
+    cached = await aiodb.get_module_data("updater", f"http:{module_name}", default=None)
+    if not isinstance(cached, dict) or cached.get("source") != source_url:
+        cached = None
+
+    headers = {"Range": f"bytes=0-{MANIFEST_PROBE_BYTES - 1}"}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    async with session.get(source_url, headers=headers, timeout=CHECK_TIMEOUT) as response:
+        if response.status == 304 and cached:
+            return cached.get("version"), None
+        if response.status not in (200, 206):
+            return None, None
+        # read(n) отдаёт то, что уже пришло, и может вернуть меньше n — читаем до n байт или до конца
+        try:
+            head = await response.content.readexactly(MANIFEST_PROBE_BYTES)
+            at_eof = response.content.at_eof()
+        except asyncio.IncompleteReadError as e:
+            head, at_eof = e.partial, True
+        if response.status == 206:
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            complete = total.isdigit() and int(total) <= len(head)
+        else:
+            complete = at_eof
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        # Недочитанное тело при выходе из контекста не скачивается — соединение просто закрывается
+
+    remote_content = head.decode("utf-8", errors="ignore")
+    remote_version = parse_manifest(remote_content).get("version")
+    if remote_version in (None, "N/A") and not complete:
+        # Версия объявлена дальше начала файла — единственный случай полной загрузки при проверке
+        async with session.get(source_url, timeout=CHECK_TIMEOUT) as response:
+            if response.status != 200:
+                return None, None
+            remote_content = await response.text()
+        remote_version = parse_manifest(remote_content).get("version")
+        complete = True
+
+    if etag or last_modified:
+        await aiodb.set_module_data("updater", f"http:{module_name}", {
+            "source": source_url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "version": remote_version,
+        })
+    return remote_version, remote_content if complete else None
+
+def _read_local_manifest(module_file: Path):
+    try:
+        with open(module_file, "r", encoding="utf-8") as f:
+            local_manifest = parse_manifest(f.read())
+    except Exception:
         return None
 
+    if not local_manifest or "source" not in local_manifest or "version" not in local_manifest:
+        return None
+
+    source_url = local_manifest["source"]
+    if not source_url or source_url == "local":
+        return None
+    return local_manifest
+
+async def _check_module(module_file: Path, local_manifest: dict, session, semaphore, tg_contents: dict):
+    try:
+        source_url = local_manifest["source"]
+        module_name = ".".join(module_file.relative_to(MODULES_DIR).with_suffix("").parts)
+        remote_content = None
+
+        if source_url.startswith("tg://"):
+            # Источник — Telegram-канал (скачан заранее пачкой по каналам)
+            parsed = _parse_tg_source(source_url)
+            remote_content = tg_contents.get(f"tg://{parsed[0]}/{parsed[1]}") if parsed else None
+            remote_manifest = parse_manifest(remote_content) if remote_content else None
+            remote_version = remote_manifest.get("version") if remote_manifest else None
+        else:
+            # Источник — HTTP
+            async with semaphore:
+                remote_version, remote_content = await _fetch_http_manifest(session, module_name, source_url)
+
+        # Безопасное сравнение версий — пропускаем N/A
+        local_v = _parse_version(local_manifest["version"])
+        remote_v = _parse_version(remote_version)
+        if local_v is None or remote_v is None or remote_v <= local_v:
+            return None
+
+        if remote_content:
+            remote_hash = hashlib.sha256(remote_content.encode("utf-8")).hexdigest()
+        else:
+            # Файл целиком не скачивался — его версию однозначно определяет ETag
+            http_cache = await aiodb.get_module_data("updater", f"http:{module_name}", default={}) or {}
+            remote_hash = http_cache.get("etag") or http_cache.get("last_modified")
+
+        return {
+            "file_path": str(module_file),
+            "module_name": module_name,
+            "old_version": local_manifest["version"],
+            "new_version": remote_version,
+            "source": source_url,
+            "remote_hash": remote_hash,
+            "remote_content": remote_content,  # None, если при проверке файл не читался целиком
+        }
+    except Exception:
+        return None
 
 async def check_for_updates(client=None):
     """
     Сканирует все модули на наличие обновлений.
     Поддерживает source: https://... и source: tg://<channel>/<msg_id>
+    tg://-источники запрашиваются одним get_messages на канал.
+    Модули проверяются параллельно (не больше CHECK_CONCURRENCY одновременно) через общую HTTP-сессию.
     Возвращает список словарей с информацией о найденных обновлениях.
     """
-    updates_to_do = []
+    modules = []
     for module_file in MODULES_DIR.rglob("*.py"):
         if any(part.startswith('.') for part in module_file.parts) or '__pycache__' in module_file.parts:
             continue
+        local_manifest = _read_local_manifest(module_file)
+        if local_manifest:
+            modules.append((module_file, local_manifest))
 
-        try:
-            with open(module_file, "r", encoding="utf-8") as f:
-                content = f.read()
-                local_manifest = parse_manifest(content)
+    tg_sources = [m["source"] for _, m in modules if m["source"].startswith("tg://")]
+    # Без клиента tg://-источники пропускаются
+    tg_contents = await _fetch_tg_sources(client, tg_sources) if client is not None and tg_sources else {}
 
-            if not local_manifest or "source" not in local_manifest or "version" not in local_manifest:
-                continue
+    semaphore = asyncio.Semaphore(CHECK_CONCURRENCY)
+    session = await http.get_session()
+    results = await asyncio.gather(*(
+        _check_module(module_file, local_manifest, session, semaphore, tg_contents)
+        for module_file, local_manifest in modules
+    ))
+    return [result for result in results if result]
 
-            source_url = local_manifest["source"]
-            if not source_url or source_url == "local":
-                continue
+# --- ФОНОВАЯ ПРОВЕРКА ---
+# Результат последней проверки хранится в БД: панель обновлений и .check_updates
+# показывают его сразу, с возрастом данных, не дожидаясь обхода всех модулей.
+UPDATE_CHECK_INTERVAL = 6 * 60 * 60   # сек. между фоновыми проверками
+UPDATE_CHECK_FIRST_DELAY = 120        # сек. после запуска, чтобы не мешать загрузке
+UPDATE_CHECK_JITTER = 0.1             # ±10% к интервалу, чтобы твинки/перезапуски не били в GitHub разом
+_scheduler_task = None
 
-            remote_content = None
+async def refresh_updates_cache(client=None) -> list:
+    """Проверяет обновления и сохраняет результат (без содержимого файлов) в БД."""
+    updates = await check_for_updates(client=client)
+    await aiodb.set_module_data("updater", "last_check", {
+        "checked_at": time.time(),
+        "updates": [{k: v for k, v in u.items() if k != "remote_content"} for u in updates],
+    })
+    return updates
 
-            if source_url.startswith("tg://"):
-                # Источник — Telegram-канал
-                if client is None:
-                    continue  # нет клиента — пропускаем
-                remote_content = await _fetch_from_tg(client, source_url)
-            else:
-                # Источник — HTTP
-                url_to_fetch = f"{source_url}?t={int(time.time())}"
-                headers = {'Cache-Control': 'no-cache', 'Pragma': 'no-cache'}
-                async with aiohttp.ClientSession(trust_env=False) as session:
-                    async with session.get(url_to_fetch, headers=headers) as response:
-                        if response.status != 200:
-                            continue
-                        remote_content = await response.text()
-
-            if not remote_content:
-                continue
-
-            remote_manifest = parse_manifest(remote_content)
-            if not remote_manifest or "version" not in remote_manifest:
-                continue
-
-            # Безопасное сравнение версий — пропускаем N/A
-            try:
-                local_v = tuple(map(int, local_manifest["version"].split('.')))
-                remote_v = tuple(map(int, remote_manifest["version"].split('.')))
-            except ValueError:
-                continue
-
-            if remote_v > local_v:
-                updates_to_do.append({
-                    "file_path": str(module_file),
-                    "module_name": ".".join(module_file.relative_to(MODULES_DIR).with_suffix("").parts),
-                    "old_version": local_manifest["version"],
-                    "new_version": remote_manifest["version"],
-                    "source": local_manifest["source"],
-                    "remote_content": remote_content,  # кешируем чтобы не качать дважды
-                })
-        except Exception:
-            continue
+def get_cached_updates():
+    """Возвращает (обновления, время проверки) из БД или (None, None), если проверок ещё не было."""
+    cached = db.get_module_data("updater", "last_check", default=None)
+    if not isinstance(cached, dict):
+        return None, None
+    return cached.get("updates", []), cached.get("checked_at")
+
+def _forget_update(module_name: str):
+    cached = db.get_module_data("updater", "last_check", default=None)
+    if isinstance(cached, dict):
+        cached["updates"] = [u for u in cached.get("updates", []) if u.get("module_name") != module_name]
+        db.set_module_data("updater", "last_check", cached)
+
+async def _update_check_loop(client):
+    delay = UPDATE_CHECK_FIRST_DELAY * random.uniform(0.5, 1.5)
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            updates = await refresh_updates_cache(client)
+            if updates:
+                print(f"🔔 Доступны обновления модулей: {len(updates)}")
+        except Exception as e:
+            print(f"[updater] Фоновая проверка обновлений не удалась: {e}")
+        delay = UPDATE_CHECK_INTERVAL * random.uniform(1 - UPDATE_CHECK_JITTER, 1 + UPDATE_CHECK_JITTER)
 
-    return updates_to_do
+def start_update_scheduler(client):
+    """Запускает фоновую проверку обновлений (один раз на процесс)."""
+    global _scheduler_task
+    if _scheduler_task is None or _scheduler_task.done():
+        _scheduler_task = asyncio.create_task(_update_check_loop(client))
+    return _scheduler_task
 
 @register("check_updates", incoming=True)
 async def check_updates_cmd(event):
@@ -173,16 +372,13 @@ async def update_cmd(event):
             if found["source"].startswith("tg://"):
                 remote_content = await _fetch_from_tg(event.client, found["source"])
             else:
-                url_to_fetch = f"{found['source']}?t={int(time.time())}"
-                headers = {'Cache-Control': 'no-cache', 'Pragma': 'no-cache'}
-                async with aiohttp.ClientSession(trust_env=False) as session:
-                    async with session.get(url_to_fetch, headers=headers) as response:
-                        remote_content = await response.text()
+                remote_content = await http.fetch_text(found["source"], timeout=CHECK_TIMEOUT)
 
         with open(Path(found["file_path"]), "w", encoding="utf-8") as f:
             f.write(remote_content)
         
         await reload_module(event.client, found["module_name"])
+        _forget_update(found["module_name"])
         await message.edit(f"✅ **Модуль `{found['module_name']}` обновлен до версии {found['new_version']}!**", parse_mode="md")
         
     except Exception:
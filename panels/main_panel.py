@@ -15,15 +15,11 @@ def build_main_panel(page: int = 0, search_query: str = None, as_text: bool = Fa
     """
     raw_loaded = get_loaded_modules()  # {'about', 'admin', 'heroku:FHeta', ...}
 
-    def _get_module_name_from_file(filepath):
-        """Читает strings['name'] из файла модуля если есть."""
+    def _get_module_name_from_file(module_name, filepath):
+        """strings['name'] модуля — из кэша анализа (файл не перечитывается, если не менялся)."""
         try:
-            import ast as _ast2
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as _f:
-                _src = _f.read(4000)  # читаем только первые 4KB
-            _m = re.search(r'["\']name["\'\s]*:\s*["\']([^"\']+)["\']', _src)
-            if _m:
-                return _m.group(1)
+            from utils.loader import analyze_module
+            return analyze_module(module_name, filepath).get("strings_name")
         except Exception:
             pass
         return None
@@ -62,7 +58,7 @@ def build_main_panel(page: int = 0, search_query: str = None, as_text: bool = Fa
         _nfile = _norm(_mfile)
         _file_to_modnames[_nfile] = {_nfile}
         if _fp.exists():
-            _real_name = _get_module_name_from_file(_fp)
+            _real_name = _get_module_name_from_file(_mfile, _fp)
             if _real_name:
                 _file_to_modnames[_nfile].add(_norm(_real_name))
 
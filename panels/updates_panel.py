@@ -1,14 +1,26 @@
 # panels/updates_panel.py
 
+import time
 from telethon.tl.custom import Button
 
-def build_updates_panel(updates: list):
+def _format_age(seconds: float) -> str:
+    seconds = max(0, int(seconds))
+    if seconds < 60:
+        return "только что"
+    if seconds < 3600:
+        return f"{seconds // 60} мин. назад"
+    if seconds < 86400:
+        return f"{seconds // 3600} ч. назад"
+    return f"{seconds // 86400} дн. назад"
+
+def build_updates_panel(updates: list, checked_at: float = None):
     """
     Собирает меню со списком доступных обновлений.
     Всегда возвращает HTML-текст и кнопки, так как используется только в inline-режиме.
     
     Args:
         updates: Список словарей с информацией об обновлениях.
+        checked_at: Время проверки (для результатов из кэша) — показывается возраст данных.
     """
     buttons = []
     
@@ -29,6 +41,10 @@ def build_updates_panel(updates: list):
         if len(updates) > 1:
             buttons.insert(0, [Button.inline("🚀 Обновить всё", data="do_update:all")])
 
+    if checked_at:
+        text += f"\n\n<i>🕒 Проверено {_format_age(time.time() - checked_at)}</i>"
+        buttons.append([Button.inline("🔄 Проверить сейчас", data="run_updates_check")])
+
     buttons.append([Button.inline("❌ Закрыть", data="close_panel")])
     
     return text, buttons
\ No newline at end of file
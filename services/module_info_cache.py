@@ -147,6 +147,15 @@ def parse_manifest(content: str) -> dict:
 
     return meta
 
+def get_module_manifest(module_name: str, module_path: Path = None) -> dict | None:
+    """
+    Манифест модуля из кэша анализа (utils.loader.analyze_module):
+    файл перечитывается и парсится заново, только если изменился его хеш.
+    """
+    from utils.loader import analyze_module
+    analysis = analyze_module(module_name, module_path)
+    return analysis.get("manifest")
+
 def get_module_info(module_name: str) -> str:
     """Возвращает только описание модуля (для меню)."""
     module_path = MODULES_DIR / f"{module_name}.py"
@@ -154,8 +163,7 @@ def get_module_info(module_name: str) -> str:
         return "Описание отсутствует."
     
     try:
-        content = module_path.read_text(encoding='utf-8')
-        manifest = parse_manifest(content)
+        manifest = get_module_manifest(module_name, module_path)
         return manifest["description"]
     except Exception:
         return "Описание отсутствует."
@@ -172,9 +180,8 @@ def cache_modules_info():
         module_import_name = ".".join(module_path.relative_to(MODULES_DIR).with_suffix("").parts)
         
         try:
-            # Читаем файл как текст, чтобы не исполнять код при кешировании
-            content = module_path.read_text(encoding='utf-8')
-            manifest = parse_manifest(content)
+            # Код не исполняется: манифест берётся из кэша анализа по хешу файла
+            manifest = get_module_manifest(module_import_name, module_path)
             info[module_import_name] = manifest["description"]
         except Exception as e:
             # print(f"Не удалось получить информацию из {module_import_name}: {e}")
@@ -182,4 +189,4 @@ def cache_modules_info():
             
     with MODULES_INFO_FILE.open("w", encoding="utf-8") as f:
         json.dump(info, f, indent=4, ensure_ascii=False)
-    print(f"ℹ️ Информация о {len(info)} модулях закеширована.")
\ No newline at end of file
+    print(f"ℹ️ Информация о {len(info)} модулях закеширована.")
@@ -0,0 +1,477 @@
+# services/proxy_manager.py
+"""
+MTProto прокси: параллельная проверка, рейтинг по задержке и переключение на лету.
+
+Проверка (probe) меряет две вещи:
+  tcp       — время TCP-подключения к прокси;
+  handshake — время connect() Telethon через прокси (TCP + обмен ключами MTProto).
+Все прокси проверяются одновременно, так что старт стоит один таймаут, а не N.
+
+Рейтинг хранится в config.ini, секция [mtproto], ключ ranking:
+  server|port|tcp_ms|handshake_ms|status|checked_at;...
+
+Мониторинг (start_monitor) раз в monitor_interval секунд меряет RTT:
+  TCP-подключение ко всем прокси из списка и ping через живое соединение текущего.
+Если средний ping текущего выше rtt_threshold_ms или доля потерь выше loss_threshold,
+а другой прокси отвечает быстрее и проходит рукопожатие, клиенты переводятся на него.
+Пороги настраиваются в [mtproto] config.ini; история RTT и переключения — в .proxy history.
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+
+PROBE_TIMEOUT = 10        # сек. на всю проверку одного прокси
+TCP_TIMEOUT = 5           # сек. на TCP-подключение
+FAILOVER_CHECK_INTERVAL = 5
+FAILOVER_AFTER = 15       # сек. без соединения до переключения на другой прокси
+
+# Мониторинг RTT (значения по умолчанию; переопределяются в [mtproto] config.ini)
+MONITOR_INTERVAL = 30     # monitor_interval — сек. между замерами
+RTT_THRESHOLD_MS = 1500   # rtt_threshold_ms — средний ping текущего прокси, выше которого ищем замену
+LOSS_THRESHOLD = 0.4      # loss_threshold — доля потерянных замеров в окне
+PING_TIMEOUT = 10
+WINDOW = 5                # замеров в окне для среднего и потерь
+HISTORY_SIZE = 60         # замеров в истории на прокси
+SWITCH_COOLDOWN = 300     # сек. после переключения, когда мониторинг не переключает снова
+MIN_GAIN = 0.7            # замена должна быть хотя бы на 30% быстрее текущего
+
+# Текущий прокси основного клиента ({'server', 'port', 'secret'} или None)
+current = None
+_failover_task = None
+_monitor_task = None
+_switch_lock = asyncio.Lock()
+_last_switch = 0.0
+
+# История: {"server:port": deque[(time, tcp_ms | None)]}, ping текущего прокси — отдельно
+rtt_history = {}
+ping_history = deque(maxlen=HISTORY_SIZE)   # (time, server:port, ping_ms | None)
+switch_events = deque(maxlen=20)            # {"time", "from", "to", "reason"}
+
+
+def proxy_key(px: dict) -> str:
+    return f"{px['server']}:{px['port']}"
+
+
+def connection_kwargs(px: dict) -> dict:
+    """kwargs для TelegramClient: класс соединения по типу секрета + кортеж прокси."""
+    from network.faketls_connection import get_connection_class
+    return {
+        "connection": get_connection_class(px["secret"]),
+        "proxy": (px["server"], px["port"], px["secret"]),
+    }
+
+
+# ── Проверка ─────────────────────────────────────────────────────────────────
+
+async def _measure_tcp(px: dict) -> float:
+    started = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(px["server"], px["port"]), timeout=TCP_TIMEOUT)
+    elapsed = time.perf_counter() - started
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return elapsed
+
+
+async def _measure_handshake(px: dict, api_id: int, api_hash: str) -> float:
+    from telethon import TelegramClient
+    from telethon.sessions import MemorySession
+
+    client = TelegramClient(MemorySession(), api_id, api_hash, connection_retries=0, **connection_kwargs(px))
+    started = time.perf_counter()
+    try:
+        await client.connect()
+        if not client.is_connected():
+            raise ConnectionError("соединение не установлено")
+        return time.perf_counter() - started
+    finally:
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+
+
+async def probe(px: dict, api_id: int, api_hash: str, timeout: float = PROBE_TIMEOUT) -> dict:
+    """
+    Проверяет один прокси. status:
+      ok   — MTProto-рукопожатие прошло;
+      tcp  — порт открыт, но рукопожатие не удалось (FakeTLS может требовать другой клиент);
+      dead — не отвечает.
+    """
+    result = {"server": px["server"], "port": px["port"], "secret": px["secret"],
+              "tcp_ms": None, "handshake_ms": None, "status": "dead", "error": None, "checked_at": time.time()}
+    try:
+        result["tcp_ms"] = await _measure_tcp(px) * 1000
+        result["status"] = "tcp"
+        remaining = max(1.0, timeout - result["tcp_ms"] / 1000)
+        result["handshake_ms"] = await asyncio.wait_for(_measure_handshake(px, api_id, api_hash), timeout=remaining) * 1000
+        result["status"] = "ok"
+    except asyncio.TimeoutError:
+        result["error"] = "таймаут"
+    except Exception as e:
+        result["error"] = str(e) or e.__class__.__name__
+    return result
+
+
+def _rank_key(result: dict):
+    order = {"ok": 0, "tcp": 1, "dead": 2}[result["status"]]
+    latency = result["handshake_ms"] if result["status"] == "ok" else result["tcp_ms"]
+    return order, latency if latency is not None else float("inf")
+
+
+async def probe_all(proxies: list, api_id: int, api_hash: str, timeout: float = PROBE_TIMEOUT) -> list:
+    """Проверяет все прокси параллельно. Возвращает результаты от лучшего к худшему."""
+    results = await asyncio.gather(*(probe(px, api_id, api_hash, timeout) for px in proxies))
+    return sorted(results, key=_rank_key)
+
+
+def best_healthy(results: list, exclude: dict = None):
+    """Самый быстрый прокси с пройденным рукопожатием (кроме exclude) или None."""
+    for r in results:
+        if r["status"] == "ok" and (exclude is None or proxy_key(r) != proxy_key(exclude)):
+            return {"server": r["server"], "port": r["port"], "secret": r["secret"]}
+    return None
+
+
+# ── Рейтинг в config.ini ─────────────────────────────────────────────────────
+
+def _fmt_ms(value) -> str:
+    return "-" if value is None else f"{value:.0f}"
+
+
+def _parse_ms(value: str):
+    return None if value in ("", "-") else float(value)
+
+
+def save_ranking(config, config_file: str, results: list):
+    """Сохраняет таблицу задержек в [mtproto] ranking."""
+    if not config.has_section("mtproto"):
+        config.add_section("mtproto")
+    config["mtproto"]["ranking"] = ";".join(
+        f"{r['server']}|{r['port']}|{_fmt_ms(r['tcp_ms'])}|{_fmt_ms(r['handshake_ms'])}|{r['status']}|{r['checked_at']:.0f}"
+        for r in results
+    )
+    with open(config_file, "w", encoding="utf-8") as f:
+        config.write(f)
+
+
+def load_ranking(config) -> list:
+    """Последняя сохранённая таблица задержек (в порядке рейтинга)."""
+    if not config.has_section("mtproto"):
+        return []
+    result = []
+    for item in config.get("mtproto", "ranking", fallback="").split(";"):
+        parts = item.strip().split("|")
+        if len(parts) != 6 or not parts[1].isdigit():
+            continue
+        try:
+            result.append({
+                "server": parts[0], "port": int(parts[1]),
+                "tcp_ms": _parse_ms(parts[2]), "handshake_ms": _parse_ms(parts[3]),
+                "status": parts[4] if parts[4] in ("ok", "tcp", "dead") else "dead",
+                "checked_at": float(parts[5]),
+            })
+        except ValueError:
+            continue
+    return result
+
+
+# ── Переключение на лету ─────────────────────────────────────────────────────
+
+def transport_connected(client) -> bool:
+    """Поднят ли сетевой транспорт клиента (is_connected() остаётся True и во время переподключения)."""
+    connection = getattr(getattr(client, "_sender", None), "_connection", None)
+    return bool(connection is not None and getattr(connection, "_connected", False))
+
+
+# Замена соединения на лету опирается на внутренности Telethon 1.x (версия закреплена в
+# requirements.txt). Если их нет, клиент переподключается через disconnect/connect, а
+# run_until_disconnected ниже не даёт этому переподключению завершить юзербот.
+_SENDER_ATTRS = ("_connection", "_start_reconnect")
+_CLIENT_ATTRS = ("_connection", "_sender", "_log", "_proxy", "_local_addr")
+_reconnecting = {}   # клиент -> {"parked", "done"} (asyncio.Event) на время disconnect/connect
+_running = set()     # клиенты, которых держит run_until_disconnected
+
+
+def _can_swap_connection(client) -> bool:
+    sender = getattr(client, "_sender", None)
+    return (all(hasattr(client, attr) for attr in _CLIENT_ATTRS)
+            and all(hasattr(sender, attr) for attr in _SENDER_ATTRS)
+            and hasattr(client.session, "server_address"))
+
+
+async def switch_proxy(client, px: dict):
+    """
+    Переводит подключённый клиент на другой прокси, не останавливая run_until_disconnected.
+    Telethon.set_proxy для MTProxy меняет только адрес, но не секрет и не класс соединения,
+    поэтому соединение отправителя заменяется целиком, а переподключение делает сам Telethon.
+    """
+    if not _can_swap_connection(client):
+        await _reconnect_via_proxy(client, px)
+        return
+
+    kwargs = connection_kwargs(px)
+    client._connection = kwargs["connection"]
+    client.set_proxy(kwargs["proxy"])
+
+    sender = client._sender
+    old = sender._connection
+    sender._connection = client._connection(
+        client.session.server_address,
+        client.session.port,
+        client.session.dc_id,
+        loggers=client._log,
+        proxy=client._proxy,
+        local_addr=client._local_addr,
+    )
+    if old is not None and old._connected:
+        # Живое соединение: запускаем переподключение (оно возьмёт новое соединение)
+        # и закрываем старое. Если транспорт уже упал, идущий цикл переподключения
+        # Telethon подхватит новое соединение на следующей попытке.
+        sender._start_reconnect(None)
+        await old.disconnect()
+
+
+async def _reconnect_via_proxy(client, px: dict):
+    """Запасной путь без внутренностей Telethon: disconnect, новый прокси, connect."""
+    kwargs = connection_kwargs(px)
+    state = {"parked": asyncio.Event(), "done": asyncio.Event()}
+    _reconnecting[client] = state
+    try:
+        await client.disconnect()
+        if client in _running:
+            # Дожидаемся, пока run_until_disconnected закончит свой disconnect() в finally,
+            # иначе он разорвёт уже новое соединение
+            try:
+                await asyncio.wait_for(state["parked"].wait(), timeout=PROBE_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        if hasattr(client, "_connection"):
+            client._connection = kwargs["connection"]
+        client.set_proxy(kwargs["proxy"])
+        await client.connect()
+    finally:
+        _reconnecting.pop(client, None)
+        state["done"].set()
+
+
+async def run_until_disconnected(client):
+    """client.run_until_disconnected(), который переживает переподключение через _reconnect_via_proxy."""
+    _running.add(client)
+    try:
+        while True:
+            await client.run_until_disconnected()
+            state = _reconnecting.get(client)
+            if state is None:
+                return
+            state["parked"].set()
+            await state["done"].wait()
+            if not client.is_connected():
+                return
+    finally:
+        _running.discard(client)
+
+
+async def switch_all(clients: list, px: dict, reason: str) -> bool:
+    """Переводит все клиенты на px и записывает событие переключения."""
+    global current, _last_switch
+    async with _switch_lock:
+        if current is not None and proxy_key(current) == proxy_key(px):
+            return False
+        for client in clients:
+            try:
+                await switch_proxy(client, px)
+                if not client.is_connected():
+                    # Клиент успел исчерпать попытки переподключения — _start_reconnect
+                    # его уже не поднимет, подключаем заново через новый прокси
+                    await client.connect()
+            except Exception as e:
+                print(f"⚠️ Не удалось переключить клиент на {proxy_key(px)}: {e}")
+        switch_events.append({
+            "time": time.time(),
+            "from": proxy_key(current) if current else None,
+            "to": proxy_key(px),
+            "reason": reason,
+        })
+        print(f"🔀 Переключено на прокси {proxy_key(px)} ({reason})")
+        current = dict(px)
+        _last_switch = time.monotonic()
+        return True
+
+
+async def _failover_loop(clients: list, proxies: list, api_id: int, api_hash: str, config, config_file: str):
+    down_since = None
+    while True:
+        await asyncio.sleep(FAILOVER_CHECK_INTERVAL)
+        # Следим за всеми клиентами (юзербот и инлайн-бот), а не только за основным
+        if current is None or not any(c.is_connected() and not transport_connected(c) for c in clients):
+            down_since = None
+            continue
+        down_since = down_since or time.monotonic()
+        if time.monotonic() - down_since < FAILOVER_AFTER or len(proxies) < 2:
+            continue
+
+        print(f"⚠️ Прокси {proxy_key(current)} не отвечает {FAILOVER_AFTER}+ сек. — ищу замену...")
+        results = await probe_all(proxies, api_id, api_hash)
+        save_ranking(config, config_file, results)
+        best = best_healthy(results, exclude=current)
+        if best is None:
+            print("⚠️ Рабочих прокси нет — Telethon продолжает переподключаться к текущему")
+            down_since = time.monotonic()
+            continue
+        await switch_all(clients, best, f"нет соединения {FAILOVER_AFTER}+ сек.")
+        down_since = None
+
+
+def start_failover(clients: list, proxies: list, api_id: int, api_hash: str, config, config_file: str):
+    """
+    Запускает фоновое переключение: если транспорт любого из клиентов лежит дольше FAILOVER_AFTER,
+    прокси перепроверяются и клиенты переводятся на самый быстрый рабочий.
+    proxies — живой список из main.py (его меняет .proxy add/del).
+    """
+    global _failover_task
+    if _failover_task is None or _failover_task.done():
+        _failover_task = asyncio.create_task(
+            _failover_loop([c for c in clients if c is not None], proxies, api_id, api_hash, config, config_file)
+        )
+    return _failover_task
+
+
+# ── Мониторинг RTT ───────────────────────────────────────────────────────────
+
+def _setting(config, key: str, default: float) -> float:
+    try:
+        return config.getfloat("mtproto", key, fallback=default)
+    except ValueError:
+        return default
+
+
+def _record(history: deque, value):
+    history.append((time.time(), value))
+
+
+async def _sample_tcp(px: dict):
+    try:
+        return await _measure_tcp(px) * 1000
+    except Exception:
+        return None
+
+
+async def _sample_ping(client):
+    """
+    RTT запроса через живое соединение клиента (клиент → прокси → DC и обратно).
+    Пинг идёт мимо планировщика utils.flood (TelegramClient.__call__ напрямую, даже если клиент —
+    SafeClient), иначе ожидание в очереди токенов попало бы в RTT.
+    """
+    from telethon import TelegramClient
+    from telethon.tl.functions import PingRequest
+    started = time.perf_counter()
+    try:
+        request = PingRequest(ping_id=random.getrandbits(63))
+        await asyncio.wait_for(TelegramClient.__call__(client, request), timeout=PING_TIMEOUT)
+    except Exception:
+        return None
+    return (time.perf_counter() - started) * 1000
+
+
+def window_stats(samples) -> dict:
+    """Среднее (по успешным) и доля потерь по последним WINDOW замерам."""
+    recent = [v for _, v in list(samples)[-WINDOW:]]
+    ok = [v for v in recent if v is not None]
+    return {
+        "samples": len(recent),
+        "avg": sum(ok) / len(ok) if ok else None,
+        "loss": (len(recent) - len(ok)) / len(recent) if recent else 0.0,
+    }
+
+
+def get_rtt_stats() -> dict:
+    """{server:port: {"samples", "avg", "loss", "last"}} по TCP-замерам мониторинга."""
+    result = {}
+    for key, samples in rtt_history.items():
+        stats = window_stats(samples)
+        stats["last"] = samples[-1][1] if samples else None
+        result[key] = stats
+    return result
+
+
+def get_ping_stats() -> dict:
+    samples = [(t, v) for t, key, v in ping_history if current and key == proxy_key(current)]
+    return window_stats(samples)
+
+
+def _degraded(config) -> str | None:
+    """Причина замены текущего прокси или None, если он в порядке."""
+    ping = get_ping_stats()
+    if ping["samples"] < WINDOW:
+        return None
+    loss_limit = _setting(config, "loss_threshold", LOSS_THRESHOLD)
+    rtt_limit = _setting(config, "rtt_threshold_ms", RTT_THRESHOLD_MS)
+    if ping["loss"] > loss_limit:
+        return f"потери {ping['loss']:.0%} > {loss_limit:.0%}"
+    if ping["avg"] is not None and ping["avg"] > rtt_limit:
+        return f"ping {ping['avg']:.0f} мс > {rtt_limit:.0f} мс"
+    return None
+
+
+def _candidates(proxies: list) -> list:
+    """Альтернативы без потерь в окне, быстрее текущего хотя бы на MIN_GAIN, от лучшей к худшей."""
+    stats = get_rtt_stats()
+    own = stats.get(proxy_key(current), {}) if current else {}
+    own_avg = own.get("avg") if own.get("loss", 1.0) < 1.0 else None
+    found = []
+    for px in proxies:
+        if current is not None and proxy_key(px) == proxy_key(current):
+            continue
+        st = stats.get(proxy_key(px))
+        if not st or st["avg"] is None or st["loss"] > 0:
+            continue
+        if own_avg is None or st["avg"] < own_avg * MIN_GAIN:
+            found.append((st["avg"], px))
+    return [px for _, px in sorted(found, key=lambda item: item[0])]
+
+
+async def _monitor_loop(clients: list, proxies: list, api_id: int, api_hash: str, config):
+    main_client = clients[0]
+    while True:
+        await asyncio.sleep(_setting(config, "monitor_interval", MONITOR_INTERVAL))
+        if current is None:
+            continue
+        try:
+            snapshot = list(proxies)
+            tcp, ping = await asyncio.gather(
+                asyncio.gather(*(_sample_tcp(px) for px in snapshot)),
+                _sample_ping(main_client),
+            )
+            for px, value in zip(snapshot, tcp):
+                _record(rtt_history.setdefault(proxy_key(px), deque(maxlen=HISTORY_SIZE)), value)
+            ping_history.append((time.time(), proxy_key(current), ping))
+
+            reason = _degraded(config)
+            if reason is None or time.monotonic() - _last_switch < SWITCH_COOLDOWN:
+                continue
+            # TCP-замер не гарантирует MTProto — кандидата проверяем полным рукопожатием
+            for px in _candidates(proxies):
+                result = await probe(px, api_id, api_hash)
+                if result["status"] == "ok":
+                    await switch_all(clients, px, reason)
+                    break
+        except Exception as e:
+            print(f"⚠️ Ошибка мониторинга прокси: {e}")
+
+
+def start_monitor(clients: list, proxies: list, api_id: int, api_hash: str, config):
+    """
+    Запускает фоновый замер RTT текущего и запасных прокси с переключением на лету
+    при превышении порогов задержки или потерь. proxies — живой список из main.py.
+    """
+    global _monitor_task
+    if _monitor_task is None or _monitor_task.done():
+        _monitor_task = asyncio.create_task(
+            _monitor_loop([c for c in clients if c is not None], proxies, api_id, api_hash, config)
+        )
+    return _monitor_task
@@ -2,25 +2,51 @@
 import asyncio
 import json
 import random
+import time
 from pathlib import Path
-from telethon import TelegramClient
+from telethon import TelegramClient, events
 from telethon.sessions import StringSession
 from configparser import ConfigParser
+from utils import database as db
 
 TWINS_FILE = Path(__file__).parent.parent / "twins.json"
 CONFIG_FILE = Path(__file__).parent.parent / "config.ini"
 
+# Старт: твинки подключаются параллельно, не больше START_CONCURRENCY одновременно
+# (переопределяется настройкой twin_start_concurrency).
+START_CONCURRENCY = 5
+START_TIMEOUT = 30          # сек. на connect() + is_user_authorized() одного твинка
+# Супервизор: раз в SUPERVISE_INTERVAL проверяет соединения и переподключает упавшие
+# с экспоненциальной задержкой BACKOFF_BASE * 2^n (не больше BACKOFF_MAX, ±20% разброса).
+SUPERVISE_INTERVAL = 15
+BACKOFF_BASE = 5
+BACKOFF_MAX = 600
+
 class TwinManager:
     def __init__(self):
         self.clients = {}
+        # {имя: {"state", "connected_at", "reconnects", "failures", "next_attempt", "last_error"}}
+        self.health = {}
         self.global_api_id = None
         self.global_api_hash = None
+        self._supervisor = None
+        self._config_mtime = None
+        self._migrated = False
+        # Шина событий твинков: одна таблица watcher'ов (@watcher(twins=True)) на всех клиентов
+        self.watchers = []
+        self._watcher_index = {}
+        self._watcher_index_dirty = False
+        self._watcher_seq = 0
         self._load_config()
 
     def _load_config(self):
-        """Загружает глобальные API ID/Hash из конфига."""
+        """Загружает глобальные API ID/Hash из конфига (повторно — только если config.ini изменился)."""
         if not CONFIG_FILE.exists():
             return
+        mtime = CONFIG_FILE.stat().st_mtime
+        if mtime == self._config_mtime:
+            return
+        self._config_mtime = mtime
 
         config = ConfigParser()
         try:
@@ -31,61 +57,55 @@ class TwinManager:
         except Exception:
             pass
 
-    def get_stored_twins(self) -> dict:
-        """Возвращает словарь твинков. Автоматически мигрирует старый формат."""
+    def _migrate_json(self):
+        """Переносит твинков из старого twins.json в таблицу twins (один раз)."""
+        self._migrated = True
         if not TWINS_FILE.exists():
-            return {}
+            return
         try:
             with open(TWINS_FILE, "r", encoding="utf-8") as f:
                 data = json.load(f)
-                
-            # Миграция: если формат старый {"name": "session_str"}, переделываем в структуру
-            migrated_data = {}
-            needs_save = False
-            
+            stored = db.get_twins()
             for name, value in data.items():
+                if name in stored:
+                    continue
+                # Совсем старый формат: {"name": "session_str"}
                 if isinstance(value, str):
-                    migrated_data[name] = {"session": value}
-                    needs_save = True
-                else:
-                    migrated_data[name] = value
-            
-            if needs_save:
-                with open(TWINS_FILE, "w", encoding="utf-8") as f:
-                    json.dump(migrated_data, f, indent=4)
-                    
-            return migrated_data
-        except Exception:
-            return {}
+                    value = {"session": value}
+                db.save_twin(name, value["session"], api_id=value.get("api_id"), api_hash=value.get("api_hash"))
+            TWINS_FILE.rename(TWINS_FILE.with_suffix(".json.migrated"))
+            print(f"👥 Твинки перенесены из {TWINS_FILE.name} в базу данных: {len(data)}")
+        except Exception as e:
+            print(f"⚠️ Не удалось перенести твинков из {TWINS_FILE.name}: {e}")
+
+    def get_stored_twins(self) -> dict:
+        """Возвращает словарь твинков {имя: запись} из кэша БД."""
+        if not self._migrated:
+            self._migrate_json()
+        return db.get_twins()
 
     def save_twin(self, name: str, session_str: str, api_id: int = None, api_hash: str = None):
         """Сохраняет твинка. Если переданы api_id/hash — это Twin+."""
-        data = self.get_stored_twins()
-        
-        entry = {"session": session_str}
-        if api_id and api_hash:
-            entry["api_id"] = api_id
-            entry["api_hash"] = api_hash
-            
-        data[name] = entry
-        
-        with open(TWINS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
+        if not self._migrated:
+            self._migrate_json()
+        db.save_twin(name, session_str, api_id=api_id, api_hash=api_hash)
 
     def remove_twin_data(self, name: str):
-        data = self.get_stored_twins()
-        if name in data:
-            del data[name]
-            with open(TWINS_FILE, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=4)
+        self.health.pop(name, None)
+        db.remove_twin(name)
 
     async def start_twin(self, name: str):
         # Если уже запущен, возвращаем объект
         if name in self.clients and self.clients[name].is_connected():
             return self.clients[name]
+        # Клиент есть, но соединение упало — переподключаем тот же объект,
+        # чтобы не потерять навешанные на него обработчики
+        if name in self.clients:
+            return await self._reconnect(name)
 
-        stored = self.get_stored_twins()
-        twin_data = stored.get(name)
+        if not self._migrated:
+            self._migrate_json()
+        twin_data = db.get_twin(name)
         
         if not twin_data:
             raise ValueError(f"Твинк {name} не найден.")
@@ -98,7 +118,7 @@ class TwinManager:
         t_api_hash = twin_data.get("api_hash") or self.global_api_hash
 
         if not t_api_id or not t_api_hash:
-            # Если глобальные не загрузились сразу, пробуем перечитать
+            # Если глобальные не загрузились сразу, пробуем перечитать (если config.ini менялся)
             self._load_config()
             t_api_id = t_api_id or self.global_api_id
             t_api_hash = t_api_hash or self.global_api_hash
@@ -106,43 +126,221 @@ class TwinManager:
             if not t_api_id:
                 raise ValueError("API ID/Hash не найдены ни в твинке, ни в config.ini")
 
+        client = None
         try:
             client = TelegramClient(
                 StringSession(session_str), 
                 t_api_id, 
                 t_api_hash
             )
-            await client.connect()
-            
-            if not await client.is_user_authorized():
-                # Если сессия умерла
-                raise Exception("Session revoked")
+            await asyncio.wait_for(self._connect_checked(client), timeout=START_TIMEOUT)
+        except BaseException as e:
+            # Недостроенный клиент закрываем в любом случае (в т.ч. при отмене снаружи),
+            # иначе каждая неудачная попытка оставляет висеть живое соединение.
+            # Из БД твинка не удаляем — сбой может быть временным
+            if client is not None:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+            if isinstance(e, Exception):
+                if isinstance(e, asyncio.TimeoutError):
+                    e = Exception(f"нет ответа за {START_TIMEOUT} сек")
+                self._mark_failed(name, e)
+                raise e
+            raise
 
-            self.clients[name] = client
-            return client
-        except Exception as e:
-            # Если ошибка при старте, удаляем из памяти (но не из файла, вдруг временный сбой)
-            if name in self.clients:
-                del self.clients[name]
+        self.clients[name] = client
+        self._install_bus(name, client)
+        self._mark_online(name)
+        # Твинки, добавленные после старта (.addtwin), тоже должны быть под присмотром
+        self.start_supervisor()
+        return client
+
+    @staticmethod
+    async def _connect_checked(client):
+        await client.connect()
+        if not await client.is_user_authorized():
+            # Если сессия умерла
+            raise Exception("Session revoked")
+
+    async def _reconnect(self, name: str):
+        client = self.clients[name]
+        try:
+            await asyncio.wait_for(self._connect_checked(client), timeout=START_TIMEOUT)
+        except asyncio.TimeoutError:
+            e = Exception(f"нет ответа за {START_TIMEOUT} сек")
+            self._mark_failed(name, e)
             raise e
+        except Exception as e:
+            self._mark_failed(name, e)
+            raise
+        self._health(name)["reconnects"] += 1
+        self._mark_online(name)
+        return client
+
+    # --- ШИНА СОБЫТИЙ ---
+    # На каждом твинке висит один обработчик _dispatch; маршруты и их индекс общие
+    # (та же раскладка по корзинам, что у диспетчера watcher'ов основного клиента в utils.loader).
+    # Обработчик получает событие с атрибутом twin_name — именем твинка, которому оно пришло.
+
+    def add_watcher(self, module_name: str, func, handler, timeout: float = None) -> bool:
+        """Подписывает func на события всех твинков. Только для events.NewMessage, иначе False."""
+        if type(handler) is not events.NewMessage:
+            return False
+        self._watcher_seq += 1
+        self.watchers.append({
+            "module": module_name,
+            "func": func,
+            "handler": handler,
+            "timeout": timeout,
+            "seq": self._watcher_seq,
+        })
+        self._watcher_index_dirty = True
+        return True
+
+    def remove_watchers(self, module_name: str):
+        """Снимает все подписки модуля."""
+        self.watchers[:] = [r for r in self.watchers if r["module"] != module_name]
+        self._watcher_index_dirty = True
+
+    def _install_bus(self, name: str, client):
+        client._twin_name = name
+        if not getattr(client, "_twin_bus_installed", False):
+            client.add_event_handler(self._dispatch, events.NewMessage())
+            client._twin_bus_installed = True
+
+    async def _dispatch(self, event):
+        from utils import loader
+        if self._watcher_index_dirty:
+            self._watcher_index_dirty = False
+            routes = list(self.watchers)
+            await loader._resolve_watcher_routes(routes, event.client)
+            self._watcher_index = loader._index_watcher_routes(routes)
+        if not self._watcher_index:
+            return
+        candidates = loader._match_watcher_routes(self._watcher_index, event)
+        if not candidates:
+            return
+        event.twin_name = getattr(event.client, "_twin_name", None)
+        stopped = await asyncio.gather(*(loader._run_watcher(route, event) for route in candidates))
+        if any(stopped):
+            raise events.StopPropagation
+
+    # --- ЗДОРОВЬЕ ---
+
+    def _health(self, name: str) -> dict:
+        return self.health.setdefault(name, {
+            "state": "offline", "connected_at": None, "reconnects": 0,
+            "failures": 0, "next_attempt": 0.0, "last_error": None,
+        })
+
+    def _mark_online(self, name: str):
+        h = self._health(name)
+        h.update(state="online", connected_at=time.time(), failures=0, next_attempt=0.0, last_error=None)
+        db.touch_twin(name, h["connected_at"])
+
+    def _mark_failed(self, name: str, error: Exception):
+        h = self._health(name)
+        h["connected_at"] = None
+        h["last_error"] = str(error)
+        if str(error) == "Session revoked":
+            # Сессию отозвали — переподключение не поможет, нужен повторный .addtwin
+            h["state"] = "revoked"
+            return
+        h["failures"] += 1
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (h["failures"] - 1))
+        h["next_attempt"] = time.monotonic() + delay * random.uniform(0.8, 1.2)
+        h["state"] = "reconnecting"
+
+    def get_health(self, name: str) -> dict:
+        """Состояние твинка для .twins: state, uptime (сек.), reconnects, retry_in (сек.), last_error."""
+        h = dict(self._health(name))
+        client = self.clients.get(name)
+        if h["state"] == "online" and not (client and client.is_connected()):
+            h["state"] = "reconnecting"
+        h["uptime"] = time.time() - h["connected_at"] if h["state"] == "online" and h["connected_at"] else None
+        h["retry_in"] = max(0.0, h["next_attempt"] - time.monotonic()) if h["state"] == "reconnecting" else None
+        return h
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            for name in list(self.health):
+                # Ошибка по одному твинку не должна останавливать присмотр за остальными
+                try:
+                    await self._supervise_one(name)
+                except Exception as e:
+                    print(f"⚠️ Супервизор твинков: ошибка для {name}: {e}")
+
+    async def _supervise_one(self, name: str):
+        # Твинк мог быть удалён (.deltwin), пока переподключались предыдущие
+        h = self.health.get(name)
+        if h is None:
+            return
+        if db.get_twin(name) is None:
+            self.health.pop(name, None)
+            return
+        if h["state"] in ("revoked", "stopped"):
+            return
+        client = self.clients.get(name)
+        if client is not None and client.is_connected():
+            return
+        now = time.monotonic()
+        if h["state"] == "online":
+            # Соединение упало (Telethon исчерпал свои попытки) — первая попытка сразу
+            print(f"⚠️ Твинк {name} отключился, переподключаю...")
+            h["state"], h["connected_at"], h["next_attempt"] = "reconnecting", None, now
+        if now < h["next_attempt"]:
+            return
+        # Ошибки (и таймауты) отмечают сами start_twin/_reconnect
+        try:
+            if client is not None:
+                await self._reconnect(name)
+            else:
+                await self.start_twin(name)
+                self._health(name)["reconnects"] += 1
+            print(f"✅ Твинк {name} снова в сети")
+        except Exception:
+            if self.health.get(name, {}).get("state") == "revoked":
+                print(f"⚠️ Сессия твинка {name} отозвана — переподключение остановлено")
+
+    def start_supervisor(self):
+        if self._supervisor is None or self._supervisor.done():
+            self._supervisor = asyncio.create_task(self._supervise())
+        return self._supervisor
 
     async def stop_twin(self, name: str):
+        if name in self.health:
+            self.health[name]["state"] = "stopped"
         if name in self.clients:
             await self.clients[name].disconnect()
             del self.clients[name]
 
     async def start_all_twins(self):
+        """Запускает всех твинков параллельно (не больше twin_start_concurrency сразу) и супервизор."""
+        # Супервизор нужен и без твинков на старте — их могут добавить позже через .addtwin
+        self.start_supervisor()
         stored = self.get_stored_twins()
         if not stored: return 0
-            
-        count = 0
-        for name in stored.keys():
-            try:
-                await self.start_twin(name)
-                count += 1
-            except Exception as e:
-                print(f"⚠️ Не удалось запустить твинка {name}: {e}")
-        return count
+
+        try:
+            limit = max(1, int(db.get_setting("twin_start_concurrency", default=str(START_CONCURRENCY))))
+        except ValueError:
+            limit = START_CONCURRENCY
+        semaphore = asyncio.Semaphore(limit)
+
+        async def _start(name):
+            async with semaphore:
+                try:
+                    await self.start_twin(name)
+                    return True
+                except Exception as e:
+                    print(f"⚠️ Не удалось запустить твинка {name}: {e}")
+                    return False
+
+        results = await asyncio.gather(*(_start(name) for name in stored))
+        return sum(results)
 
     def get_client(self, name: str):
         return self.clients.get(name)
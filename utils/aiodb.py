@@ -0,0 +1,111 @@
+# utils/aiodb.py
+
+import asyncio
+import queue
+import threading
+from typing import Any, Callable, Dict
+
+from utils import database as db
+
+# Асинхронный фасад над utils.database.
+# Все обращения к SQLite выполняются в одном выделенном потоке по очереди запросов,
+# поэтому блокировка базы (твинки, внешние утилиты, медленный диск) не замораживает event loop.
+# Встроенные модули читают и пишут module_storage из обработчиков команд через aiodb.
+# Синхронный API utils.database остаётся для синхронного кода: хелперов, Heroku-совместимых
+# self.get/self.set и старых модулей. Промахи кэша там обычно не доходят до SQLite
+# (module_storage прогревается целиком), но сам вызов по-прежнему берёт _db_lock
+# и может подождать, пока поток aiodb или сброс записей держат блокировку.
+
+_requests: "queue.SimpleQueue" = queue.SimpleQueue()
+_thread: threading.Thread | None = None
+_thread_lock = threading.Lock()
+_STOP = object()
+
+def _db_thread():
+    while True:
+        item = _requests.get()
+        if item is _STOP:
+            break
+        func, args, kwargs, loop, future = item
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_set_exception, future, e)
+        else:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_set_result, future, result)
+
+def _set_result(future: asyncio.Future, result: Any):
+    if not future.done():
+        future.set_result(result)
+
+def _set_exception(future: asyncio.Future, exc: BaseException):
+    if not future.done():
+        future.set_exception(exc)
+
+def _ensure_thread():
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_db_thread, name="aiodb", daemon=True)
+            _thread.start()
+
+def run(func: Callable, *args, **kwargs) -> "asyncio.Future":
+    """Ставит вызов синхронной функции БД в очередь потока aiodb. Запросы выполняются строго по порядку."""
+    _ensure_thread()
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _requests.put((func, args, kwargs, loop, future))
+    return future
+
+def shutdown(timeout: float = 5.0):
+    """Дожидается выполнения уже поставленных запросов и останавливает поток."""
+    global _thread
+    with _thread_lock:
+        thread, _thread = _thread, None
+    if thread is not None and thread.is_alive():
+        _requests.put(_STOP)
+        thread.join(timeout)
+
+# --- SETTINGS ---
+async def get_setting(key: str, default: str = None) -> str:
+    # Настройки целиком лежат в памяти — поток не нужен
+    return db.get_setting(key, default)
+
+async def set_setting(key: str, value: str):
+    return await run(db.set_setting, key, value)
+
+# --- MODULE DATA ---
+async def get_module_data(module_name: str, data_key: str, default: Any = None, user_id: int = 0, chat_id: int = 0) -> Any:
+    value = db._peek_module_data(module_name, data_key, 'data', default, user_id, chat_id)
+    if value is not db._NOT_CACHED:
+        return value
+    return await run(db.get_module_data, module_name, data_key, default, user_id, chat_id)
+
+async def set_module_data(module_name: str, data_key: str, data_value: Any, user_id: int = 0, chat_id: int = 0):
+    return await run(db.set_module_data, module_name, data_key, data_value, user_id, chat_id)
+
+async def get_module_config(module_name: str, config_key: str, default: Any = None, user_id: int = 0) -> Any:
+    value = db._peek_module_data(module_name, config_key, 'config', default, user_id, 0)
+    if value is not db._NOT_CACHED:
+        return value
+    return await run(db.get_module_config, module_name, config_key, default, user_id)
+
+async def set_module_config(module_name: str, config_key: str, config_value: Any, user_id: int = 0):
+    return await run(db.set_module_config, module_name, config_key, config_value, user_id)
+
+async def get_all_module_data(module_name: str, user_id: int = 0, chat_id: int = 0) -> Dict[str, Any]:
+    return await run(db.get_all_module_data, module_name, user_id, chat_id)
+
+async def get_all_module_configs(module_name: str, user_id: int = 0) -> Dict[str, Any]:
+    return await run(db.get_all_module_configs, module_name, user_id)
+
+async def remove_module_data(module_name: str, data_key: str = None, user_id: int = 0, chat_id: int = 0):
+    return await run(db.remove_module_data, module_name, data_key, user_id, chat_id)
+
+async def remove_module_config(module_name: str, config_key: str = None, user_id: int = 0):
+    return await run(db.remove_module_config, module_name, config_key, user_id)
+
+async def flush_module_writes() -> int:
+    return await run(db.flush_module_writes)
@@ -2,12 +2,19 @@
 # utils/database.py
 import sqlite3
 import json
+import copy
+import os
 import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import Any, Dict, Optional
 
 DB_FILE = Path(__file__).parent.parent / "database.db"
+# Сессии твинков — полный доступ к аккаунтам, поэтому они лежат в отдельном файле:
+# database.db уходит в чат через .db_backup и перезаписывается .restore_db
+TWINS_DB_FILE = Path(__file__).parent.parent / "twins.db"
 connection = None
+twins_connection = None
 _db_lock = threading.RLock()
 
 # --- КЭШИ В ПАМЯТИ (Для скорости) ---
@@ -15,6 +22,26 @@ _settings_cache: Dict[str, str] = {}
 _users_cache: Dict[int, str] = {}
 _users_list_cache: Dict[str, list] = {}
 _aliases_cache: list = []
+_analysis_cache: Dict[str, dict] = {}
+_twins_cache: Dict[str, dict] = {}
+
+# LRU-кэш декодированных значений module_storage:
+# (module_name, key, storage_type, user_id, chat_id) -> значение (или _MISSING)
+MODULE_DATA_CACHE_SIZE = 4096
+_module_data_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+_module_data_stats = {"hits": 0, "misses": 0}
+_MISSING = object()
+# True, пока в кэше лежит вся таблица (прогрев при старте уместился и ничего не вытеснено):
+# тогда промах кэша означает «ключа нет» и синхронные get_module_data/config не ходят в SQLite
+_module_cache_complete = False
+
+# Write-behind для module_storage: повторные записи одного ключа схлопываются
+# и сбрасываются одной транзакцией по таймеру или при накоплении порога.
+WRITE_BEHIND_INTERVAL = 1.0
+WRITE_BEHIND_MAX_PENDING = 500
+_pending_writes: Dict[tuple, str] = {}
+_flush_timer: Optional[threading.Timer] = None
+_write_stats = {"writes": 0, "flushes": 0, "flushed_rows": 0}
 
 def db_connect():
     """Устанавливает соединение с базой данных с увеличенным таймаутом."""
@@ -47,6 +74,102 @@ def init_aliases_table():
             )
         """)
 
+def init_module_analysis_table():
+    with _db_lock:
+        cursor = connection.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS module_analysis (
+                module_name TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                analysis TEXT NOT NULL
+            )
+        """)
+
+def init_twins_table():
+    global twins_connection
+    with _db_lock:
+        if twins_connection is None:
+            created = not TWINS_DB_FILE.exists()
+            twins_connection = sqlite3.connect(TWINS_DB_FILE, timeout=10.0, isolation_level=None, check_same_thread=False)
+            twins_connection.row_factory = sqlite3.Row
+            twins_connection.execute("PRAGMA journal_mode=WAL;")
+            if created and os.name == "posix":
+                os.chmod(TWINS_DB_FILE, 0o600)
+        cursor = twins_connection.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS twins (
+                name TEXT PRIMARY KEY,
+                session TEXT NOT NULL,
+                api_id INTEGER,
+                api_hash TEXT,
+                flags TEXT NOT NULL DEFAULT '{}',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_seen REAL,
+                connects INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        _move_twins_out_of_main_db()
+
+def _move_twins_out_of_main_db():
+    """Переносит таблицу twins из database.db (старая схема) в twins.db и вычищает её из основной БД."""
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'twins'")
+    if cursor.fetchone() is None:
+        return
+    cursor.execute("SELECT name, session, api_id, api_hash, flags, created_at, last_seen, connects FROM twins")
+    rows = [tuple(row) for row in cursor.fetchall()]
+    twins_connection.executemany("""
+        INSERT OR IGNORE INTO twins (name, session, api_id, api_hash, flags, created_at, last_seen, connects)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    cursor.execute("DROP TABLE twins")
+    # VACUUM переписывает файл — иначе строки сессий остаются в свободных страницах database.db
+    cursor.execute("VACUUM")
+    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    print(f"🔐 Сессии твинков перенесены в {TWINS_DB_FILE.name}: {len(rows)}")
+
+def migrate_module_storage():
+    """
+    Переводит module_storage на уникальный составной ключ, чтобы запись была одним UPSERT.
+    Дубликаты (остатки старой схемы UPDATE-then-INSERT) схлопываются до самой свежей строки.
+    """
+    with _db_lock:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_module_storage_key'")
+        if cursor.fetchone() is None:
+            print("🔧 Миграция module_storage: уникальный индекс...")
+            cursor.execute("BEGIN")
+            try:
+                cursor.execute("""
+                    DELETE FROM module_storage WHERE id NOT IN (
+                        SELECT MAX(id) FROM module_storage
+                        GROUP BY module_name, storage_type, user_id, chat_id, storage_key
+                    )
+                """)
+                if cursor.rowcount:
+                    print(f"   удалено дубликатов: {cursor.rowcount}")
+                cursor.execute("DROP INDEX IF EXISTS idx_module_storage_lookup")
+                # Порядок колонок — под выборки get_all_module_configs/get_all_module_data (префикс без ключа)
+                cursor.execute("""
+                    CREATE UNIQUE INDEX idx_module_storage_key
+                    ON module_storage(module_name, storage_type, user_id, chat_id, storage_key)
+                """)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+        # Покрывающие индексы: get_modules_stats и get_all_module_sources читают только их
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_module_storage_stats
+            ON module_storage(module_name, storage_type, updated_at)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_module_storage_sources
+            ON module_storage(storage_type, storage_key, module_name, storage_value)
+            WHERE storage_type = 'config' AND storage_key = 'source_url'
+        """)
+
 def _warmup_cache():
     print("🔥 Прогрев кэша базы данных...")
     with _db_lock:
@@ -68,6 +191,31 @@ def _warmup_cache():
         cursor.execute("SELECT * FROM aliases")
         _aliases_cache = [dict(row) for row in cursor.fetchall()]
 
+        _warmup_module_storage(cursor)
+
+        for row in twins_connection.execute("SELECT * FROM twins").fetchall():
+            _twins_cache[row['name']] = _twin_from_row(row)
+
+        cursor.execute("SELECT module_name, content_hash, analysis FROM module_analysis")
+        for row in cursor.fetchall():
+            try:
+                _analysis_cache[row['module_name']] = {"hash": row['content_hash'], "data": json.loads(row['analysis'])}
+            except (json.JSONDecodeError, TypeError):
+                pass
+
+def _warmup_module_storage(cursor):
+    """Загружает module_storage в кэш целиком, если таблица помещается в MODULE_DATA_CACHE_SIZE."""
+    global _module_cache_complete
+    cursor.execute("SELECT COUNT(*) FROM module_storage")
+    if cursor.fetchone()[0] > MODULE_DATA_CACHE_SIZE:
+        _module_cache_complete = False
+        return
+    cursor.execute("SELECT module_name, storage_key, storage_type, user_id, chat_id, storage_value FROM module_storage")
+    for row in cursor.fetchall():
+        cache_key = (row['module_name'], row['storage_key'], row['storage_type'], row['user_id'], row['chat_id'])
+        _module_data_cache[cache_key] = _decode_value(row['storage_value'])
+    _module_cache_complete = True
+
 def init_db():
     print("Инициализация базы данных...")
     db = db_connect()
@@ -88,14 +236,12 @@ def init_db():
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
-        # Индекс для ускорения поиска данных модулей
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_module_storage_lookup 
-            ON module_storage(module_name, storage_key, storage_type, user_id, chat_id)
-        """)
     
+    migrate_module_storage()
     init_hidden_modules_table()
     init_aliases_table()
+    init_module_analysis_table()
+    init_twins_table()
     _warmup_cache()
     print("✅ База данных готова (WAL mode).")
 
@@ -141,37 +287,177 @@ def get_users_by_level(level: str) -> list:
     return res
 
 # --- MODULE DATA ---
-def _store_module_data(module_name: str, key: str, value: Any, storage_type: str = 'data', user_id: int = 0, chat_id: int = 0):
-    value_str = json.dumps(value, ensure_ascii=False) if not isinstance(value, str) else value
+def _decode_value(value_str: str) -> Any:
+    try:
+        return json.loads(value_str)
+    except (json.JSONDecodeError, TypeError):
+        return value_str
+
+def _cache_put(cache_key: tuple, value: Any):
+    global _module_cache_complete
+    with _db_lock:
+        _module_data_cache[cache_key] = value
+        _module_data_cache.move_to_end(cache_key)
+        while len(_module_data_cache) > MODULE_DATA_CACHE_SIZE:
+            _module_data_cache.popitem(last=False)
+            _module_cache_complete = False
+
+def _matches(pattern: tuple, cache_key: tuple) -> bool:
+    return all(p is None or p == c for p, c in zip(pattern, cache_key))
+
+def _cache_invalidate(module_name: str, key: str = None, storage_type: str = None, user_id: int = None, chat_id: int = None):
+    """
+    Удаляет из кэша записи, совпадающие по всем переданным полям.
+    Несброшенные записи по тем же ключам отбрасываются — строки всё равно удаляются.
+    """
+    pattern = (module_name, key, storage_type, user_id, chat_id)
+    with _db_lock:
+        for cache_key in list(_module_data_cache):
+            if _matches(pattern, cache_key):
+                del _module_data_cache[cache_key]
+        for cache_key in list(_pending_writes):
+            if _matches(pattern, cache_key):
+                del _pending_writes[cache_key]
+
+def get_module_cache_stats() -> Dict[str, int]:
+    """Счётчики кэша module_storage (для .db_stats)."""
+    with _db_lock:
+        return {
+            "hits": _module_data_stats["hits"],
+            "misses": _module_data_stats["misses"],
+            "size": len(_module_data_cache),
+            "capacity": MODULE_DATA_CACHE_SIZE,
+            "pending": len(_pending_writes),
+            "writes": _write_stats["writes"],
+            "flushes": _write_stats["flushes"],
+            "flushed_rows": _write_stats["flushed_rows"],
+        }
+
+def flush_module_writes() -> int:
+    """
+    Сбрасывает накопленные записи module_storage одной транзакцией.
+    Возвращает количество записанных строк.
+    """
+    global _flush_timer
     with _db_lock:
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+        if not _pending_writes or connection is None:
+            return 0
+
+        batch = dict(_pending_writes)
+        _pending_writes.clear()
         cursor = connection.cursor()
-        cursor.execute("""
-            UPDATE module_storage 
-            SET storage_value = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE module_name = ? AND storage_key = ? AND storage_type = ? AND user_id = ? AND chat_id = ?
-        """, (value_str, module_name, key, storage_type, user_id, chat_id))
-
-        if cursor.rowcount == 0:
-            cursor.execute("""
+        try:
+            cursor.execute("BEGIN")
+            cursor.executemany("""
                 INSERT INTO module_storage 
                 (module_name, storage_key, storage_value, storage_type, user_id, chat_id)
                 VALUES (?, ?, ?, ?, ?, ?)
-            """, (module_name, key, value_str, storage_type, user_id, chat_id))
+                ON CONFLICT(module_name, storage_type, user_id, chat_id, storage_key)
+                DO UPDATE SET storage_value = excluded.storage_value, updated_at = CURRENT_TIMESTAMP
+            """, [
+                (module_name, key, value_str, storage_type, user_id, chat_id)
+                for (module_name, key, storage_type, user_id, chat_id), value_str in batch.items()
+            ])
+            cursor.execute("COMMIT")
+        except Exception as e:
+            try:
+                cursor.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            # Возвращаем пачку в очередь, не затирая более свежие значения
+            for cache_key, value_str in batch.items():
+                _pending_writes.setdefault(cache_key, value_str)
+            print(f"⚠️ Ошибка сброса данных модулей ({len(batch)} записей): {e}")
+            _schedule_flush()
+            return 0
+
+        _write_stats["flushes"] += 1
+        _write_stats["flushed_rows"] += len(batch)
+        return len(batch)
+
+def _schedule_flush():
+    global _flush_timer
+    with _db_lock:
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(WRITE_BEHIND_INTERVAL, flush_module_writes)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+def _store_module_data(module_name: str, key: str, value: Any, storage_type: str = 'data', user_id: int = 0, chat_id: int = 0):
+    value_str = json.dumps(value, ensure_ascii=False) if not isinstance(value, str) else value
+    cache_key = (module_name, key, storage_type, user_id, chat_id)
+    with _db_lock:
+        _pending_writes[cache_key] = value_str
+        _write_stats["writes"] += 1
+        # Write-through в кэш: чтение сразу видит то, что вернул бы SELECT + json.loads
+        _cache_put(cache_key, _decode_value(value_str))
+
+        if len(_pending_writes) >= WRITE_BEHIND_MAX_PENDING:
+            flush_module_writes()
+        else:
+            _schedule_flush()
 
 def _get_module_data(module_name: str, key: str, storage_type: str = 'data', default: Any = None, user_id: int = 0, chat_id: int = 0) -> Any:
+    cache_key = (module_name, key, storage_type, user_id, chat_id)
     with _db_lock:
-        cursor = connection.cursor()
-        cursor.execute("""
-            SELECT storage_value FROM module_storage 
-            WHERE module_name = ? AND storage_key = ? AND storage_type = ? AND user_id = ? AND chat_id = ?
-        """, (module_name, key, storage_type, user_id, chat_id))
-        result = cursor.fetchone()
+        value = _module_data_cache.get(cache_key, None)
+        if cache_key in _module_data_cache:
+            _module_data_cache.move_to_end(cache_key)
+            _module_data_stats["hits"] += 1
+        elif cache_key in _pending_writes:
+            # Запись вытеснена из кэша, но ещё не сброшена в БД
+            _module_data_stats["hits"] += 1
+            value = _decode_value(_pending_writes[cache_key])
+            _cache_put(cache_key, value)
+        elif _module_cache_complete:
+            _module_data_stats["hits"] += 1
+            value = _MISSING
+        else:
+            _module_data_stats["misses"] += 1
+            cursor = connection.cursor()
+            cursor.execute("""
+                SELECT storage_value FROM module_storage 
+                WHERE module_name = ? AND storage_key = ? AND storage_type = ? AND user_id = ? AND chat_id = ?
+            """, (module_name, key, storage_type, user_id, chat_id))
+            result = cursor.fetchone()
+            value = _decode_value(result['storage_value']) if result else _MISSING
+            _cache_put(cache_key, value)
     
-    if not result: return default
+    if value is _MISSING: return default
+    # Отдаём копию изменяемых значений, чтобы правки вызывающего не попали в кэш мимо БД
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
+_NOT_CACHED = object()
+
+def _peek_module_data(module_name: str, key: str, storage_type: str = 'data', default: Any = None, user_id: int = 0, chat_id: int = 0) -> Any:
+    """
+    Чтение только из кэша, без ожидания блокировки и без SQL (для utils.aiodb).
+    Возвращает _NOT_CACHED, если ответа без похода в БД нет.
+    """
+    cache_key = (module_name, key, storage_type, user_id, chat_id)
+    if not _db_lock.acquire(blocking=False):
+        return _NOT_CACHED
     try:
-        return json.loads(result['storage_value'])
-    except (json.JSONDecodeError, TypeError):
-        return result['storage_value']
+        if cache_key in _module_data_cache:
+            value = _module_data_cache[cache_key]
+            _module_data_cache.move_to_end(cache_key)
+        elif cache_key in _pending_writes or not _module_cache_complete:
+            return _NOT_CACHED
+        else:
+            value = _MISSING
+        _module_data_stats["hits"] += 1
+    finally:
+        _db_lock.release()
+
+    if value is _MISSING: return default
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
 
 # Обертки для удобства
 def set_module_config(module_name: str, config_key: str, config_value: Any, user_id: int = 0):
@@ -187,6 +473,7 @@ def get_module_data(module_name: str, data_key: str, default: Any = None, user_i
     return _get_module_data(module_name, data_key, 'data', default, user_id, chat_id)
 
 def get_all_module_configs(module_name: str, user_id: int = 0) -> Dict[str, Any]:
+    flush_module_writes()
     with _db_lock:
         cursor = connection.cursor()
         cursor.execute("""
@@ -203,6 +490,7 @@ def get_all_module_configs(module_name: str, user_id: int = 0) -> Dict[str, Any]
     return configs
 
 def get_all_module_data(module_name: str, user_id: int = 0, chat_id: int = 0) -> Dict[str, Any]:
+    flush_module_writes()
     with _db_lock:
         cursor = connection.cursor()
         cursor.execute("""
@@ -225,6 +513,7 @@ def remove_module_config(module_name: str, config_key: str = None, user_id: int
             cursor.execute("DELETE FROM module_storage WHERE module_name = ? AND storage_key = ? AND storage_type = 'config' AND user_id = ?", (module_name, config_key, user_id))
         else:
             cursor.execute("DELETE FROM module_storage WHERE module_name = ? AND storage_type = 'config' AND user_id = ?", (module_name, user_id))
+        _cache_invalidate(module_name, config_key, 'config', user_id)
 
 def remove_module_data(module_name: str, data_key: str = None, user_id: int = 0, chat_id: int = 0):
     with _db_lock:
@@ -233,14 +522,17 @@ def remove_module_data(module_name: str, data_key: str = None, user_id: int = 0,
             cursor.execute("DELETE FROM module_storage WHERE module_name = ? AND storage_key = ? AND storage_type = 'data' AND user_id = ? AND chat_id = ?", (module_name, data_key, user_id, chat_id))
         else:
             cursor.execute("DELETE FROM module_storage WHERE module_name = ? AND storage_type = 'data' AND user_id = ? AND chat_id = ?", (module_name, user_id, chat_id))
+        _cache_invalidate(module_name, data_key, 'data', user_id, chat_id)
 
 def clear_module(module_name: str):
     with _db_lock:
         cursor = connection.cursor()
         cursor.execute("DELETE FROM module_storage WHERE module_name = ?", (module_name,))
+        _cache_invalidate(module_name)
     print(f"🗑️ Все данные модуля '{module_name}' удалены.")
 
 def get_modules_stats() -> Dict[str, Dict]:
+    flush_module_writes()
     with _db_lock:
         cursor = connection.cursor()
         cursor.execute("""
@@ -262,6 +554,7 @@ def get_modules_stats() -> Dict[str, Dict]:
     return stats
 
 def get_all_module_sources() -> Dict[str, str]:
+    flush_module_writes()
     with _db_lock:
         cursor = connection.cursor()
         cursor.execute("SELECT module_name, storage_value FROM module_storage WHERE storage_type = 'config' AND storage_key = 'source_url'")
@@ -287,6 +580,25 @@ def get_hidden_modules() -> list:
         cursor.execute("SELECT module_name FROM hidden_modules")
         return [row['module_name'] for row in cursor.fetchall()]
 
+# --- MODULE ANALYSIS CACHE ---
+def get_module_analysis(module_name: str, content_hash: str) -> Optional[dict]:
+    """Результат анализа модуля, если он сделан для файла с этим хешем."""
+    entry = _analysis_cache.get(module_name)
+    if entry and entry["hash"] == content_hash:
+        return entry["data"]
+    return None
+
+def set_module_analysis(module_name: str, content_hash: str, analysis: dict):
+    _analysis_cache[module_name] = {"hash": content_hash, "data": analysis}
+    if connection is None:
+        return
+    with _db_lock:
+        cursor = connection.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO module_analysis (module_name, content_hash, analysis) VALUES (?, ?, ?)",
+            (module_name, content_hash, json.dumps(analysis, ensure_ascii=False))
+        )
+
 # --- ALIASES ---
 def _refresh_aliases_cache():
     global _aliases_cache
@@ -313,9 +625,76 @@ def get_aliases_by_command(real_command: str) -> list:
 def get_all_aliases() -> list:
     return _aliases_cache
 
+# --- TWINS ---
+# Записи твинков целиком живут в _twins_cache (прогревается в init_db), twins.db только пишется.
+def _twin_from_row(row) -> dict:
+    twin = {"session": row['session'], "flags": {}, "last_seen": row['last_seen'], "connects": row['connects']}
+    try:
+        twin["flags"] = json.loads(row['flags'] or "{}")
+    except (json.JSONDecodeError, TypeError):
+        pass
+    # api_id/api_hash только у Twin+ — по наличию ключа их и отличают
+    if row['api_id'] and row['api_hash']:
+        twin["api_id"], twin["api_hash"] = row['api_id'], row['api_hash']
+    return twin
+
+def get_twins() -> Dict[str, dict]:
+    """Все твинки: {имя: {"session", "api_id"?, "api_hash"?, "flags", "last_seen", "connects"}} (копия)."""
+    return copy.deepcopy(_twins_cache)
+
+def get_twin(name: str) -> Optional[dict]:
+    twin = _twins_cache.get(name)
+    return copy.deepcopy(twin) if twin is not None else None
+
+def save_twin(name: str, session: str, api_id: int = None, api_hash: str = None, flags: dict = None):
+    """Добавляет или перезаписывает твинка (статистика подключений сбрасывается)."""
+    with _db_lock:
+        cursor = twins_connection.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO twins (name, session, api_id, api_hash, flags) VALUES (?, ?, ?, ?, ?)",
+            (name, session, api_id if api_hash else None, api_hash if api_id else None,
+             json.dumps(flags or {}, ensure_ascii=False))
+        )
+        cursor.execute("SELECT * FROM twins WHERE name = ?", (name,))
+        _twins_cache[name] = _twin_from_row(cursor.fetchone())
+
+def remove_twin(name: str):
+    _twins_cache.pop(name, None)
+    with _db_lock:
+        cursor = twins_connection.cursor()
+        cursor.execute("DELETE FROM twins WHERE name = ?", (name,))
+
+def touch_twin(name: str, last_seen: float):
+    """Отмечает успешное подключение твинка."""
+    twin = _twins_cache.get(name)
+    if twin is None:
+        return
+    twin["last_seen"] = last_seen
+    twin["connects"] += 1
+    with _db_lock:
+        cursor = twins_connection.cursor()
+        cursor.execute("UPDATE twins SET last_seen = ?, connects = connects + 1 WHERE name = ?", (last_seen, name))
+
+def sanitize_restored_db(path):
+    """
+    Чистит файл бэкапа перед .restore_db от того, чему нельзя доверять из чужого файла:
+    кэш module_analysis хранит вердикты scan_code — подложенный бэкап мог бы заранее
+    объявить «чистыми» нужные хеши. После восстановления модули будут проверены заново.
+    """
+    restored = sqlite3.connect(path)
+    try:
+        restored.execute("DROP TABLE IF EXISTS module_analysis")
+        restored.commit()
+    finally:
+        restored.close()
+
 def close_db():
-    global connection
+    global connection, twins_connection
+    if twins_connection is not None:
+        twins_connection.close()
+        twins_connection = None
     if connection is not None:
+        flush_module_writes()
         connection.close()
         connection = None
         print("Соединение с базой данных закрыто.")
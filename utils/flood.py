@@ -0,0 +1,113 @@
+# utils/flood.py
+
+import asyncio
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from telethon.errors import FloodWaitError
+
+# Планировщик запросов с учётом FloodWait.
+# Дедлайн FloodWait запоминается по типу запроса (EditMessageRequest, SendMessageRequest, ...):
+# запросы того же типа паркуются до дедлайна, остальные идут без задержки.
+# Через планировщик идут запросы модулей (SafeClient.__call__); собственные запросы ядра
+# и служебный трафик Telethon (обновления, GetDifference) его не касаются.
+#
+# Приоритетная полоса — команды владельца (выставляет command_router): они не стоят
+# в общей очереди ratelimit "api" и не висят минутами на чужом FloodWait, а сразу получают ошибку.
+# Полоса действует, только пока выполняется сама команда: задачи, которые она запустила через
+# create_task, наследуют контекст, но после выхода из owner_lane() идут общей очередью.
+
+class _Lane:
+    __slots__ = ("active",)
+
+    def __init__(self):
+        self.active = True
+
+OWNER_LANE = contextvars.ContextVar("owner_lane", default=None)
+OWNER_MAX_PARK = 10      # дольше этого команда владельца не ждёт, а получает FloodWaitError
+MAX_RETRIES = 3          # повторы фонового запроса после FloodWait
+MAX_TOTAL_PARK = 600     # дольше этого (суммарно за все повторы) фоновый запрос не ждёт, а получает FloodWaitError
+
+_deadlines = {}          # {тип запроса: time.monotonic() окончания FloodWait}
+_stats = {"flood_waits": 0, "parked": 0, "parked_seconds": 0.0, "owner_rejected": 0, "rejected": 0}
+
+@contextmanager
+def owner_lane(enabled: bool = True):
+    """Выполняет блок в приоритетной полосе (enabled=False — без изменений)."""
+    if not enabled:
+        yield
+        return
+    lane = _Lane()
+    token = OWNER_LANE.set(lane)
+    try:
+        yield
+    finally:
+        lane.active = False
+        OWNER_LANE.reset(token)
+
+def in_owner_lane() -> bool:
+    lane = OWNER_LANE.get()
+    return lane is not None and lane.active
+
+def _request_key(request) -> str:
+    if isinstance(request, (list, tuple)):
+        request = request[0] if request else None
+    return request.__class__.__name__
+
+def _remaining(key: str) -> float:
+    deadline = _deadlines.get(key)
+    if deadline is None:
+        return 0.0
+    left = deadline - time.monotonic()
+    if left <= 0:
+        _deadlines.pop(key, None)
+        return 0.0
+    return left
+
+async def _park(key: str, owner: bool, request, budget: float) -> float:
+    """Ждёт дедлайн FloodWait по типу запроса, если он укладывается в budget. Возвращает время ожидания."""
+    left = _remaining(key)
+    if not left:
+        return 0.0
+    if left > budget:
+        if owner:
+            _stats["owner_rejected"] += 1
+        else:
+            _stats["rejected"] += 1
+        raise FloodWaitError(request=request, capture=int(left) + 1)
+    _stats["parked"] += 1
+    _stats["parked_seconds"] += left
+    await asyncio.sleep(left)
+    return left
+
+async def call(invoke, request, *args, **kwargs):
+    """
+    Выполняет invoke(request, ...) с учётом FloodWait-дедлайнов.
+    invoke — исходный __call__ клиента.
+    """
+    from utils import ratelimit
+
+    key = _request_key(request)
+    owner = in_owner_lane()
+    if not owner:
+        await ratelimit.acquire("api")
+
+    budget = OWNER_MAX_PARK if owner else MAX_TOTAL_PARK
+    for attempt in range(MAX_RETRIES + 1):
+        budget -= await _park(key, owner, request, budget)
+        try:
+            return await invoke(request, *args, **kwargs)
+        except FloodWaitError as e:
+            _stats["flood_waits"] += 1
+            deadline = time.monotonic() + e.seconds
+            if deadline > _deadlines.get(key, 0):
+                _deadlines[key] = deadline
+            logging.warning(f"⏳ FloodWait {e.seconds} сек. на {key} — такие запросы приостановлены")
+            if owner or attempt == MAX_RETRIES:
+                raise
+
+def get_stats() -> dict:
+    """Счётчики планировщика и активные дедлайны {тип запроса: секунд осталось}."""
+    active = {key: round(left, 1) for key in list(_deadlines) if (left := _remaining(key))}
+    return dict(_stats, active=active)
@@ -0,0 +1,69 @@
+# utils/http.py
+
+import asyncio
+import aiohttp
+
+# Общий HTTP-клиент загрузчика.
+# Одна aiohttp-сессия на процесс: keep-alive соединения, кэш DNS и лимит соединений на хост —
+# массовая установка и проверка обновлений не платят за DNS/TCP/TLS на каждый запрос.
+#
+# Модули получают её так:
+#   from utils import http
+#   session = await http.get_session()
+#   async with session.get(url) as resp: ...
+# или короче: text = await http.fetch_text(url)
+
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10)
+CONNECTION_LIMIT = 64          # всего одновременных соединений
+CONNECTION_LIMIT_PER_HOST = 8  # на один хост (github, raw.githubusercontent, ...)
+DNS_CACHE_TTL = 300            # сек.
+KEEPALIVE_TIMEOUT = 30         # сек. простоя до закрытия соединения
+
+_session: aiohttp.ClientSession | None = None
+_session_loop = None
+
+def configure(timeout: aiohttp.ClientTimeout = None, limit: int = None, limit_per_host: int = None):
+    """Меняет параметры пула. Вступает в силу для следующей созданной сессии (после close())."""
+    global DEFAULT_TIMEOUT, CONNECTION_LIMIT, CONNECTION_LIMIT_PER_HOST
+    if timeout is not None:
+        DEFAULT_TIMEOUT = timeout
+    if limit is not None:
+        CONNECTION_LIMIT = limit
+    if limit_per_host is not None:
+        CONNECTION_LIMIT_PER_HOST = limit_per_host
+
+async def get_session() -> aiohttp.ClientSession:
+    """Возвращает общую сессию, создавая её при первом обращении (или если прежняя закрыта)."""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=CONNECTION_LIMIT,
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT, trust_env=False)
+        _session_loop = loop
+    return _session
+
+async def fetch_text(url: str, headers: dict = None, timeout: aiohttp.ClientTimeout = None) -> str:
+    """GET и текст ответа. При статусе ошибки — aiohttp.ClientResponseError."""
+    session = await get_session()
+    async with session.get(url, headers=headers, timeout=timeout or DEFAULT_TIMEOUT) as response:
+        response.raise_for_status()
+        return await response.text()
+
+async def fetch_bytes(url: str, headers: dict = None, timeout: aiohttp.ClientTimeout = None) -> bytes:
+    """GET и тело ответа в байтах. При статусе ошибки — aiohttp.ClientResponseError."""
+    session = await get_session()
+    async with session.get(url, headers=headers, timeout=timeout or DEFAULT_TIMEOUT) as response:
+        response.raise_for_status()
+        return await response.read()
+
+async def close():
+    """Закрывает общую сессию (при завершении работы)."""
+    global _session, _session_loop
+    session, _session, _session_loop = _session, None, None
+    if session is not None and not session.closed:
+        await session.close()
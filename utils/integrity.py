@@ -3,6 +3,8 @@
 import hashlib
 import os
 import sys
+import struct
+import logging
 from pathlib import Path
 
 # Файлы, изменение которых во время работы считается АТАКОЙ
@@ -16,6 +18,11 @@ CRITICAL_FILES = [
 ]
 
 _SNAPSHOT = {}
+# Метаданные файлов, для которых хеш уже подтверждён: {filename: (mtime_ns, ctime_ns, size, ino)}
+_STAT_CACHE = {}
+# Файлы, изменение которых заметил inotify-наблюдатель: {filename: reason}
+_TAMPERED = {}
+_watcher_fd = None
 ROOT_DIR = Path(__file__).parent.parent
 
 def calculate_file_hash(path: Path) -> str:
@@ -34,14 +41,52 @@ def calculate_file_hash(path: Path) -> str:
     except Exception:
         return "ERROR"
 
+def _stat_key(path: Path):
+    """
+    Ключ метаданных файла. ctime включён дополнительно к mtime/size/ino:
+    mtime можно выставить вручную (touch -d), а ctime — нет.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino)
+
 def initialize_snapshot():
     """Создает снимок состояния файлов при запуске бота."""
     global _SNAPSHOT
     _SNAPSHOT = {}
+    _STAT_CACHE.clear()
+    _TAMPERED.clear()
     for filename in CRITICAL_FILES:
         path = ROOT_DIR / filename
         if path.exists():
+            stat_key = _stat_key(path)
             _SNAPSHOT[filename] = calculate_file_hash(path)
+            if stat_key is not None:
+                _STAT_CACHE[filename] = stat_key
+
+def _check_file(filename: str) -> dict | None:
+    """Проверяет один файл. Хеш пересчитывается, только если изменились метаданные."""
+    path = ROOT_DIR / filename
+    stat_key = _stat_key(path)
+    if stat_key is not None and _STAT_CACHE.get(filename) == stat_key:
+        return None
+
+    current_hash = calculate_file_hash(path)
+    if current_hash != _SNAPSHOT[filename]:
+        _STAT_CACHE.pop(filename, None)
+        return {
+            "status": "compromised",
+            "file": filename,
+            "reason": "File modified during runtime" if current_hash != "DELETED" else "File deleted"
+        }
+
+    # Содержимое то же (например, touch) — запоминаем новые метаданные
+    if stat_key is not None:
+        _STAT_CACHE[filename] = stat_key
+    _TAMPERED.pop(filename, None)
+    return None
 
 def verify_integrity() -> dict:
     """
@@ -51,15 +96,100 @@ def verify_integrity() -> dict:
     if not _SNAPSHOT:
         initialize_snapshot()
 
-    for filename, original_hash in _SNAPSHOT.items():
-        path = ROOT_DIR / filename
-        current_hash = calculate_file_hash(path)
-        
-        if current_hash != original_hash:
-            return {
-                "status": "compromised",
-                "file": filename,
-                "reason": "File modified during runtime" if current_hash != "DELETED" else "File deleted"
-            }
-            
+    # Файлы, пойманные наблюдателем, перепроверяем первыми: если файл восстановили,
+    # хеш снова совпадёт и _check_file снимет отметку
+    for filename in list(_TAMPERED):
+        status = _check_file(filename)
+        if status is not None:
+            _TAMPERED[filename] = status["reason"]
+            return status
+
+    for filename in _SNAPSHOT:
+        status = _check_file(filename)
+        if status is not None:
+            return status
+
     return {"status": "ok"}
+
+# --- inotify-наблюдатель (Linux/Android, опционально) ---
+_IN_MODIFY = 0x002
+_IN_ATTRIB = 0x004
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+def _on_inotify_event(wd_dirs: dict):
+    try:
+        data = os.read(_watcher_fd, 65536)
+    except BlockingIOError:
+        return
+    except OSError:
+        return
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(data):
+        wd, _mask, _cookie, name_len = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        name = data[offset:offset + name_len].rstrip(b"\0").decode("utf-8", errors="replace")
+        offset += name_len
+
+        directory = wd_dirs.get(wd)
+        if directory is None:
+            continue
+        filename = (Path(directory) / name).as_posix() if directory else name
+        if filename not in _SNAPSHOT:
+            continue
+
+        # Метаданные изменились — проверяем хеш сразу, не дожидаясь следующей загрузки модуля
+        _STAT_CACHE.pop(filename, None)
+        status = _check_file(filename)
+        if status is not None:
+            _TAMPERED[filename] = status["reason"]
+            logging.critical(f"🚨 Integrity: {filename} изменён во время работы ({status['reason']})")
+
+def start_watcher(loop=None) -> bool:
+    """
+    Подписывается через inotify на каталоги с критическими файлами.
+    Без inotify (не Linux, нет libc) проверка по метаданным работает и так.
+    """
+    global _watcher_fd
+    if _watcher_fd is not None:
+        return True
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        import ctypes
+        import ctypes.util
+        import asyncio
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            return False
+
+        if not _SNAPSHOT:
+            initialize_snapshot()
+
+        mask = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM
+                | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE)
+        wd_dirs = {}
+        for directory in sorted({Path(f).parent.as_posix() for f in CRITICAL_FILES}):
+            rel = "" if directory == "." else directory
+            wd = libc.inotify_add_watch(fd, str(ROOT_DIR / rel).encode(), mask)
+            if wd >= 0:
+                wd_dirs[wd] = rel
+
+        if not wd_dirs:
+            os.close(fd)
+            return False
+
+        _watcher_fd = fd
+        (loop or asyncio.get_running_loop()).add_reader(fd, _on_inotify_event, wd_dirs)
+        return True
+    except Exception as e:
+        logging.warning(f"Integrity watcher не запущен: {e}")
+        return False
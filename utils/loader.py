@@ -4,10 +4,20 @@ import importlib
 import sys
 import os
 import re
+import ast
+import copy
+import time
+import contextlib
+import logging
+import asyncio
 import inspect
 import traceback
 from pathlib import Path
 from telethon import events
+from telethon.errors import FloodWaitError
+from utils import flood
+from utils import profiler
+from utils import metrics
 from telethon.tl.custom import Button
 # Импортируем типы для форматирования
 from telethon.tl.types import (
@@ -25,6 +35,13 @@ COMMANDS_REGISTRY = {}
 CALLBACK_REGISTRY = {}
 INLINE_HANDLERS_REGISTRY = {}
 WATCHERS_REGISTRY = [] 
+# Таблица маршрутов команд: {префикс: {команда: [{"module", "func", "handler"}, ...]}}
+# Префикс хранится тот, с которым команда регистрировалась (смена префикса — после .restart)
+COMMAND_ROUTES = {}
+# Watcher'ы на NewMessage: [{"module", "func", "handler", "timeout", "seq"}, ...]
+# Диспетчер раскладывает их по корзинам (направление, чат, отправитель), см. dispatch_watchers.
+# timeout — только если модуль сам его указал (@watcher(timeout=...)), иначе watcher не ограничен
+WATCHER_ROUTES = []
 
 # --- Базовый класс для модулей ---
 class Module:
@@ -40,6 +57,8 @@ class Module:
 def register(command: str, **kwargs):
     kwargs.setdefault("outgoing", True)
     def decorator(func):
+        module_label = metrics.module_label(func)
+
         async def wrapper(event, *args, **kwargs):
             from utils import database as db
             is_enabled = db.get_setting("userbot_enabled", default="True") == "True"
@@ -49,9 +68,12 @@ def register(command: str, **kwargs):
                 else: return
             
             # --- ПЕРЕХВАТ ОШИБОК ВЫПОЛНЕНИЯ ---
+            started = time.perf_counter()
             try:
                 await func(event, *args, **kwargs)
+                metrics.observe(module_label, command, time.perf_counter() - started)
             except Exception:
+                metrics.observe(module_label, command, time.perf_counter() - started, error=True)
                 # Если произошла ошибка во время выполнения команды
                 from utils.message_builder import build_and_edit
                 
@@ -78,6 +100,7 @@ def register(command: str, **kwargs):
                     print(f"Failed to send error message: {e}")
             # ----------------------------------
         
+        wrapper.__wrapped__ = func
         wrapper._is_command = True
         wrapper._command_name = command
         wrapper._command_kwargs = kwargs
@@ -108,6 +131,233 @@ def inline_handler(query_pattern: str, title: str, description: str = ""):
         return func
     return decorator
 
+# --- Роутер команд ---
+# Вместо двух regex-хендлеров NewMessage на каждую команду на клиенте висит
+# один обработчик: дешёвая проверка префикса -> поиск слова в COMMAND_ROUTES ->
+# фильтры только найденных маршрутов.
+
+def _trusted_filter(ev):
+    """Фильтр входящих команд: только OWNER и TRUSTED."""
+    from utils import database as _db
+    try:
+        msg = getattr(ev, "message", ev)
+        if not hasattr(msg, "out"):
+            return False
+        sid = getattr(ev, "sender_id", None) or getattr(msg, "sender_id", None)
+        if sid is None:
+            return False
+        return _db.get_user_level(sid) in ("OWNER", "TRUSTED")
+    except Exception:
+        return False
+
+def build_command_handlers(command: str, handler_args: dict, escape: bool = False) -> list:
+    """
+    Строит пару фильтров NewMessage для команды: исходящие (владелец пишет сам)
+    и входящие от trusted пользователей. Сами фильтры в клиент не добавляются —
+    их проверяет command_router.
+    """
+    name = re.escape(command) if escape else command
+    pattern = re.compile(re.escape(PREFIX) + name + r"(?:\s+(.*))?$", re.IGNORECASE | re.DOTALL)
+    base_args = {k: v for k, v in handler_args.items()
+                 if k not in ("incoming", "outgoing", "from_users", "pattern")}
+
+    out_args = dict(base_args, outgoing=True, pattern=pattern)
+    in_args = dict(base_args, incoming=True, func=_trusted_filter, pattern=pattern)
+    return [events.NewMessage(**out_args), events.NewMessage(**in_args)]
+
+def add_command_route(client, module_name: str, command: str, func, handler):
+    """Добавляет маршрут команды и при необходимости ставит роутер на клиент."""
+    install_command_router(client)
+    routes = COMMAND_ROUTES.setdefault(PREFIX.lower(), {})
+    routes.setdefault(command.lower(), []).append({
+        "module": module_name,
+        "func": func,
+        "handler": handler,
+    })
+
+def remove_command_routes(module_name: str, command: str = None):
+    """Удаляет маршруты модуля (все или только одной команды/алиаса)."""
+    for prefix in list(COMMAND_ROUTES):
+        routes = COMMAND_ROUTES[prefix]
+        for cmd in list(routes):
+            if command is not None and cmd != command.lower():
+                continue
+            routes[cmd] = [r for r in routes[cmd] if r["module"] != module_name]
+            if not routes[cmd]: del routes[cmd]
+        if not routes: del COMMAND_ROUTES[prefix]
+
+async def command_router(event):
+    """Единая точка входа для всех команд модулей."""
+    text = event.message.message if event.message else None
+    if not text:
+        return
+
+    for prefix, routes in list(COMMAND_ROUTES.items()):
+        if text[:len(prefix)].lower() != prefix:
+            continue
+        words = text[len(prefix):].split(None, 1)
+        if not words:
+            continue
+        for route in list(routes.get(words[0].lower(), ())):
+            handler = route["handler"]
+            if not handler.resolved:
+                await handler.resolve(event.client)
+            passed = handler.filter(event)
+            if inspect.isawaitable(passed):
+                passed = await passed
+            if not passed:
+                continue
+            # Команды владельца идут приоритетной полосой планировщика запросов
+            with flood.owner_lane(bool(event.message.out)), _module_busy(route["module"]):
+                try:
+                    await route["func"](event)
+                except events.StopPropagation:
+                    raise
+                except Exception:
+                    print(f"Unhandled exception in .{words[0]} ({route['module']}):")
+                    traceback.print_exc()
+
+def install_command_router(client):
+    """Регистрирует command_router на клиенте (один раз)."""
+    if getattr(client, "_command_router_installed", False):
+        return
+    client.add_event_handler(command_router, events.NewMessage())
+    client._command_router_installed = True
+
+# --- ДИСПЕТЧЕР WATCHER'ОВ ---
+# Вместо отдельного обработчика Telethon на каждый watcher — один диспетчер.
+# Индекс: {(направление, chat_id | None, sender_id | None): [маршруты]}, где None — «любой».
+# Событие проверяет только 4 корзины, а не весь список watcher'ов.
+_WATCHER_INDEX = {}
+_watcher_index_dirty = True
+_watcher_seq = 0
+
+def add_watcher_route(client, module_name: str, func, handler, timeout: float = None) -> bool:
+    """
+    Регистрирует watcher в диспетчере. Работает только для чистого events.NewMessage —
+    для остальных билдеров (MessageEdited, ChatAction, ...) возвращает False,
+    и вызывающий ставит обработчик на клиент сам.
+    timeout — лимит выполнения в секундах (None — без лимита).
+    """
+    global _watcher_index_dirty, _watcher_seq
+    if type(handler) is not events.NewMessage:
+        return False
+    install_watcher_dispatcher(client)
+    _watcher_seq += 1
+    WATCHER_ROUTES.append({
+        "module": module_name,
+        "func": func,
+        "handler": handler,
+        "timeout": timeout,
+        "seq": _watcher_seq,
+    })
+    _watcher_index_dirty = True
+    return True
+
+def remove_watcher_routes(module_name: str):
+    """Удаляет все watcher'ы модуля из диспетчера."""
+    global _watcher_index_dirty
+    WATCHER_ROUTES[:] = [r for r in WATCHER_ROUTES if r["module"] != module_name]
+    _watcher_index_dirty = True
+
+async def _resolve_watcher_routes(routes: list, client):
+    for route in routes:
+        if not route["handler"].resolved:
+            await route["handler"].resolve(client)
+
+def _index_watcher_routes(routes: list) -> dict:
+    """Раскладывает маршруты по корзинам (направление, chat_id | None, sender_id | None)."""
+    index = {}
+    for route in routes:
+        handler = route["handler"]
+        directions = ("in", "out")
+        if handler.incoming:
+            directions = ("in",)
+        elif handler.outgoing:
+            directions = ("out",)
+        # Чёрный список чатов не сужает выборку — такой watcher лежит в корзине «любой чат»
+        chats = handler.chats if handler.chats is not None and not handler.blacklist_chats else (None,)
+        senders = handler.from_users if handler.from_users is not None else (None,)
+        for direction in directions:
+            for chat_id in chats:
+                for sender_id in senders:
+                    index.setdefault((direction, chat_id, sender_id), []).append(route)
+    return index
+
+def _match_watcher_routes(index: dict, event) -> list:
+    """Маршруты-кандидаты для события в порядке регистрации (фильтры ещё не проверены)."""
+    direction = "out" if event.message.out else "in"
+    chat_id, sender_id = event.chat_id, event.sender_id
+    candidates = []
+    for key in ((direction, None, None), (direction, chat_id, None),
+                (direction, None, sender_id), (direction, chat_id, sender_id)):
+        candidates.extend(index.get(key, ()))
+    candidates.sort(key=lambda r: r["seq"])
+    return candidates
+
+async def _rebuild_watcher_index(client):
+    global _WATCHER_INDEX, _watcher_index_dirty
+    _watcher_index_dirty = False
+    routes = list(WATCHER_ROUTES)
+    await _resolve_watcher_routes(routes, client)
+    # Если во время resolve маршруты поменялись, флаг снова поднят — пересоберём на следующем событии
+    _WATCHER_INDEX = _index_watcher_routes(routes)
+
+async def _run_watcher(route, event) -> bool:
+    """Запускает watcher, если событие проходит его фильтр. True — watcher поднял StopPropagation."""
+    handler = route["handler"]
+    if handler.pattern:
+        # pattern_match пишется в событие — каждому watcher'у свою копию
+        event = copy.copy(event)
+    passed = handler.filter(event)
+    if inspect.isawaitable(passed):
+        passed = await passed
+    if not passed:
+        return False
+    try:
+        with _module_busy(route["module"]):
+            if route["timeout"]:
+                await asyncio.wait_for(route["func"](event), route["timeout"])
+            else:
+                await route["func"](event)
+    except asyncio.TimeoutError:
+        logging.warning(f"⏱ Watcher {route['func'].__name__} ({route['module']}) не уложился в {route['timeout']} сек. и был остановлен")
+    except events.StopPropagation:
+        # Watcher'ы выполняются параллельно — соседей не остановить, но обработчики
+        # клиента после диспетчера не получат событие (см. dispatch_watchers)
+        return True
+    except FloodWaitError as e:
+        logging.warning(f"⏳ FloodWait в модуле {route['module']}: ожидание {e.seconds} сек.")
+    except Exception as e:
+        logging.error(f"⚠️ Ошибка в модуле {route['module']} ({route['func'].__name__}): {e}")
+
+async def dispatch_watchers(event):
+    """Единая точка входа для всех watcher'ов модулей."""
+    if _watcher_index_dirty:
+        await _rebuild_watcher_index(event.client)
+    if not _WATCHER_INDEX:
+        return
+
+    candidates = _match_watcher_routes(_WATCHER_INDEX, event)
+    if not candidates:
+        return
+
+    # Порядок регистрации сохраняется, но выполняются watcher'ы параллельно
+    stopped = await asyncio.gather(*(_run_watcher(route, event) for route in candidates))
+    if any(stopped):
+        raise events.StopPropagation
+
+def install_watcher_dispatcher(client):
+    """
+    Регистрирует dispatch_watchers на клиенте (один раз).
+    Роутер команд ставится раньше: команда не ждёт, пока отработают совпавшие watcher'ы.
+    """
+    if getattr(client, "_watcher_dispatcher_installed", False):
+        return
+    install_command_router(client)
+    client.add_event_handler(dispatch_watchers, events.NewMessage())
+    client._watcher_dispatcher_installed = True
+
 def check_module_dependencies(module_name: str) -> dict:
     try:
         importlib.import_module(f"modules.{module_name}")
@@ -137,7 +387,220 @@ def _find_module_path(module_name: str) -> Path | None:
     
     return None
 
-async def load_module(client, module_name: str, chat_id: int = None) -> dict:
+# Системные модули, которые не проходят сканер безопасности
+TRUSTED_SYSTEM_MODULES = ["install", "modules", "updater", "core_updater"]
+# Фреймворки, чьи модули запускаются через heroku_loader
+_COMPAT_FRAMEWORKS = {"herokutl", "hikka", "dragon", "watgbridge"}
+
+def _is_compat_import(node) -> bool:
+    """Импорт, по которому модуль определяется как Heroku/Hikka."""
+    if isinstance(node, ast.ImportFrom):
+        # from .. import loader  (relative, level >= 1)
+        if node.level and node.level >= 1:
+            names = [a.name for a in node.names]
+            if "loader" in names or "utils" in names:
+                return True
+        # from hikka import loader / from herokutl.xxx import yyy
+        if node.module and node.module.split(".")[0] in _COMPAT_FRAMEWORKS:
+            return True
+    if isinstance(node, ast.Import):
+        for a in node.names:
+            if a.name.split(".")[0] in _COMPAT_FRAMEWORKS:
+                return True
+    return False
+
+def _module_dependencies(tree) -> set:
+    """Модули из modules/, которые импортирует данный (from modules.x / from modules import x)."""
+    deps = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            parts = node.module.split(".")
+            if parts[0] != "modules":
+                continue
+            if len(parts) > 1:
+                deps.add(".".join(parts[1:]))
+            else:
+                deps.update(a.name for a in node.names)
+        elif isinstance(node, ast.Import):
+            for a in node.names:
+                parts = a.name.split(".")
+                if parts[0] == "modules" and len(parts) > 1:
+                    deps.add(".".join(parts[1:]))
+    return deps
+
+# {путь: (метаданные файла, хеш содержимого)} — чтобы не хешировать неизменённые файлы
+_CONTENT_HASHES = {}
+_STRINGS_NAME_RE = re.compile(r'["\']name["\'\s]*:\s*["\']([^"\']+)["\']')
+_analysis_version = None
+
+_LAZY_DECORATORS = {"register", "watcher", "callback_handler", "inline_handler"}
+
+def _lazy_index(tree) -> dict | None:
+    """
+    Статический индекс команд, callback- и inline-обработчиков для ленивой загрузки.
+    None — модуль нельзя загружать лениво: есть watcher'ы (им нужен каждый апдейт),
+    аргументы декораторов не литералы, нечем разбудить модуль или в нём стоит __lazy__ = False.
+    """
+    index = {"commands": [], "callbacks": [], "inline": []}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "__lazy__" for t in node.targets):
+            if isinstance(node.value, ast.Constant) and node.value.value is False:
+                return None
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        if node.name.startswith("twin_") and node.name.endswith("_watcher"):
+            return None  # watcher твинков по соглашению об имени
+        for dec in node.decorator_list:
+            if not isinstance(dec, ast.Call):
+                continue
+            name = dec.func.attr if isinstance(dec.func, ast.Attribute) else getattr(dec.func, "id", None)
+            if name not in _LAZY_DECORATORS:
+                continue
+            if name == "watcher":
+                return None
+            try:
+                args = [ast.literal_eval(a) for a in dec.args]
+                kwargs = {k.arg: ast.literal_eval(k.value) for k in dec.keywords}
+            except (ValueError, TypeError, SyntaxError):
+                return None
+            if name == "register":
+                if not args or not isinstance(args[0], str):
+                    return None
+                index["commands"].append({"name": args[0], "kwargs": kwargs,
+                                          "doc": ast.get_docstring(node) or "Нет описания"})
+            elif name == "callback_handler":
+                index["callbacks"].append(args[0] if args else kwargs.get("data_pattern"))
+            else:
+                pattern = args[0] if args else kwargs.get("query_pattern")
+                title = args[1] if len(args) > 1 else kwargs.get("title", "")
+                description = args[2] if len(args) > 2 else kwargs.get("description", "")
+                index["inline"].append({"pattern": pattern, "title": title, "description": description})
+    if not any(index.values()) or None in index["callbacks"] or any(i["pattern"] is None for i in index["inline"]):
+        return None
+    return index
+
+def _get_analysis_version() -> str:
+    """Версия анализатора: меняется вместе с правилами сканера — кэш тогда пересчитывается."""
+    global _analysis_version
+    if _analysis_version is None:
+        import hashlib
+        from utils import security
+        rules = repr((sorted(map(sorted, security.BLOCK_LIST.values())),
+                      sorted(map(sorted, security.WARN_LIST.values())),
+                      sorted(map(sorted, security.INFO_LIST.values())),
+                      sorted(_COMPAT_FRAMEWORKS), TRUSTED_SYSTEM_MODULES))
+        _analysis_version = "3:" + hashlib.sha256(rules.encode()).hexdigest()[:16]
+    return _analysis_version
+
+def _analyze_source(module_name: str, file_content: str) -> dict:
+    """Полный анализ исходника (без кэша)."""
+    from utils.security import scan_code
+    from services.module_info_cache import parse_manifest
+    analysis = {"is_heroku": False, "scan": None, "deps": [], "manifest": None, "strings_name": None,
+                "lazy_index": None}
+
+    # Определяем Heroku-модуль по реальным импортам через AST
+    # (строковый поиск ненадёжен — install.py содержит эти строки в своём коде)
+    try:
+        tree = ast.parse(file_content)
+        analysis["is_heroku"] = any(_is_compat_import(node) for node in ast.walk(tree))
+        analysis["deps"] = sorted(_module_dependencies(tree))
+        if not analysis["is_heroku"]:
+            analysis["lazy_index"] = _lazy_index(tree)
+    except Exception:
+        pass
+
+    # Сканер безопасности — только для обычных модулей
+    if not analysis["is_heroku"] and module_name not in TRUSTED_SYSTEM_MODULES:
+        analysis["scan"] = scan_code(file_content)
+
+    try:
+        analysis["manifest"] = parse_manifest(file_content)
+    except Exception:
+        pass
+    # strings['name'] Heroku-модулей — ищем в первых 4KB, как панель
+    name_match = _STRINGS_NAME_RE.search(file_content[:4000])
+    if name_match:
+        analysis["strings_name"] = name_match.group(1)
+    return analysis
+
+def _timed_analyze_source(module_name: str, file_content: str) -> tuple:
+    """_analyze_source для пула процессов: (анализ, время в секундах)."""
+    started = time.perf_counter()
+    return _analyze_source(module_name, file_content), time.perf_counter() - started
+
+def _lookup_analysis(module_name: str, module_path: Path = None) -> tuple:
+    """
+    Первая, дешёвая часть analyze_module: хеш файла и кэш анализа в БД.
+    Возвращает (result, content_hash, source) — source не None, если исходник ещё нужно разобрать.
+    """
+    import hashlib
+    from utils import database as db
+    started = time.perf_counter()
+    if module_path is None:
+        module_path = _find_module_path(module_name)
+    result = {"path": module_path, "is_heroku": False, "scan": None, "deps": set(),
+              "manifest": None, "strings_name": None, "error": None, "cached": False}
+    content_hash = source = None
+
+    if module_path and module_path.is_file():
+        try:
+            # Файл с теми же метаданными не перечитываем — хеш уже известен
+            st = os.stat(module_path)
+            stat_key = (st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino)
+            known = _CONTENT_HASHES.get(str(module_path))
+            raw = None
+            if known and known[0] == stat_key:
+                content_hash = known[1]
+            else:
+                with open(module_path, 'rb') as f:
+                    raw = f.read()
+                content_hash = hashlib.sha256(raw).hexdigest() + ":" + _get_analysis_version()
+                _CONTENT_HASHES[str(module_path)] = (stat_key, content_hash)
+
+            analysis = db.get_module_analysis(module_name, content_hash)
+            result["cached"] = analysis is not None
+            if analysis is None:
+                if raw is None:
+                    with open(module_path, 'rb') as f:
+                        raw = f.read()
+                source = raw.decode('utf-8')
+            else:
+                result.update(analysis)
+                result["deps"] = set(analysis["deps"])
+        except Exception as e:
+            result["error"] = str(e)
+
+    result["time"] = time.perf_counter() - started
+    return result, content_hash, source
+
+def _finish_analysis(module_name: str, result: dict, content_hash: str, analysis: dict, seconds: float) -> dict:
+    """Вторая часть analyze_module: сохраняет разобранный анализ в кэш и в result."""
+    from utils import database as db
+    db.set_module_analysis(module_name, content_hash, analysis)
+    result.update(analysis)
+    result["deps"] = set(analysis["deps"])
+    result["time"] += seconds
+    return result
+
+def analyze_module(module_name: str, module_path: Path = None) -> dict:
+    """
+    Анализ файла модуля без импорта: тип (обычный / Heroku), вердикт сканера
+    безопасности, зависимости от других модулей, манифест и strings['name'].
+    Результат кэшируется в БД по хешу содержимого — неизменённые модули
+    повторно не парсятся. Потокобезопасна.
+    """
+    result, content_hash, source = _lookup_analysis(module_name, module_path)
+    if source is None:
+        return result
+    try:
+        analysis, seconds = _timed_analyze_source(module_name, source)
+        return _finish_analysis(module_name, result, content_hash, analysis, seconds)
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+
+async def load_module(client, module_name: str, chat_id: int = None, analysis: dict = None) -> dict:
     """Загружает модуль и регистрирует его обработчики."""
     # Проверяем оба варианта ключа: обычный и heroku:
     _already_keys = [module_name, f"heroku:{module_name}"]
@@ -160,70 +623,36 @@ async def load_module(client, module_name: str, chat_id: int = None) -> dict:
         # ----------------------------------
 
         # --- АНАЛИЗ ФАЙЛА: безопасность + определение типа ---
-        TRUSTED_SYSTEM_MODULES = ["install", "modules", "updater", "core_updater"]
-        from utils.security import scan_code
-        module_path = _find_module_path(module_name)
-        _is_heroku_mod = False
-
-        if module_path and module_path.is_file():
-            try:
-                with open(module_path, 'r', encoding='utf-8') as f:
-                    _file_content = f.read()
+        # При старте анализ уже сделан заранее в пуле потоков (load_all_modules)
+        if analysis is None:
+            analysis = analyze_module(module_name)
+        module_path = analysis["path"]
+        _is_heroku_mod = analysis["is_heroku"]
+        if analysis.get("error"):
+            print(f"Module analysis failed for {module_name}: {analysis['error']}")
 
-                # Определяем Heroku-модуль по реальным импортам через AST
-                # (строковый поиск ненадёжен — install.py содержит эти строки в своём коде)
-                import ast as _ast
-                try:
-                    _tree = _ast.parse(_file_content)
-                    # Фреймворки, чьи модули запускаются через heroku_loader
-                    _COMPAT_FRAMEWORKS = {"herokutl", "hikka", "dragon", "watgbridge"}
-                    for _node in _ast.walk(_tree):
-                        if isinstance(_node, _ast.ImportFrom):
-                            # from .. import loader  (relative, level >= 1)
-                            if _node.level and _node.level >= 1:
-                                names = [a.name for a in _node.names]
-                                if "loader" in names or "utils" in names:
-                                    _is_heroku_mod = True
-                                    break
-                            # from hikka import loader / from herokutl.xxx import yyy
-                            if _node.module:
-                                _mod_root = _node.module.split(".")[0]
-                                if _mod_root in _COMPAT_FRAMEWORKS:
-                                    _is_heroku_mod = True
-                                    break
-                        if isinstance(_node, _ast.Import):
-                            for _a in _node.names:
-                                _imp_root = _a.name.split(".")[0]
-                                if _imp_root in _COMPAT_FRAMEWORKS:
-                                    _is_heroku_mod = True
-                                    break
-                except Exception:
-                    pass
-
-                # Сканер безопасности — только для обычных модулей
-                if not _is_heroku_mod and module_name not in TRUSTED_SYSTEM_MODULES:
-                    scan_result = scan_code(_file_content)
-                    if scan_result["level"] == "block":
-                        blocked_path = str(module_path) + ".blocked"
-                        os.rename(module_path, blocked_path)
-                        return {
-                            "status": "error",
-                            "message": f"🚫 ЗАЩИТА: Модуль {module_name} заблокирован!\nОбнаружены критические угрозы: {scan_result['reasons']}\nФайл переименован в .blocked"
-                        }
-            except Exception as e:
-                print(f"Module analysis failed for {module_name}: {e}")
+        scan_result = analysis.get("scan")
+        if scan_result and scan_result["level"] == "block":
+            blocked_path = str(module_path) + ".blocked"
+            os.rename(module_path, blocked_path)
+            return {
+                "status": "error",
+                "message": f"🚫 ЗАЩИТА: Модуль {module_name} заблокирован!\nОбнаружены критические угрозы: {scan_result['reasons']}\nФайл переименован в .blocked"
+            }
 
         # Heroku/Hikka-модуль — передаём в compat-загрузчик
         if _is_heroku_mod:
             from compat.heroku_loader import load_heroku_module
-            return await load_heroku_module(client, module_path, chat_id)
+            with profiler.span("heroku_load", "module", module=module_name):
+                return await load_heroku_module(client, module_path, chat_id)
         # ------------------------------------------------------
 
         import_name = f"modules.{module_name}"
 
-        if import_name in sys.modules:
-            importlib.reload(sys.modules[import_name])
-        imported_module = importlib.import_module(import_name)
+        with profiler.span("import", "module", module=module_name):
+            if import_name in sys.modules:
+                importlib.reload(sys.modules[import_name])
+            imported_module = importlib.import_module(import_name)
 
         registered_handlers = []
         module_instance = None
@@ -236,60 +665,38 @@ async def load_module(client, module_name: str, chat_id: int = None) -> dict:
                 from utils import database
                 module_instance.db = database
                 if hasattr(module_instance, "client_ready"):
-                    await module_instance.client_ready(safe_client, database)
+                    with profiler.span("client_ready", "module", module=module_name):
+                        await module_instance.client_ready(safe_client, database)
                 break
         search_target = module_instance if module_instance else imported_module
-        
+        registration_started = time.perf_counter()
+
         for name, func in inspect.getmembers(search_target):
             if not (inspect.isfunction(func) or inspect.ismethod(func)):
                 continue
 
             if getattr(func, "_is_command", False):
                 command_name, handler_args, doc = func._command_name, func._command_kwargs, func._command_doc
-                pattern_text = re.escape(PREFIX) + command_name + r"(?:\s+(.*))?$"
-                _pat = re.compile(pattern_text, re.IGNORECASE | re.DOTALL)
-
-                # 1. Исходящие (владелец пишет сам)
-                _out_args = {k: v for k, v in handler_args.items()
-                             if k not in ("incoming", "outgoing", "from_users")}
-                _out_args["outgoing"] = True
-                _out_args["pattern"] = _pat
-                handler = events.NewMessage(**_out_args)
-                client.add_event_handler(func, handler)
-                registered_handlers.append((func, handler))
-
-                # 2. Входящие от trusted пользователей
-                def _make_trusted_filter():
-                    from utils import database as _db2
-                    def _is_trusted(ev):
-                        try:
-                            msg = getattr(ev, "message", ev)
-                            if not hasattr(msg, "out"):
-                                return False
-                            sid = getattr(ev, "sender_id", None) or getattr(msg, "sender_id", None)
-                            if sid is None:
-                                return False
-                            return _db2.get_user_level(sid) in ("OWNER", "TRUSTED")
-                        except Exception:
-                            return False
-                    return _is_trusted
-
-                _in_args = {k: v for k, v in handler_args.items()
-                            if k not in ("incoming", "outgoing", "from_users")}
-                _in_args["incoming"] = True
-                _in_args["func"] = _make_trusted_filter()
-                _in_args["pattern"] = _pat
-                handler_in = events.NewMessage(**_in_args)
-                client.add_event_handler(func, handler_in)
-                registered_handlers.append((func, handler_in))
+
+                # Исходящие + входящие от trusted — через общий роутер
+                for handler in build_command_handlers(command_name, handler_args):
+                    add_command_route(client, module_name, command_name, func, handler)
                 if command_name not in COMMANDS_REGISTRY: COMMANDS_REGISTRY[command_name] = []
                 COMMANDS_REGISTRY[command_name].append({"module": module_name, "doc": doc or "Нет описания"})
 
             if getattr(func, "_is_watcher", False):
                 handler_args = func._watcher_kwargs.copy()
+                timeout = handler_args.pop('timeout', None)
+                twins = handler_args.pop('twins', False)
                 handler = handler_args.get('event') or events.NewMessage(**handler_args)
-                client.add_event_handler(func, handler)
-                registered_handlers.append((func, handler))
+                if twins:
+                    # @watcher(twins=True) — события всех твинков через общую шину TwinManager
+                    from services.twin_manager import twin_manager
+                    if not twin_manager.add_watcher(module_name, func, handler, timeout):
+                        print(f"⚠️ {module_name}.{name}: twins=True поддерживается только для NewMessage")
+                elif not add_watcher_route(client, module_name, func, handler, timeout):
+                    client.add_event_handler(func, handler)
+                    registered_handlers.append((func, handler))
 
             if getattr(func, "_is_callback_handler", False):
                 CALLBACK_REGISTRY[func._callback_pattern] = func
@@ -301,6 +708,16 @@ async def load_module(client, module_name: str, chat_id: int = None) -> dict:
                     "description": func._inline_description
                 }
         
+        # Совместимость: до @watcher(twins=True) модули экспортировали функции twin_*_watcher,
+        # которые main() вешал на каждого твинка как NewMessage(incoming=True)
+        for name, func in inspect.getmembers(imported_module, inspect.iscoroutinefunction):
+            if (name.startswith("twin_") and name.endswith("_watcher") and not getattr(func, "_is_watcher", False)
+                    and func.__module__ == imported_module.__name__):
+                from services.twin_manager import twin_manager
+                twin_manager.add_watcher(module_name, func, events.NewMessage(incoming=True))
+
+        profiler.record("handlers", "module", registration_started, time.perf_counter(), module=module_name)
+
         client.modules[module_name] = {
             "module": imported_module,
             "instance": module_instance,
@@ -343,6 +760,12 @@ async def unload_module(client, module_name: str) -> dict:
         for func, handler in module_data["handlers"]:
             client.remove_event_handler(func, handler)
 
+        remove_command_routes(module_name)
+        remove_watcher_routes(module_name)
+        from services.twin_manager import twin_manager
+        twin_manager.remove_watchers(module_name)
+        LAZY_MODULES.discard(module_name)
+
         for command in list(COMMANDS_REGISTRY):
             COMMANDS_REGISTRY[command] = [cmd for cmd in COMMANDS_REGISTRY[command] if cmd["module"] != module_name]
             if not COMMANDS_REGISTRY[command]: del COMMANDS_REGISTRY[command]
@@ -376,28 +799,305 @@ async def reload_module(client, module_name: str, chat_id: int = None) -> dict:
     
     return await load_module(client, module_name, chat_id)
 
+def _dependency_order(modules: list, deps: dict) -> list:
+    """
+    Топологическая сортировка модулей: зависимости раньше зависящих.
+    Порядок внутри одного уровня — исходный; циклы и неизвестные
+    зависимости не блокируют загрузку (модуль идёт в исходном порядке).
+    """
+    known = set(modules)
+    pending = {m: {d for d in deps.get(m, ()) if d in known and d != m} for m in modules}
+    ordered, done = [], set()
+    while pending:
+        ready = [m for m in modules if m in pending and pending[m] <= done]
+        if not ready:
+            # Цикл — берём первый оставшийся модуль как есть
+            ready = [next(m for m in modules if m in pending)]
+        for m in ready:
+            ordered.append(m)
+            done.add(m)
+            del pending[m]
+    return ordered
+
+# Разбор исходника (AST + scan_code) упирается в CPU, и из-за GIL пул потоков его почти не
+# ускоряет. Поэтому при холодном старте изменившиеся модули разбираются в пуле процессов.
+# Только fork: spawn/forkserver заново импортируют main.py, а он берёт .koteloader.lock.
+# Где fork или семафоров нет (Windows, macOS, Termux без sem_open) — разбор в потоках, как раньше.
+MIN_PROCESS_ANALYSIS = 4
+
+def _open_source_pool(count: int, max_workers: int = None):
+    """ProcessPoolExecutor для count исходников или None, если процессы не нужны или недоступны."""
+    if count < MIN_PROCESS_ANALYSIS or (os.cpu_count() or 1) < 2:
+        return None
+    try:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        if "fork" not in multiprocessing.get_all_start_methods():
+            return None
+        return ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count(), count),
+                                   mp_context=multiprocessing.get_context("fork"))
+    except (ImportError, NotImplementedError, OSError) as e:
+        logging.info(f"[boot] пул процессов недоступен ({e}), анализ модулей в потоках")
+        return None
+
+async def load_all_modules(client, modules: list = None, max_workers: int = None, lazy: bool = None) -> dict:
+    """
+    Загрузка модулей при старте:
+    1. анализ файлов: хеши и кэш анализа — в пуле потоков (ввод-вывод), разбор AST и scan_code
+       для изменившихся модулей — в пуле процессов (см. _open_source_pool);
+    2. импорт и регистрация — последовательно, в порядке зависимостей.
+       В ленивом режиме (lazy_modules) подходящие модули получают только заглушки.
+    Возвращает {модуль: {"result", "analysis", "load"}} с временем по этапам.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+
+    def _lookup(module_name):
+        with profiler.span("analysis", "module", module=module_name):
+            return _lookup_analysis(module_name)
+
+    if modules is None:
+        modules = get_all_modules(client)
+    loop = asyncio.get_running_loop()
+    workers = max_workers or min(8, (os.cpu_count() or 1) + 2)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis") as pool:
+        lookups = dict(zip(modules, await asyncio.gather(
+            *(loop.run_in_executor(pool, _lookup, m) for m in modules))))
+
+        to_parse = [m for m, (_, _, source) in lookups.items() if source is not None]
+
+        def _parse_in(executor):
+            return asyncio.gather(*(
+                loop.run_in_executor(executor, _timed_analyze_source, m, lookups[m][2]) for m in to_parse
+            ), return_exceptions=True)
+
+        parsed = None
+        proc_pool = _open_source_pool(len(to_parse), max_workers)
+        if proc_pool is not None:
+            with proc_pool:
+                parsed = await _parse_in(proc_pool)
+            if any(isinstance(outcome, BrokenProcessPool) for outcome in parsed):
+                logging.info("[boot] пул процессов анализа упал, разбор модулей в потоках")
+                parsed = None
+        if parsed is None:
+            parsed = await _parse_in(pool)
+
+    analyses = {module: lookup[0] for module, lookup in lookups.items()}
+    for module, outcome in zip(to_parse, parsed):
+        result, content_hash, _ = lookups[module]
+        if isinstance(outcome, BaseException):
+            result["error"] = str(outcome)
+        else:
+            _finish_analysis(module, result, content_hash, *outcome)
+
+    if lazy is None:
+        lazy = lazy_loading_enabled()
+
+    report = {}
+    for module in _dependency_order(modules, {m: a["deps"] for m, a in analyses.items()}):
+        started = time.perf_counter()
+        try:
+            if lazy and _can_load_lazily(module, analyses[module]):
+                with profiler.span("lazy_stubs", "module", module=module):
+                    result = register_lazy_module(client, module, analyses[module])
+            else:
+                result = await load_module(client, module, analysis=analyses[module])
+        except Exception as e:
+            result = {"status": "error", "message": str(e), "traceback": traceback.format_exc()}
+        report[module] = {
+            "result": result,
+            "analysis": analyses[module]["time"],
+            "load": time.perf_counter() - started,
+        }
+    return report
+
+# --- ЛЕНИВАЯ ЗАГРУЗКА ---
+# Настройка lazy_modules = True: модули, для которых статический индекс (_lazy_index) известен,
+# при старте не импортируются. Вместо их команд, callback- и inline-обработчиков регистрируются
+# заглушки; первая сработавшая заглушка импортирует модуль (client_ready выполняется тогда же)
+# и передаёт событие настоящему обработчику.
+# lazy_modules_ttl = N (сек., 0 — выключено): модуль, к командам которого не обращались N секунд,
+# выгружается обратно в заглушки.
+LAZY_MODULES = set()  # модули, загруженные лениво (только их выгружает TTL)
+_LAST_USED = {}       # {модуль: time.monotonic() последнего вызова команды, callback, inline или watcher'а}
+_IN_FLIGHT = {}       # {модуль: число выполняющихся сейчас вызовов} — такие модули TTL не выгружает
+_lazy_locks = {}
+_lazy_reaper = None
+
+def lazy_loading_enabled() -> bool:
+    from utils import database as db
+    return db.get_setting("lazy_modules", default="False") == "True"
+
+def _lazy_ttl() -> float:
+    from utils import database as db
+    try:
+        return float(db.get_setting("lazy_modules_ttl", default="0"))
+    except ValueError:
+        return 0.0
+
+def _can_load_lazily(module_name: str, analysis: dict) -> bool:
+    scan = analysis.get("scan")
+    return (bool(analysis.get("lazy_index")) and not analysis.get("is_heroku")
+            and module_name not in TRUSTED_SYSTEM_MODULES
+            and not (scan and scan["level"] == "block"))
+
+def _mark_stub(stub, module_name: str, name: str):
+    stub._lazy_stub = True
+    # По __module__ unload_module чистит CALLBACK_REGISTRY/INLINE_HANDLERS_REGISTRY
+    stub.__module__ = f"modules.{module_name}"
+    stub.__name__ = stub.__qualname__ = f"lazy_{name}"
+    return stub
+
+def _handler_module(func) -> str | None:
+    name = getattr(func, "__module__", None) or ""
+    return name[len("modules."):] if name.startswith("modules.") else None
+
+@contextlib.contextmanager
+def _module_busy(module_name: str):
+    """Отмечает выполняющийся вызов модуля: пока он идёт, TTL модуль не выгружает."""
+    _LAST_USED[module_name] = time.monotonic()
+    _IN_FLIGHT[module_name] = _IN_FLIGHT.get(module_name, 0) + 1
+    try:
+        yield
+    finally:
+        left = _IN_FLIGHT[module_name] - 1
+        if left:
+            _IN_FLIGHT[module_name] = left
+        else:
+            del _IN_FLIGHT[module_name]
+        _LAST_USED[module_name] = time.monotonic()
+
+def in_use(func):
+    """Контекст вызова обработчика модуля (callback, inline): модуль не выгрузится, пока вызов идёт."""
+    module_name = _handler_module(func)
+    return _module_busy(module_name) if module_name else contextlib.nullcontext()
+
+def _make_command_stub(client, module_name: str, command: str, kwargs: dict):
+    async def stub(event):
+        if not await materialize_module(client, module_name):
+            return
+        for routes in list(COMMAND_ROUTES.values()):
+            for route in routes.get(command.lower(), ()):
+                if route["module"] == module_name and not getattr(route["func"], "_lazy_stub", False):
+                    # Проверку userbot_enabled и метрики уже выполнила обёртка register самой заглушки
+                    func = getattr(route["func"], "__wrapped__", route["func"])
+                    return await func(event)
+    # Заглушка проходит через ту же обёртку register, что и настоящая команда
+    _mark_stub(stub, module_name, command)
+    return _mark_stub(register(command, **kwargs)(stub), module_name, command)
+
+def _make_handler_stub(client, module_name: str, registry: dict, pattern: str):
+    async def stub(*args, **kwargs):
+        if not await materialize_module(client, module_name):
+            return
+        for key, value in list(registry.items()):
+            func = value["func"] if isinstance(value, dict) else value
+            if getattr(key, "pattern", None) == pattern and not getattr(func, "_lazy_stub", False):
+                return await func(*args, **kwargs)
+    return _mark_stub(stub, module_name, pattern)
+
+def register_lazy_module(client, module_name: str, analysis: dict) -> dict:
+    """Регистрирует заглушки модуля по статическому индексу, не импортируя его."""
+    index = analysis["lazy_index"]
+    for cmd in index["commands"]:
+        kwargs = dict(cmd["kwargs"])
+        kwargs.setdefault("outgoing", True)
+        stub = _make_command_stub(client, module_name, cmd["name"], kwargs)
+        for handler in build_command_handlers(cmd["name"], kwargs):
+            add_command_route(client, module_name, cmd["name"], stub, handler)
+        COMMANDS_REGISTRY.setdefault(cmd["name"], []).append({"module": module_name, "doc": cmd["doc"]})
+
+    for pattern in index["callbacks"]:
+        CALLBACK_REGISTRY[re.compile(pattern)] = _make_handler_stub(client, module_name, CALLBACK_REGISTRY, pattern)
+
+    for item in index["inline"]:
+        INLINE_HANDLERS_REGISTRY[re.compile(item["pattern"])] = {
+            "func": _make_handler_stub(client, module_name, INLINE_HANDLERS_REGISTRY, item["pattern"]),
+            "title": item["title"],
+            "description": item["description"],
+        }
+
+    client.modules[module_name] = {"module": None, "instance": None, "handlers": [], "lazy": True}
+    LAZY_MODULES.add(module_name)
+    return {"status": "ok", "message": f"Модуль {module_name} зарегистрирован (загрузится при первом обращении).", "lazy": True}
+
+async def _register_module_aliases(client, module_name: str):
+    from utils import database as db
+    for row in db.get_all_aliases():
+        if row['module_name'] == module_name:
+            await register_single_alias(client, row['alias'], row['real_command'], module_name)
+
+async def materialize_module(client, module_name: str) -> bool:
+    """Импортирует лениво зарегистрированный модуль вместо его заглушек. True — модуль загружен."""
+    entry = client.modules.get(module_name)
+    if not entry or not entry.get("lazy"):
+        return entry is not None
+
+    lock = _lazy_locks.setdefault(module_name, asyncio.Lock())
+    async with lock:
+        entry = client.modules.get(module_name)
+        if not entry or not entry.get("lazy"):
+            return entry is not None
+        started = time.perf_counter()
+        await unload_module(client, module_name)
+        result = await load_module(client, module_name)
+        if result.get("status") != "ok":
+            print(f"❌ Ленивая загрузка {module_name} не удалась: {result.get('message')}")
+            if result.get("traceback"):
+                print(result["traceback"])
+            return False
+        await _register_module_aliases(client, module_name)
+        LAZY_MODULES.add(module_name)
+        _LAST_USED[module_name] = time.monotonic()
+        logging.info(f"[lazy] {module_name} загружен по первому обращению за {time.perf_counter() - started:.3f} сек")
+    _start_lazy_reaper(client)
+    return True
+
+async def _lazy_reaper_loop(client):
+    while True:
+        ttl = _lazy_ttl()
+        await asyncio.sleep(min(max(ttl / 2, 30), 300) if ttl > 0 else 300)
+        if ttl <= 0:
+            continue
+        now = time.monotonic()
+        for module_name in list(LAZY_MODULES):
+            entry = client.modules.get(module_name)
+            if (not entry or entry.get("lazy") or module_name in _IN_FLIGHT
+                    or now - _LAST_USED.get(module_name, now) < ttl):
+                continue
+            analysis = await asyncio.to_thread(analyze_module, module_name)
+            if not _can_load_lazily(module_name, analysis):
+                LAZY_MODULES.discard(module_name)
+                continue
+            # Пока шёл анализ, модуль могли вызвать
+            if module_name in _IN_FLIGHT or time.monotonic() - _LAST_USED.get(module_name, 0) < ttl:
+                continue
+            await unload_module(client, module_name)
+            register_lazy_module(client, module_name, analysis)
+            await _register_module_aliases(client, module_name)
+            logging.info(f"[lazy] {module_name} выгружен после {ttl:.0f} сек простоя")
+
+def _start_lazy_reaper(client):
+    global _lazy_reaper
+    if _lazy_ttl() > 0 and (_lazy_reaper is None or _lazy_reaper.done()):
+        _lazy_reaper = asyncio.create_task(_lazy_reaper_loop(client))
+
 async def register_single_alias(client, alias: str, real_command: str, module_name: str):
     """Регистрирует один алиас. Используется в modules/aliases.py"""
     if module_name not in client.modules: return False
     
-    module_data = client.modules[module_name]
     target_func = None
-    
-    for func, handler in module_data["handlers"]:
-        if getattr(func, "_command_name", None) == real_command:
-            target_func = func
-            handler_args = getattr(func, "_command_kwargs", {}).copy()
-            break
+    for routes in COMMAND_ROUTES.values():
+        for route in routes.get(real_command.lower(), ()):
+            if route["module"] == module_name:
+                target_func = route["func"]
+                handler_args = getattr(target_func, "_command_kwargs", {}).copy()
+                break
+        if target_func: break
     
     if target_func:
-        pattern_text = re.escape(PREFIX) + re.escape(alias) + r"(?:\s+(.*))?$"
-        handler_args["pattern"] = re.compile(pattern_text, re.IGNORECASE | re.DOTALL)
-        
-        new_handler = events.NewMessage(**handler_args)
-        client.add_event_handler(target_func, new_handler)
-        
-        # Добавляем в список хендлеров модуля
-        client.modules[module_name]["handlers"].append((target_func, new_handler))
+        for handler in build_command_handlers(alias, handler_args, escape=True):
+            add_command_route(client, module_name, alias, target_func, handler)
         
         # Добавляем в реестр команд для .help
         if alias not in COMMANDS_REGISTRY: COMMANDS_REGISTRY[alias] = []
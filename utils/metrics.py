@@ -0,0 +1,220 @@
+# utils/metrics.py
+
+import asyncio
+import bisect
+import json
+import math
+import os
+import time
+
+# Метрики команд: число вызовов, ошибки и гистограмма длительности по каждой команде.
+# Пишут обёртки команд (utils.loader.register и compat loader.command) через observe().
+# Все вызовы observe() идут из event loop, поэтому хранилище — обычные dict/list без блокировок:
+# запись метрики стоит пару сложений и один bisect по корзинам.
+#
+# Раз в PERSIST_INTERVAL секунд счётчики сохраняются в настройку command_metrics (накапливаются между
+# перезапусками), а если задана настройка metrics_textfile — ещё и выгружаются туда в текстовом формате
+# Prometheus (для node_exporter textfile collector). Тот же текст отдаёт канал управления:
+#   {"command": "metrics"}
+
+# Верхние границы корзин гистограммы, сек. Последняя (inf) ловит всё остальное.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+PERSIST_INTERVAL = 60
+SETTING_KEY = "command_metrics"
+
+_commands = {}   # {(модуль, команда): {"count", "errors", "sum", "max", "buckets": [...]}}
+_started_at = time.time()
+_loaded = False
+
+def _new_entry() -> dict:
+    return {"count": 0, "errors": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)}
+
+def module_label(func) -> str:
+    """Имя модуля для метрик: modules.ping -> ping, heroku-модули -> heroku:<файл>."""
+    name = getattr(func, "__module__", "") or "?"
+    if name.startswith("modules."):
+        return name[len("modules."):]
+    return f"heroku:{name.rsplit('.', 1)[-1]}"
+
+def observe(module: str, command: str, seconds: float, error: bool = False):
+    """Учитывает один вызов команды."""
+    entry = _commands.get((module, command))
+    if entry is None:
+        entry = _commands[(module, command)] = _new_entry()
+    entry["count"] += 1
+    entry["sum"] += seconds
+    if seconds > entry["max"]:
+        entry["max"] = seconds
+    if error:
+        entry["errors"] += 1
+    entry["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+def _quantile(buckets: list, count: int, q: float) -> float:
+    """Оценка квантиля по гистограмме (линейная интерполяция внутри корзины, как histogram_quantile)."""
+    if not count:
+        return 0.0
+    rank = q * count
+    seen, lower = 0, 0.0
+    for bound, n in zip(BUCKETS, buckets):
+        if n and seen + n >= rank:
+            if math.isinf(bound):
+                return lower
+            return lower + (bound - lower) * (rank - seen) / n
+        seen += n
+        lower = bound if not math.isinf(bound) else lower
+    return lower
+
+def get_command_stats() -> list:
+    """[{"module", "command", "count", "errors", "avg", "max", "p50", "p95", "p99"}], самые нагруженные первыми."""
+    rows = []
+    for (module, command), e in _commands.items():
+        rows.append({
+            "module": module, "command": command,
+            "count": e["count"], "errors": e["errors"],
+            "total": e["sum"], "avg": e["sum"] / e["count"] if e["count"] else 0.0, "max": e["max"],
+            # Интерполяция может «перелететь» реальный максимум внутри широкой корзины
+            "p50": min(_quantile(e["buckets"], e["count"], 0.50), e["max"]),
+            "p95": min(_quantile(e["buckets"], e["count"], 0.95), e["max"]),
+            "p99": min(_quantile(e["buckets"], e["count"], 0.99), e["max"]),
+        })
+    rows.sort(key=lambda r: r["total"], reverse=True)
+    return rows
+
+def get_module_stats() -> list:
+    """Суммы по модулям: [{"module", "count", "errors", "total"}], по убыванию суммарного времени."""
+    modules = {}
+    for (module, _), e in _commands.items():
+        m = modules.setdefault(module, {"module": module, "count": 0, "errors": 0, "total": 0.0})
+        m["count"] += e["count"]
+        m["errors"] += e["errors"]
+        m["total"] += e["sum"]
+    return sorted(modules.values(), key=lambda m: m["total"], reverse=True)
+
+def reset():
+    """Обнуляет метрики (и сохранённую копию)."""
+    global _started_at
+    _commands.clear()
+    _started_at = time.time()
+    save()
+
+# --- СОХРАНЕНИЕ ---
+
+def load():
+    """Подхватывает сохранённые счётчики (один раз за процесс)."""
+    global _loaded, _started_at
+    if _loaded:
+        return
+    _loaded = True
+    from utils import database as db
+    raw = db.get_setting(SETTING_KEY)
+    if not raw:
+        return
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return
+    if data.get("buckets") != [b if not math.isinf(b) else "inf" for b in BUCKETS]:
+        return  # другие границы корзин — старые данные несовместимы
+    _started_at = data.get("started_at", _started_at)
+    for row in data.get("commands", []):
+        entry = _commands.setdefault((row["module"], row["command"]), _new_entry())
+        entry["count"] += row["count"]
+        entry["errors"] += row["errors"]
+        entry["sum"] += row["sum"]
+        entry["max"] = max(entry["max"], row["max"])
+        entry["buckets"] = [a + b for a, b in zip(entry["buckets"], row["buckets"])]
+
+def _snapshot() -> tuple:
+    """Копия счётчиков для записи — снимается в event loop, пока observe() их не трогает."""
+    data = {
+        "started_at": _started_at,
+        "buckets": [b if not math.isinf(b) else "inf" for b in BUCKETS],
+        "commands": [dict(e, module=m, command=c, buckets=list(e["buckets"])) for (m, c), e in _commands.items()],
+    }
+    return json.dumps(data, ensure_ascii=False), render_prometheus()
+
+def _write(raw: str, text: str):
+    from utils import database as db
+    db.set_setting(SETTING_KEY, raw)
+    path = db.get_setting("metrics_textfile")
+    if path:
+        # Атомарная замена: коллектор не должен прочитать наполовину записанный файл
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+def save():
+    """Сохраняет счётчики в БД и, если задан metrics_textfile, выгружает текст Prometheus."""
+    _write(*_snapshot())
+
+async def _persist_loop():
+    while True:
+        await asyncio.sleep(PERSIST_INTERVAL)
+        try:
+            await asyncio.to_thread(_write, *_snapshot())
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить метрики команд: {e}")
+
+def start_persistence() -> asyncio.Task:
+    """Загружает сохранённые метрики и запускает их периодическое сохранение."""
+    load()
+    return asyncio.create_task(_persist_loop())
+
+# --- PROMETHEUS ---
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def render_prometheus() -> str:
+    """Все метрики в текстовом формате Prometheus (exposition format 0.0.4)."""
+    from utils import flood, ratelimit
+
+    lines = [
+        "# HELP koteloader_command_duration_seconds Длительность выполнения команды.",
+        "# TYPE koteloader_command_duration_seconds histogram",
+    ]
+    for (module, command), e in sorted(_commands.items()):
+        labels = f'module="{_escape(module)}",command="{_escape(command)}"'
+        cumulative = 0
+        for bound, n in zip(BUCKETS, e["buckets"]):
+            cumulative += n
+            le = "+Inf" if math.isinf(bound) else repr(bound)
+            lines.append(f'koteloader_command_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"koteloader_command_duration_seconds_sum{{{labels}}} {e['sum']:.6f}")
+        lines.append(f"koteloader_command_duration_seconds_count{{{labels}}} {e['count']}")
+
+    lines += [
+        "# HELP koteloader_command_errors_total Команды, завершившиеся исключением.",
+        "# TYPE koteloader_command_errors_total counter",
+    ]
+    for (module, command), e in sorted(_commands.items()):
+        lines.append(f'koteloader_command_errors_total{{module="{_escape(module)}",command="{_escape(command)}"}} {e["errors"]}')
+
+    lines += [
+        "# HELP koteloader_ratelimit_calls_total Запросы токенов по областям ratelimit.",
+        "# TYPE koteloader_ratelimit_calls_total counter",
+    ]
+    rl = ratelimit.get_stats()
+    for scope, stat in sorted(rl.items()):
+        lines.append(f'koteloader_ratelimit_calls_total{{scope="{_escape(scope)}"}} {stat["calls"]}')
+    lines += [
+        "# HELP koteloader_ratelimit_wait_seconds_total Суммарное ожидание токенов.",
+        "# TYPE koteloader_ratelimit_wait_seconds_total counter",
+    ]
+    for scope, stat in sorted(rl.items()):
+        lines.append(f'koteloader_ratelimit_wait_seconds_total{{scope="{_escape(scope)}"}} {stat["wait_total"]:.6f}')
+
+    fl = flood.get_stats()
+    lines += [
+        "# HELP koteloader_flood_waits_total Полученные FloodWait.",
+        "# TYPE koteloader_flood_waits_total counter",
+        f"koteloader_flood_waits_total {fl['flood_waits']}",
+        "# HELP koteloader_flood_parked_seconds_total Время, проведённое запросами в ожидании FloodWait.",
+        "# TYPE koteloader_flood_parked_seconds_total counter",
+        f"koteloader_flood_parked_seconds_total {fl['parked_seconds']:.6f}",
+        "# HELP koteloader_metrics_start_time_seconds Начало накопления метрик (unix time).",
+        "# TYPE koteloader_metrics_start_time_seconds gauge",
+        f"koteloader_metrics_start_time_seconds {_started_at:.0f}",
+    ]
+    return "\n".join(lines) + "\n"
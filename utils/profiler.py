@@ -0,0 +1,138 @@
+# utils/profiler.py
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Таймлайн загрузки.
+# main() вызывает begin() в самом начале; этапы старта оборачиваются в span(...):
+#   with profiler.span("connect", "clients"): await user_client.connect()
+# Когда все этапы из begin(stages=...) отметились через complete(), таймлайн сохраняется
+# в настройку boot_timeline и запись выключается — загрузки модулей после старта не пишутся.
+# Просмотр — команда .boot, экспорт в Chrome trace (chrome://tracing, ui.perfetto.dev) — to_chrome_trace().
+
+SETTING_KEY = "boot_timeline"
+MAX_SPANS = 5000
+
+_spans = []
+_origin = time.perf_counter()
+_started_at = time.time()
+_active = False
+_pending = set()
+
+def begin(stages=()):
+    """Начинает новый таймлайн. stages — этапы, после завершения которых он сохраняется."""
+    global _origin, _started_at, _active
+    _spans.clear()
+    _pending.clear()
+    _pending.update(stages)
+    _origin = time.perf_counter()
+    _started_at = time.time()
+    _active = True
+
+def is_active() -> bool:
+    return _active
+
+def record(name: str, category: str, start: float, end: float, **args):
+    """Добавляет отрезок [start, end] (time.perf_counter()) в таймлайн."""
+    if not _active or len(_spans) >= MAX_SPANS:
+        return
+    _spans.append({
+        "name": name,
+        "cat": category,
+        "start": round(start - _origin, 6),
+        "dur": round(end - start, 6),
+        "thread": threading.current_thread().name,
+        "args": args,
+    })
+
+@contextmanager
+def span(name: str, category: str = "boot", **args):
+    """Замеряет блок кода. Работает и вокруг await внутри корутины."""
+    if not _active:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, category, started, time.perf_counter(), **args)
+
+def complete(stage: str):
+    """Отмечает этап старта завершённым; после последнего таймлайн сохраняется."""
+    if not _active:
+        return
+    _pending.discard(stage)
+    if not _pending:
+        finish()
+
+def finish() -> dict:
+    """Останавливает запись и сохраняет таймлайн в БД."""
+    global _active
+    timeline = snapshot()
+    _active = False
+    try:
+        from utils import database as db
+        db.set_setting(SETTING_KEY, json.dumps(timeline, ensure_ascii=False))
+    except Exception as e:
+        print(f"⚠️ Не удалось сохранить таймлайн загрузки: {e}")
+    return timeline
+
+def snapshot() -> dict:
+    """Текущий таймлайн: {"started_at", "total", "spans"}."""
+    spans = list(_spans)
+    total = max((s["start"] + s["dur"] for s in spans), default=0.0)
+    return {"started_at": _started_at, "total": round(total, 6), "spans": spans}
+
+def load_timeline() -> dict | None:
+    """Последний сохранённый таймлайн (или текущий, если загрузка ещё идёт)."""
+    if _active:
+        return snapshot()
+    from utils import database as db
+    raw = db.get_setting(SETTING_KEY)
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+def to_chrome_trace(timeline: dict) -> dict:
+    """Chrome Trace Event Format: полные события ("ph": "X"), время в микросекундах."""
+    threads = {}
+    events = []
+    for s in timeline["spans"]:
+        tid = threads.setdefault(s["thread"], len(threads) + 1)
+        events.append({
+            "name": s["name"],
+            "cat": s["cat"],
+            "ph": "X",
+            "ts": int(s["start"] * 1_000_000),
+            "dur": max(1, int(s["dur"] * 1_000_000)),
+            "pid": 1,
+            "tid": tid,
+            "args": s.get("args") or {},
+        })
+    for thread, tid in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread}})
+    events.append({"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "KoteLoader boot"}})
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"started_at": timeline["started_at"]}}
+
+def summarize(timeline: dict, top: int = 10) -> dict:
+    """
+    Сводка для .boot:
+    stages — отрезки категорий clients/core/twins в порядке начала,
+    modules — самые медленные модули (сумма их отрезков по фазам).
+    """
+    stages = sorted((s for s in timeline["spans"] if s["cat"] != "module"), key=lambda s: s["start"])
+    modules = {}
+    for s in timeline["spans"]:
+        if s["cat"] != "module":
+            continue
+        name = s["args"].get("module", "?")
+        entry = modules.setdefault(name, {"total": 0.0, "phases": {}})
+        entry["total"] += s["dur"]
+        entry["phases"][s["name"]] = entry["phases"].get(s["name"], 0.0) + s["dur"]
+    slowest = sorted(modules.items(), key=lambda kv: kv[1]["total"], reverse=True)[:top]
+    return {"total": timeline["total"], "stages": stages, "modules": slowest, "module_count": len(modules)}
@@ -0,0 +1,110 @@
+# utils/ratelimit.py
+
+import asyncio
+import time
+from collections import OrderedDict
+
+# Token bucket: ведро на `burst` токенов, пополняется со скоростью `rate` токенов в секунду.
+# Запрос без свободного токена не отбрасывается, а ждёт своей очереди (FIFO) —
+# всплеск размазывается во времени вместо FloodWait на сотни секунд.
+
+# Лимиты по умолчанию: {область: (rate в сек, burst)}
+# Переопределяются настройкой `ratelimit_<область>` в БД в виде "rate/burst" (например "0.5/3")
+DEFAULT_LIMITS = {
+    "user": (1.0, 5),      # вызовы @loader.ratelimit-команд одним пользователем
+    "command": (2.0, 10),  # вызовы одной @loader.ratelimit-команды всеми вместе
+    "api": (20.0, 30),     # все запросы через SafeClient.__call__
+}
+MAX_BUCKETS = 4096
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        """Берёт токен, при необходимости дожидаясь его. Возвращает время ожидания в секундах."""
+        started = time.monotonic()
+        throttled = self._lock.locked()
+        # Lock держится на время ожидания — так ожидающие обслуживаются строго по очереди
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                throttled = True
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+        return time.monotonic() - started if throttled else 0.0
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst and not self._lock.locked()
+
+_buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()
+_limits = dict(DEFAULT_LIMITS)
+_stats = {}
+_bad_overrides = set()   # некорректные ratelimit_<область>, о которых уже предупредили
+
+def _scope_limits(scope: str) -> tuple:
+    from utils import database as db
+    override = db.get_setting(f"ratelimit_{scope}")
+    if override:
+        try:
+            rate, burst = override.split("/", 1)
+            rate = float(rate)
+            # rate <= 0 (или nan/inf) сломает ожидание в TokenBucket — такой лимит игнорируем
+            if 0 < rate < float("inf"):
+                return rate, max(1, int(burst))
+        except ValueError:
+            pass
+        if (scope, override) not in _bad_overrides:
+            _bad_overrides.add((scope, override))
+            print(f"⚠️ Некорректная настройка ratelimit_{scope}={override!r}, используется лимит по умолчанию")
+    return _limits.get(scope, DEFAULT_LIMITS["api"])
+
+def configure(scope: str, rate: float = None, burst: int = None):
+    """Меняет лимит области. Уже созданные вёдра этой области пересоздаются."""
+    old_rate, old_burst = _limits.get(scope, DEFAULT_LIMITS["api"])
+    if rate is not None and rate <= 0:
+        raise ValueError(f"rate должен быть больше нуля: {rate}")
+    _limits[scope] = (rate or old_rate, burst or old_burst)
+    for key in [k for k in _buckets if k[0] == scope]:
+        del _buckets[key]
+
+def _get_bucket(scope: str, key) -> TokenBucket:
+    bucket_key = (scope, key)
+    bucket = _buckets.get(bucket_key)
+    if bucket is None:
+        bucket = _buckets[bucket_key] = TokenBucket(*_scope_limits(scope))
+        # Вытесняем старые вёдра, которые всё равно полны (их состояние не отличается от нового)
+        if len(_buckets) > MAX_BUCKETS:
+            for old_key in list(_buckets)[:len(_buckets) - MAX_BUCKETS]:
+                if _buckets[old_key].idle:
+                    del _buckets[old_key]
+    else:
+        _buckets.move_to_end(bucket_key)
+    return bucket
+
+async def acquire(scope: str, key=None) -> float:
+    """Ждёт токен в ведре (scope, key) и учитывает результат в статистике."""
+    waited = await _get_bucket(scope, key).acquire()
+    stat = _stats.setdefault(scope, {"calls": 0, "throttled": 0, "wait_total": 0.0, "wait_max": 0.0})
+    stat["calls"] += 1
+    if waited > 0:
+        stat["throttled"] += 1
+        stat["wait_total"] += waited
+        stat["wait_max"] = max(stat["wait_max"], waited)
+    return waited
+
+def get_stats() -> dict:
+    """{область: {"calls", "throttled", "wait_total", "wait_max"}} с момента запуска."""
+    return {scope: dict(stat) for scope, stat in _stats.items()}
@@ -0,0 +1,27 @@
+# utils/restart.py
+
+import os
+import sys
+
+# Перезапуск процесса через os.execv.
+# execv заменяет процесс сразу — finally в main() не выполняется, поэтому всё, что живёт
+# только в памяти (отложенные записи module_storage, метрики команд), нужно сбросить заранее.
+
+def save_state():
+    """Сбрасывает в БД метрики команд и отложенные записи module_storage."""
+    from utils import database as db
+    from utils import metrics
+
+    try:
+        metrics.save()
+    except Exception as e:
+        print(f"⚠️ Не удалось сохранить метрики команд: {e}")
+    flushed = db.flush_module_writes()
+    if flushed:
+        print(f"💾 Сохранено отложенных записей модулей: {flushed}")
+
+def restart_process(save: bool = True):
+    """Перезапускает юзербот. save=False — состояние уже сброшено (например, перед заменой БД)."""
+    if save:
+        save_state()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
@@ -190,7 +190,8 @@ class CustomTelegramClient(TelegramClient):
         if isinstance(request, blocked_types) or req_name in blocked_names:
             raise SecurityError(f"🚫 Безопасность: Запрос {req_name} заблокирован!")
         
-        return await super().__call__(request, *args, **kwargs)
+        from utils import flood
+        return await flood.call(super().__call__, request, *args, **kwargs)
 
 class SafeClient:
     """Wrapper for TelegramClient to block dangerous requests (Legacy support)."""
@@ -219,8 +220,12 @@ class SafeClient:
         req_name = request.__class__.__name__
         if isinstance(request, blocked_types) or req_name in blocked_names:
             raise SecurityError(f"🚫 Безопасность: Запрос {req_name} заблокирован!")
-        
-        return await self._client(request, *args, **kwargs)
+
+        # FloodWait-дедлайны по типу запроса + общий token bucket (см. utils/flood.py)
+        from utils import flood
+        if isinstance(self._client, CustomTelegramClient):
+            return await self._client(request, *args, **kwargs)
+        return await flood.call(self._client, request, *args, **kwargs)
 
 def get_safe_client(client):
     """Оставляет совместимость со старым и новым кодом."""
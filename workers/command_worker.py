@@ -1,10 +1,14 @@
 # workers/command_worker.py
+import os
 import json
 import asyncio
+import logging
 import traceback
 import time
 from pathlib import Path
 from utils import loader
+from utils import profiler
+from utils import metrics
 from services.state_manager import update_state_file
 from services.module_info_cache import cache_modules_info
 from utils import database as db
@@ -20,33 +24,205 @@ except Exception:
     pass
 
 COMMAND_FILE = Path(__file__).parent.parent / "command.json"
+# Локальный канал управления для внешних инструментов (JSON-строка на запрос)
+CONTROL_SOCKET = Path(__file__).parent.parent / "koteloader.sock"
+
+# Сколько ждать, пока воркер возьмёт команду (при старте он сначала грузит все модули)
+COMMAND_TIMEOUT = 30
+
+_command_queue = None
+_user_client = None
+_worker_stopped = False
+
+def _get_queue() -> asyncio.Queue:
+    global _command_queue
+    if _command_queue is None:
+        _command_queue = asyncio.Queue()
+    return _command_queue
+
+def submit_command(command: str, module_name: str, chat_id=None) -> asyncio.Future:
+    """
+    Ставит команду load/unload/reload в очередь воркера.
+    Возвращает future со списком строк отчёта. Если передан chat_id —
+    воркер сам отправит отчёт в этот чат.
+    """
+    future = asyncio.get_running_loop().create_future()
+    _get_queue().put_nowait(({"command": command, "module_name": module_name, "chat_id": chat_id}, future))
+    return future
+
+async def run_command(command: str, module_name: str, chat_id=None) -> list:
+    """
+    Выполняет команду через очередь воркера и ждёт отчёт.
+    Если воркер остановлен или не взял команду за COMMAND_TIMEOUT — выполняет её напрямую.
+    """
+    data = {"command": command, "module_name": module_name, "chat_id": chat_id}
+    if _worker_stopped and _user_client is not None:
+        return await _process_command(_user_client, data)
+
+    future = asyncio.get_running_loop().create_future()
+    _get_queue().put_nowait((data, future))
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), COMMAND_TIMEOUT)
+    except asyncio.TimeoutError:
+        if data.get("taken") or _user_client is None:
+            # Воркер уже выполняет команду — дожидаемся его отчёта
+            return await future
+        future.cancel()
+        print(f"⚠️ Воркер занят, команда '{command} {module_name}' выполняется напрямую")
+        return await _process_command(_user_client, data)
+
+async def _process_command(user_client, data: dict) -> list:
+    command, module_name, chat_id = data.get("command"), data.get("module_name"), data.get("chat_id")
+    if command not in ("load", "unload", "reload") or not module_name:
+        raise ValueError(f"Некорректная команда: {data}")
+
+    if module_name == "all":
+        if command == "load":
+            modules_to_process = loader.get_all_modules()
+        else:
+            modules_to_process = list(user_client.modules.keys())
+    else:
+        modules_to_process = [module_name]
+    
+    report_lines = []
+    for mod in modules_to_process:
+        try:
+            if command == "load":
+                result_text = await loader.load_module(user_client, mod)
+            elif command == "unload":
+                result_text = await loader.unload_module(user_client, mod)
+            elif command == "reload":
+                result_text = await loader.reload_module(user_client, mod)
+            report_lines.append(result_text.get('message', str(result_text)))
+        except Exception as e:
+            report_lines.append(f"<b>Ошибка с модулем {mod}:</b> <code>{e}</code>")
+    
+    update_state_file(user_client)
+
+    if chat_id:
+        # Команда уже выполнена — ошибка отправки отчёта не должна превращать её в ошибку
+        try:
+            await user_client.send_message(
+                chat_id, 
+                f"<b>Отчет о выполнении команды '{command} {module_name}':</b>\n\n" + "\n".join(report_lines), 
+                parse_mode="html"
+            )
+        except Exception as e:
+            print(f"⚠️ Не удалось отправить отчёт о команде '{command} {module_name}': {e}")
+    return report_lines
+
+def _pickup_command_file():
+    """Забирает command.json, оставшийся от внешнего инструмента (старый формат)."""
+    if not COMMAND_FILE.exists():
+        return
+    try:
+        with COMMAND_FILE.open("r") as f:
+            data = json.load(f)
+        if not all([data.get("command"), data.get("module_name"), data.get("chat_id")]):
+            raise ValueError("Некорректные данные в command.json")
+        submit_command(data["command"], data["module_name"], data["chat_id"])
+    except Exception as e:
+        print(f"🔥 Ошибка чтения command.json: {e}")
+    finally:
+        if COMMAND_FILE.exists():
+            COMMAND_FILE.unlink()
+
+async def _handle_control_client(reader, writer):
+    """
+    Один запрос на строку: {"command", "module_name", "chat_id"} -> {"status", "report"}.
+    {"command": "metrics"} -> {"status", "metrics"} — метрики в текстовом формате Prometheus.
+    """
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                data = json.loads(line)
+                if data.get("command") == "metrics":
+                    response = {"status": "ok", "metrics": metrics.render_prometheus()}
+                else:
+                    report = await run_command(data.get("command"), data.get("module_name"), data.get("chat_id"))
+                    response = {"status": "ok", "report": report}
+            except Exception as e:
+                response = {"status": "error", "message": str(e)}
+            writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+            await writer.drain()
+    finally:
+        writer.close()
+
+async def _socket_in_use() -> bool:
+    """Проверяет, слушает ли кто-то CONTROL_SOCKET (например, второй запущенный экземпляр)."""
+    try:
+        _, writer = await asyncio.open_unix_connection(str(CONTROL_SOCKET))
+    except OSError:
+        # ConnectionRefusedError/FileNotFoundError — файл остался от упавшего процесса
+        return False
+    writer.close()
+    return True
+
+async def start_control_socket():
+    """Открывает Unix-сокет управления (если платформа поддерживает и он не выключен)."""
+    if not hasattr(asyncio, "start_unix_server"):
+        return None
+    if db.get_setting("control_socket", default="True") != "True":
+        return None
+    try:
+        if CONTROL_SOCKET.exists():
+            if await _socket_in_use():
+                print(f"⚠️ Канал управления {CONTROL_SOCKET.name} уже занят другим процессом")
+                return None
+            CONTROL_SOCKET.unlink()
+        server = await asyncio.start_unix_server(_handle_control_client, path=str(CONTROL_SOCKET))
+        os.chmod(CONTROL_SOCKET, 0o600)
+        print(f"🔌 Канал управления: {CONTROL_SOCKET.name}")
+        return server
+    except Exception as e:
+        print(f"⚠️ Не удалось открыть канал управления: {e}")
+        return None
 
 async def command_worker(user_client):
-    """Постоянно проверяет command.json и выполняет команды."""
+    """Загружает модули и выполняет команды из очереди по мере поступления."""
+    global _user_client, _worker_stopped
     print("👤 Воркер юзербота запущен.")
+    _user_client = user_client
+    _worker_stopped = False
     user_client.modules = {}
     
-    cache_modules_info()
+    with profiler.span("cache_modules_info", "core"):
+        cache_modules_info()
     
     # --- ЗАГРУЗКА МОДУЛЕЙ ---
     all_modules = loader.get_all_modules()
     print(f"Найдено модулей: {len(all_modules)}")
     
-    for module in all_modules:
-        try:
-            result = await loader.load_module(user_client, module)
-            if result and result.get("status") == "error":
-                print(f"❌ Ошибка загрузки {module}: {result.get('message', '?')}")
-                tb = result.get("traceback")
-                if tb:
-                    print(tb)
-        except Exception:
-            print(f"Ошибка загрузки модуля {module}:\n{traceback.format_exc()}")
+    with profiler.span("load_all_modules", "core", count=len(all_modules)):
+        load_report = await loader.load_all_modules(user_client, all_modules)
+    for module, info in load_report.items():
+        result = info["result"]
+        if result and result.get("status") == "error":
+            print(f"❌ Ошибка загрузки {module}: {result.get('message', '?')}")
+            tb = result.get("traceback")
+            if tb:
+                print(tb)
+        logging.info(f"[boot] {module}: анализ {info['analysis']:.3f} сек, загрузка {info['load']:.3f} сек")
+
+    lazy_count = sum(1 for info in load_report.values() if (info["result"] or {}).get("lazy"))
+    if lazy_count:
+        print(f"💤 Отложено модулей: {lazy_count} (загрузятся при первом обращении)")
+
+    slowest = sorted(load_report.items(), key=lambda kv: kv[1]["analysis"] + kv[1]["load"], reverse=True)[:5]
+    if slowest:
+        print("⏱️ Самые медленные модули: " + ", ".join(
+            f"{m} ({i['analysis'] + i['load']:.2f} сек)" for m, i in slowest
+        ))
     
     # --- РЕГИСТРАЦИЯ АЛИАСОВ ---
-    await loader.register_aliases(user_client)
+    with profiler.span("register_aliases", "core"):
+        await loader.register_aliases(user_client)
             
     update_state_file(user_client)
+    profiler.complete("modules")
     
     # --- ОТПРАВКА ОТЧЕТА О ПЕРЕЗАГРУЗКЕ (Теперь здесь!) ---
     report_chat_id_str = db.get_setting("restart_report_chat_id")
@@ -90,44 +266,32 @@ async def command_worker(user_client):
             db.set_setting("restart_start_time", "")
     # ------------------------------------------------------
 
-    while True:
-        if COMMAND_FILE.exists():
-            try:
-                with COMMAND_FILE.open("r") as f:
-                    data = json.load(f)
-                
-                command, module_name, chat_id = data.get("command"), data.get("module_name"), data.get("chat_id")
-                if not all([command, module_name, chat_id]):
-                    raise ValueError("Некорректные данные в command.json")
-
-                modules_to_process = loader.get_all_modules() if module_name == "all" else [module_name]
-                
-                report_lines = []
-                for mod in modules_to_process:
-                    try:
-                        if command == "load":
-                            result_text = await loader.load_module(user_client, mod)
-                        elif command == "unload":
-                            result_text = await loader.unload_module(user_client, mod)
-                        elif command == "reload":
-                            result_text = await loader.reload_module(user_client, mod)
-                        report_lines.append(result_text.get('message', str(result_text)))
-                    except Exception as e:
-                        report_lines.append(f"<b>Ошибка с модулем {mod}:</b> <code>{e}</code>")
-                
-                await user_client.send_message(
-                    chat_id, 
-                    f"<b>Отчет о выполнении команды '{command} {module_name}':</b>\n\n" + "\n".join(report_lines), 
-                    parse_mode="html"
-                )
-                
-                update_state_file(user_client)
+    queue = _get_queue()
+    _pickup_command_file()
+    control_server = await start_control_socket()
 
+    future = None
+    try:
+        while True:
+            data, future = await queue.get()
+            if future.done():
+                # Вызывающий не дождался и выполнил команду сам
+                continue
+            data["taken"] = True
+            try:
+                report_lines = await _process_command(user_client, data)
+                if not future.done():
+                    future.set_result(report_lines)
             except Exception as e:
                 print(f"🔥 Ошибка в воркере: {e}")
                 traceback.print_exc()
-            finally:
-                if COMMAND_FILE.exists(): 
-                    COMMAND_FILE.unlink()
-        
-        await asyncio.sleep(1)
\ No newline at end of file
+                if not future.done():
+                    future.set_exception(e)
+    finally:
+        _worker_stopped = True
+        if future is not None and not future.done():
+            future.set_exception(RuntimeError("Воркер команд остановлен"))
+        if control_server is not None:
+            control_server.close()
+            if CONTROL_SOCKET.exists():
+                CONTROL_SOCKET.unlink()